@@ -0,0 +1,420 @@
+"""Benchmarks for the marathon poll engine, against a local stand-in for the SE API
+
+Drives real :class:`~semarathon.marathon.Marathon` objects (with participants
+restored from fake user profiles, so no lookups are needed) through poll cycles,
+while the Stack Exchange API is replaced by a local HTTP server that makes each
+polled user gain reputation with a given probability (the event rate). For every
+participants × sites × event rate scenario, it reports the latency percentiles of
+a poll cycle, the number of API requests per cycle, and the memory allocated per
+participant.
+
+Two engines can be measured: ``poll`` (batched :meth:`Marathon.poll` cycles) and
+``profile`` (one :meth:`ScoreUpdate.fetch_updates` per participant, i.e. one
+:meth:`UserProfile.update` request per user profile).
+
+Results can be saved as a named baseline, and later runs compared against it::
+
+    PYTHONPATH=source python -m benchmarks.poll_engine --save-baseline before
+    PYTHONPATH=source python -m benchmarks.poll_engine --compare before
+"""
+
+import argparse
+import contextlib
+import datetime
+import http.server
+import itertools
+import json
+import os
+import random
+import re
+import statistics
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from unittest import mock
+
+import requests
+
+from semarathon import marathon as mth
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+SE_API_URL_PATTERN = re.compile(r"^https?://api\.stackexchange\.com")
+DEFAULT_PARTICIPANTS = (10, 100, 500)
+DEFAULT_SITES = (1, 3)
+DEFAULT_EVENT_RATES = (0.1,)
+DEFAULT_CYCLES = 20
+REPUTATION_CHANGE = 10
+QUOTA_MAX = 10000
+# (no response cache, which would answer repeated queries without reaching the
+# server, and no client-side throttling, which would add sleeps to the cycles)
+API_OPTIONS = {"cache": 0, "impose_throttling": False}
+
+
+class FakeSEApi:
+    """Local HTTP server answering the SE API queries made by poll cycles
+
+    Each time a user is queried, they gain :data:`REPUTATION_CHANGE` points with
+    probability `event_rate`. ``/users/{ids}`` answers with the users' totals, and
+    ``/users/{ids}/reputation`` with their changes after ``fromdate``.
+    """
+
+    PATH_PATTERN = re.compile(r"/[\d.]+/users/(?P<ids>[\d;]+)(?P<detail>/reputation)?")
+
+    def __init__(self, event_rate: float, seed: int = 0):
+        self.event_rate = event_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._clock = int(time.time())
+        self._reputations: Dict[Tuple[str, int], int] = {}
+        self._events: Dict[Tuple[str, int], List[dict]] = {}
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._make_handler()
+        )
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_root(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self) -> "FakeSEApi":
+        self._thread = threading.Thread(
+            name="FakeSEApi", target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def answer(self, path: str, query: Dict[str, List[str]]) -> Optional[dict]:
+        """JSON response to a query (or ``None`` if the path isn't supported)"""
+        match = self.PATH_PATTERN.fullmatch(path)
+        if match is None:
+            return None
+        site = query.get("site", [""])[0]
+        user_ids = [int(user_id) for user_id in match.group("ids").split(";")]
+        with self._lock:
+            self.requests += 1
+            self._clock += 1
+            for user_id in user_ids:
+                if self._random.random() < self.event_rate:
+                    self._add_event((site, user_id))
+            if match.group("detail"):
+                fromdate = int(query.get("fromdate", [0])[0])
+                items = [
+                    event
+                    for user_id in user_ids
+                    for event in self._events.pop((site, user_id), ())
+                    if event["on_date"] > fromdate
+                ]
+            else:
+                items = [self._user(site, user_id) for user_id in user_ids]
+        return {
+            "items": items,
+            "has_more": False,
+            "quota_max": QUOTA_MAX,
+            "quota_remaining": QUOTA_MAX,
+        }
+
+    def _add_event(self, key: Tuple[str, int]):
+        site, user_id = key
+        self._reputations[key] = self._reputations.get(key, 1) + REPUTATION_CHANGE
+        self._events.setdefault(key, []).append(
+            {
+                "user_id": user_id,
+                "post_id": self._clock,
+                "post_type": "answer",
+                "title": "Benchmark post",
+                "link": f"https://{site}/a/{self._clock}",
+                "reputation_change": REPUTATION_CHANGE,
+                "on_date": self._clock,
+            }
+        )
+
+    def _user(self, site: str, user_id: int) -> dict:
+        return {
+            "user_id": user_id,
+            "account_id": user_id,
+            "display_name": f"user{user_id}",
+            "user_type": "registered",
+            "reputation": self._reputations.get((site, user_id), 1),
+            "creation_date": 0,
+            "last_access_date": self._clock,
+            "is_employee": False,
+            "link": f"https://{site}/users/{user_id}",
+            "profile_image": "",
+            "badge_counts": {"bronze": 0, "silver": 0, "gold": 0},
+        }
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keeps connections alive
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                path = urllib.parse.unquote(url.path)  # (e.g. ";" in vectorized ids)
+                response = api.answer(path, urllib.parse.parse_qs(url.query))
+                if response is None:
+                    self.send_error(404)
+                    return
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@contextlib.contextmanager
+def redirect_se_api(api_root: str) -> Iterator[None]:
+    """Send the HTTP requests that Py-StackExchange makes to `api_root` instead
+
+    The API sites are created with :data:`API_OPTIONS` and a placeholder app key.
+    """
+    session = requests.Session()
+    get_api = mth.get_api
+
+    def get(url, *args, **kwargs):
+        return session.get(SE_API_URL_PATTERN.sub(api_root, url), *args, **kwargs)
+
+    def get_benchmark_api(key: str, **kwargs):
+        return get_api(key, **{**API_OPTIONS, **kwargs})
+
+    get_api.cache_clear()
+    try:
+        with mock.patch("requests.get", new=get), mock.patch.object(
+            mth, "get_app_key", return_value="benchmark"
+        ), mock.patch.object(mth, "get_api", new=get_benchmark_api):
+            yield
+    finally:
+        mth.get_api.cache_clear()
+        session.close()
+
+
+class Scenario(NamedTuple):
+    engine: str  # "poll" or "profile"
+    participants: int
+    sites: int
+    event_rate: float
+
+    @property
+    def key(self) -> str:
+        return f"{self.engine}:{self.participants}p:{self.sites}s:{self.event_rate:g}"
+
+
+class Result(NamedTuple):
+    scenario: Scenario
+    cycles: int
+    p50: float  # seconds
+    p90: float
+    p99: float
+    max: float
+    requests_per_cycle: float
+    updates_per_cycle: float
+    memory_per_participant: float  # bytes
+
+
+def pick_sites(count: int) -> List[str]:
+    """API keys of `count` sites (the default marathon sites first)"""
+    others = sorted(set(mth.SITES) - set(mth.DEFAULT_SITES_KEYS))
+    return [*mth.DEFAULT_SITES_KEYS, *others][:count]
+
+
+def make_marathon(participants: int, sites: Sequence[str]) -> mth.Marathon:
+    """A marathon with participants whose user profiles need no lookups"""
+    marathon = mth.Marathon(
+        *sites,
+        duration=datetime.timedelta(days=1),
+        refresh_interval=datetime.timedelta(days=1),  # (cycles are run by hand)
+        ledger_dir=None,
+    )
+    for i in range(participants):
+        user_id = i + 1
+        participant = mth.Participant(marathon, f"user{user_id}", user_id)
+        for site in sites:
+            participant.add_user_profile(
+                mth.Participant.UserProfile.restore(
+                    participant, site, user_id, f"user{user_id}"
+                )
+            )
+        marathon.add_participant(participant)
+    return marathon
+
+
+def _discard_updates():
+    while True:
+        yield
+
+
+def run_cycle(marathon: mth.Marathon, engine: str) -> int:
+    """Run a poll cycle; return the number of participants whose score changed"""
+    if engine == "poll":
+        return sum(1 for _ in marathon.poll())
+    updates = (
+        mth.ScoreUpdate(participant).fetch_updates(marathon.sites)
+        for participant in marathon.participants.values()
+    )
+    return sum(1 for update in updates if update)
+
+
+def run_scenario(scenario: Scenario, cycles: int, seed: int = 0) -> Result:
+    sites = pick_sites(scenario.sites)
+    with FakeSEApi(scenario.event_rate, seed) as api, redirect_se_api(api.api_root):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        marathon = make_marathon(scenario.participants, sites)
+        handler = _discard_updates()
+        next(handler)
+        marathon.start(handler)
+        # every profile is due in every cycle (and nothing is reused from the feed);
+        # cycles run back to back, which no quota would allow, so the marathon is
+        # left out of the quota projections (which would switch it to totals mode)
+        marathon.refresh_interval = datetime.timedelta(0)
+        marathon.max_refresh_interval = datetime.timedelta(0)
+        mth.get_quota_tracker().unregister(marathon)
+        try:
+            run_cycle(marathon, scenario.engine)  # warm-up (e.g. first connections)
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            if api.requests == 0:
+                raise RuntimeError("No requests reached the local SE API stand-in")
+            memory = sum(s.size_diff for s in after.compare_to(before, "filename"))
+
+            requests_before = api.requests
+            latencies, updates = [], 0
+            for cycle in range(cycles):
+                cycle_requests = api.requests
+                start = time.perf_counter()
+                updates += run_cycle(marathon, scenario.engine)
+                latencies.append(time.perf_counter() - start)
+                if api.requests == cycle_requests:
+                    raise RuntimeError(
+                        f"Cycle {cycle} of {scenario.key} didn't reach the local SE "
+                        f"API stand-in (so it didn't measure the poll engine)"
+                    )
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            marathon.stop()
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return Result(
+        scenario,
+        cycles,
+        p50=quantiles[49],
+        p90=quantiles[89],
+        p99=quantiles[98],
+        max=max(latencies),
+        requests_per_cycle=(api.requests - requests_before) / cycles,
+        updates_per_cycle=updates / cycles,
+        memory_per_participant=memory / scenario.participants,
+    )
+
+
+def format_results(
+    results: Sequence[Result], baseline: Optional[Dict[str, dict]] = None
+) -> str:
+    """Table of results (with the change of p50 from the baseline, if given)"""
+    header = (
+        f"{'scenario':<28} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+        f"{'req/cycle':>9} {'upd/cycle':>9} {'KiB/part':>9}"
+    )
+    if baseline is not None:
+        header += f" {'p50 vs base':>12}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        line = (
+            f"{result.scenario.key:<28} {result.p50 * 1000:>9.2f} "
+            f"{result.p90 * 1000:>9.2f} {result.p99 * 1000:>9.2f} "
+            f"{result.max * 1000:>9.2f} {result.requests_per_cycle:>9.1f} "
+            f"{result.updates_per_cycle:>9.1f} "
+            f"{result.memory_per_participant / 1024:>9.2f}"
+        )
+        if baseline is not None:
+            base = baseline.get(result.scenario.key)
+            if base is None:
+                line += f" {'(new)':>12}"
+            else:
+                change = result.p50 / base["p50"] - 1
+                line += f" {change:>+12.1%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _baseline_path(name: str) -> str:
+    return os.path.join(BASELINES_DIR, f"{name}.json")
+
+
+def save_baseline(name: str, results: Sequence[Result]) -> str:
+    """Save results as a named baseline; return the path of the baseline file"""
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    path = _baseline_path(name)
+    data = {
+        result.scenario.key: {
+            **{field: getattr(result, field) for field in Result._fields[1:]},
+            "scenario": result.scenario._asdict(),
+        }
+        for result in results
+    }
+    with open(path, "w") as file:
+        json.dump(data, file, indent=2)
+    return path
+
+
+def load_baseline(name: str) -> Dict[str, dict]:
+    with open(_baseline_path(name)) as file:
+        return json.load(file)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark marathon poll cycles against a local fake SE API"
+    )
+    parser.add_argument(
+        "--engine", nargs="+", choices=("poll", "profile"), default=["poll"]
+    )
+    parser.add_argument(
+        "--participants", nargs="+", type=int, default=DEFAULT_PARTICIPANTS
+    )
+    parser.add_argument("--sites", nargs="+", type=int, default=DEFAULT_SITES)
+    parser.add_argument(
+        "--event-rate",
+        nargs="+",
+        type=float,
+        default=DEFAULT_EVENT_RATES,
+        help="probability that a user gains reputation each time they're queried",
+    )
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME", help="baseline to compare with")
+    args = parser.parse_args(argv)
+    if args.cycles < 2:
+        parser.error("--cycles must be at least 2 (to compute percentiles)")
+
+    baseline = load_baseline(args.compare) if args.compare else None
+    results = []
+    for engine, participants, sites, event_rate in itertools.product(
+        args.engine, args.participants, args.sites, args.event_rate
+    ):
+        scenario = Scenario(engine, participants, sites, event_rate)
+        results.append(run_scenario(scenario, args.cycles, args.seed))
+        print(f"done: {scenario.key}", flush=True)
+    print(format_results(results, baseline))
+    if args.save_baseline:
+        print(f"Saved baseline to {save_baseline(args.save_baseline, results)}")
+
+
+if __name__ == "__main__":
+    main()
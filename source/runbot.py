@@ -3,8 +3,18 @@ import atexit
 import functools
 import logging
 import re
+import secrets
+import signal
+import threading
+import urllib.parse
+from typing import Optional
 
-from semarathon.utils import Text
+from semarathon.utils import PhaseTimer, Text
+
+OUTBOX_FLUSH_TIMEOUT = 10  # seconds
+
+_shutdown_lock = threading.Lock()
+_shut_down = False
 
 
 def start_bot(bot_system):
@@ -14,8 +24,60 @@ def start_bot(bot_system):
     logging.info("Bot online")
 
 
-def shutdown_bot(bot_system):
+def start_bot_webhook(bot_system, url: str, listen: str, port: int):
+    """Start the bot in webhook mode (Telegram pushes updates to `url`)
+
+    :param bot_system: the bot system to start
+    :param url: public URL of the webhook (e.g. behind a reverse proxy that
+                forwards to `listen`:`port`)
+    :param listen: address on which the embedded HTTP server listens
+    :param port: port on which the embedded HTTP server listens
+
+    :return: the webhook server
+    """
+    from semarathon.webhook import ALLOWED_UPDATES, WebhookServer
+
+    logging.info("Starting bot (webhook mode)")
+    secret_token = secrets.token_urlsafe(32)
+    path = urllib.parse.urlsplit(url).path or "/"
+    server = WebhookServer(bot_system.dispatcher, secret_token, (listen, port), path)
+    atexit.register(functools.partial(shutdown_bot, bot_system, server))
+    server.start()
+    bot_system.job_queue.start()
+    bot_system.bot.set_webhook(
+        url, allowed_updates=ALLOWED_UPDATES, secret_token=secret_token
+    )
+    logging.info("Bot online")
+    return server
+
+
+def wait_for_interrupt():
+    """Block until the process receives SIGINT or SIGTERM
+
+    (:meth:`telegram.ext.Updater.idle` exits the process right away if the updater
+    isn't polling, so it can't be used in webhook mode.)
+    """
+    interrupted = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: interrupted.set())
+    while not interrupted.wait(timeout=1):
+        pass
+
+
+def shutdown_bot(bot_system, webhook_server=None):
+    """Stop the bot, suspending every session (only the first call has any effect)
+
+    Called at the end of :func:`main`, and also registered with :mod:`atexit` in
+    case the process exits some other way.
+    """
+    global _shut_down
+    with _shutdown_lock:
+        if _shut_down:
+            return
+        _shut_down = True
     logging.info("Shutting down bot")
+    if webhook_server is not None:
+        webhook_server.stop()
     bot_system.updater.stop()
     sessions = bot_system.sessions
     for chat_id, session in sessions.copy().items():
@@ -23,7 +85,12 @@ def shutdown_bot(bot_system):
         session.send_message(
             "SERVER SHUTDOWN – Going to sleep with the fishes...", parse_mode=None
         )
-        session._shutdown(message=False)
+        session.suspend()
+    from semarathon.marathon import get_association_cache
+
+    get_association_cache().flush()
+    if not bot_system.outbox.flush(timeout=OUTBOX_FLUSH_TIMEOUT):
+        logging.warning(f"Exiting with {bot_system.outbox.depth} messages unsent")
 
 
 def setup_logging(level):
@@ -57,22 +124,45 @@ def setup_logging(level):
     root.addHandler(handler)
 
 
-def construct_bot():
+def construct_bot(startup_timer: Optional[PhaseTimer] = None, live_mode: bool = False):
+    """Construct the bot system (recording the time of each phase in the timer)"""
+    startup_timer = startup_timer or PhaseTimer()
     # noinspection SpellCheckingInspection
     logging.info("Initializing semarathon.bot module")
-    from semarathon.bot import SEMarathonBotSystem
+    with startup_timer.phase("imports"):
+        from semarathon.bot import SEMarathonBotSystem
 
     logging.info("Initializing bot system")
-    return SEMarathonBotSystem(Text.load("token"))
+    return SEMarathonBotSystem(
+        Text.load("token"), live_mode=live_mode, startup_timer=startup_timer
+    )
 
 
-def main(logging_level=logging.INFO):
+def main(
+    logging_level=logging.INFO,
+    webhook_url: Optional[str] = None,
+    listen: str = "0.0.0.0",
+    port: int = 8443,
+    live_mode: bool = False,
+):
     setup_logging(logging_level)
-    se_marathon_bot_system = construct_bot()
-    start_bot(se_marathon_bot_system)
+    startup_timer = PhaseTimer()
+    se_marathon_bot_system = construct_bot(startup_timer, live_mode)
+    webhook_server = None
+    with startup_timer.phase("start"):
+        if webhook_url is None:
+            start_bot(se_marathon_bot_system)
+        else:
+            webhook_server = start_bot_webhook(
+                se_marathon_bot_system, webhook_url, listen, port
+            )
+    logging.info(f"Startup took {startup_timer.summary()}")
     # run bot until interrupted:
-    se_marathon_bot_system.updater.idle()
-    shutdown_bot(se_marathon_bot_system)
+    if webhook_url is None:
+        se_marathon_bot_system.updater.idle()
+    else:
+        wait_for_interrupt()
+    shutdown_bot(se_marathon_bot_system, webhook_server)
 
 
 if __name__ == "__main__":
@@ -80,6 +170,30 @@ if __name__ == "__main__":
         description="Run the server for @SEMarathonBot on Telegram"
     )
     parser.add_argument("--logging-level", "-l", action="store", default=logging.INFO)
+    parser.add_argument(
+        "--webhook",
+        metavar="URL",
+        help="receive updates through a webhook at this public URL "
+        "(instead of polling)",
+    )
+    parser.add_argument(
+        "--listen", default="0.0.0.0", help="address for the webhook server"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8443, help="port for the webhook server"
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="show the status of running marathons in a single pinned message "
+        "that is edited in place (instead of in periodic messages)",
+    )
 
     namespace = parser.parse_args()
-    main(namespace.logging_level)
+    main(
+        namespace.logging_level,
+        namespace.webhook,
+        namespace.listen,
+        namespace.port,
+        namespace.live,
+    )
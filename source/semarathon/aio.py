@@ -0,0 +1,197 @@
+"""asyncio-based variant of the marathon engine
+
+Reputation changes are fetched with non-blocking HTTP requests straight to the
+Stack Exchange API (through :mod:`aiohttp`), so a single event loop can drive many
+marathons with lots of requests in flight at the same time.
+"""
+
+import asyncio
+import datetime
+import itertools
+import logging
+from typing import AsyncIterator, Dict, Generator, Iterable, List, Optional
+
+import aiohttp
+import more_itertools
+import stackexchange as se
+
+from semarathon import marathon as mth
+from semarathon.quota import get_quota_tracker
+
+SE_API_ROOT = "https://api.stackexchange.com/2.2"
+DEFAULT_MAX_CONCURRENCY = 16
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncApiClient:
+    """Minimal non-blocking client for the Stack Exchange API"""
+
+    api_root: str
+
+    def __init__(
+        self,
+        api_root: str = SE_API_ROOT,
+        *,
+        app_key: Optional[str] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ):
+        """Initialise a new client
+
+        :param api_root: root URL of the API (can point to a local stub server)
+        :param app_key: SE app key (defaults to the bot's app key)
+        :param max_concurrency: maximum number of requests in flight at any time
+        """
+        self.api_root = api_root.rstrip("/")
+        self._app_key = mth.get_app_key() if app_key is None else app_key
+        self.max_concurrency = max_concurrency
+        # (both created in the event loop that uses them: on Python < 3.10, a
+        # semaphore created outside of a running loop is bound to another one)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "AsyncApiClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._semaphore = None
+
+    async def get(self, path: str, site_key: str, **params) -> List[dict]:
+        """Fetch all the items of a (possibly paginated) API method
+
+        :param path: path of the API method (e.g. ``users/1;2/reputation``)
+        :param site_key: site API key for the SE site to query
+        :param params: additional query parameters
+
+        :return: the JSON objects in the ``items`` field of every page
+        :raises aiohttp.ClientResponseError: if the API responds with an error
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(raise_for_status=True)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        params = {"site": site_key, "pagesize": 100, **params}
+        if self._app_key:
+            params["key"] = self._app_key
+        items: List[dict] = []
+        for page in itertools.count(1):
+            params["page"] = page
+            async with self._semaphore:
+                async with self._session.get(
+                    f"{self.api_root}/{path}", params=params
+                ) as response:
+                    json_ob = await response.json()
+            if "quota_remaining" in json_ob and "quota_max" in json_ob:
+                get_quota_tracker().observe(
+                    json_ob["quota_remaining"], json_ob["quota_max"]
+                )
+            items.extend(json_ob["items"])
+            if not json_ob.get("has_more"):
+                break
+        return items
+
+    async def fetch_reputation_changes(
+        self, site_key: str, user_ids: Iterable[int], since: datetime.datetime
+    ) -> Dict[int, List[se.RepChange]]:
+        """Asynchronous equivalent of :func:`mth.fetch_reputation_changes`"""
+        site = mth.get_api(site_key)
+        changes: Dict[int, List[se.RepChange]] = {}
+        for user_id in user_ids:
+            changes.setdefault(user_id, [])
+        pages = await asyncio.gather(
+            *(
+                self.get(
+                    f"users/{';'.join(map(str, chunk))}/reputation",
+                    site_key,
+                    fromdate=int(since.timestamp()),
+                )
+                for chunk in more_itertools.chunked(changes, mth.MAX_IDS_PER_REQUEST)
+            )
+        )
+        for items in pages:
+            for item in items:
+                changes[item["user_id"]].append(se.RepChange(item, site))
+        return changes
+
+
+class AsyncMarathon(mth.Marathon):
+    """A marathon whose poll cycles run on an asyncio event loop
+
+    Instead of :meth:`start`, use either ``async for update in marathon.updates()``
+    or ``await marathon.run(handler)``.
+    """
+
+    def __init__(self, *sites: str, client: AsyncApiClient, **kwargs):
+        """Initialise a new marathon
+
+        :param sites: see :class:`semarathon.marathon.Marathon`
+        :param client: client used to query the SE API
+        :param kwargs: see :class:`semarathon.marathon.Marathon`
+        """
+        super().__init__(*sites, **kwargs)
+        self.client = client
+
+    def start(self, handler: Generator[None, mth.ScoreUpdate, None]):
+        raise mth.MarathonRuntimeError(
+            "AsyncMarathon must be started through updates() or run()"
+        )
+
+    async def poll_async(self) -> List[mth.ScoreUpdate]:
+        """Asynchronous equivalent of :meth:`mth.Marathon.poll`"""
+        now = datetime.datetime.now()
+        profiles = self._due_profiles(now)
+        queries = self._poll_queries(profiles)
+        all_changes = await asyncio.gather(
+            *(
+                self.client.fetch_reputation_changes(site, user_ids, since)
+                for site, (user_ids, since) in queries.items()
+            )
+        )
+        changes = dict(zip(queries, all_changes))
+        return self._record_poll(now, profiles, changes)
+
+    async def updates(self) -> AsyncIterator[mth.ScoreUpdate]:
+        """Start the marathon and asynchronously yield updates until it ends"""
+        self._begin()
+        try:
+            interval = self.refresh_interval.total_seconds()
+            while self.is_running:
+                _, remaining = self.elapsed_remaining
+                if remaining.total_seconds() <= interval:
+                    await asyncio.sleep(max(remaining.total_seconds(), 0))
+                    break
+                await asyncio.sleep(interval)
+                if not self.is_running:
+                    break
+                for update in await self.poll_async():
+                    yield update
+        finally:
+            self._end()
+
+    async def run(self, handler: Generator[None, mth.ScoreUpdate, None]):
+        """Run the marathon until it ends, sending updates to a coroutine
+
+        :param handler: coroutine to which updates will be sent (closed at the end)
+        """
+        try:
+            async for update in self.updates():
+                try:
+                    handler.send(update)
+                except Exception as exc:
+                    logger.exception(
+                        "Marathon update handler raised an exception", exc_info=exc
+                    )
+        finally:
+            handler.close()
+
+    def stop(self):
+        if self.is_running:
+            self._end()
+        else:
+            logger.warning("Tried to stop a marathon that isn't running")
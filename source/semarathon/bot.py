@@ -1,20 +1,31 @@
+import concurrent.futures
 import datetime
 import enum
 import functools
+import hashlib
 import inspect
 import itertools
+import json
 import logging
-import time
-from typing import Any, Callable, Generator, List, Optional, TypeVar
+import threading
+from typing import Any, Callable, Generator, Optional, TypeVar
 
 import more_itertools
 import telegram as tg
 import telegram.ext as tge
 from telegram.parsemode import ParseMode
-from telegram.utils.helpers import escape_markdown as escape_md
 
+from semarathon import markdown as md
 from semarathon import marathon as mth
-from semarathon.utils import Decorator, Text, coroutine, format_exception_md
+from semarathon import templates
+from semarathon.digest import Digest, ScoreDigest
+from semarathon.live import LiveMessage
+from semarathon.mailbox import MailboxExecutor
+from semarathon.outbox import Outbox, Priority
+from semarathon.scheduler import get_scheduler
+from semarathon.store import STORE_PATH, SessionStore
+from semarathon.timers import Timer, TimerWheel
+from semarathon.utils import Decorator, PhaseTimer, coroutine, format_exception_md
 
 # logger setup
 logger = logging.getLogger(__name__)
@@ -26,8 +37,42 @@ CommandCallbackMethod = Callable[["BotSession", tg.Update, tge.CallbackContext],
 BotSessionRunnable = Callable[["BotSession"], Any]
 T = TypeVar("T", CommandCallback, CommandCallbackMethod)
 
-# other aliases
-escape_mdv2 = functools.partial(escape_md, version=2)
+# leaderboard
+LEADERBOARD_SIZE = 20  # number of participants shown in leaderboard messages
+
+# score updates
+UPDATE_WINDOW = datetime.timedelta(seconds=30)  # score updates are coalesced over this
+
+# live mode
+LIVE_REFRESH_INTERVAL = datetime.timedelta(seconds=5)
+LIVE_COUNTDOWN_START = datetime.timedelta(minutes=5)  # show seconds from then on
+
+# countdown messages (when not in live mode)
+# (name, time of the first message before the end, interval between messages)
+COUNTDOWNS = (
+    ("minute countdown", datetime.timedelta(minutes=5), datetime.timedelta(minutes=1)),
+    (
+        "15 seconds countdown",
+        datetime.timedelta(seconds=45),
+        datetime.timedelta(seconds=45),
+    ),
+    (
+        "5 seconds countdown",
+        datetime.timedelta(seconds=5),
+        datetime.timedelta(seconds=1),
+    ),
+)
+
+# commands
+PROGRESS_EDIT_INTERVAL = 1.0  # seconds
+
+# end of marathon
+WINNER_REVEAL_DELAY = 1.0  # seconds
+SUSPEND_TIMEOUT = 10.0  # seconds
+
+# inline queries
+INLINE_QUERY_RESULTS = 10
+INLINE_QUERY_CACHE_TIME = 3600  # seconds (the site catalog rarely changes)
 
 
 # ------------------------------- Decorators  -------------------------------
@@ -51,7 +96,9 @@ def _make_command_handler(
     Constructs a :class:`telegram.ext.CommandHandler` with a decorated version of
     the given callback. If ``command`` is not specified it defaults to the callback
     function's name. The callback is decorated with an exception handler and some
-    logging business.
+    logging business, and is run off the dispatcher thread, on the bot system's
+    :class:`~semarathon.mailbox.MailboxExecutor` (so commands in the same chat are
+    run one at a time, in order).
 
     :param callback: original callback for the command
     :param command: see :func:`cmdhandler`
@@ -66,8 +113,12 @@ def _make_command_handler(
 
     @functools.wraps(callback)
     def decorated(update: tg.Update, context: tge.CallbackContext):
+        chat_id = update.effective_chat.id
+        logger.info(f"reached /{command}@{chat_id}")
+        _get_bot_system(context).commands.submit(chat_id, run, update, context)
+
+    def run(update: tg.Update, context: tge.CallbackContext):
         command_info = f"/{command}@{update.effective_chat.id}"
-        logger.info(f"reached {command_info}")
         try:
             bot_system = _get_bot_system(context)
 
@@ -84,14 +135,14 @@ def _make_command_handler(
             logger.info(f"served {command_info}")
         except (UsageError, ValueError, mth.SEMarathonError) as e:
             text = (
-                f"{Text.load('usage-error')}\n{format_exception_md(e)}\n\n"
-                f"{escape_mdv2(getattr(e, 'help_txt', 'See /info for usage info'))}"
+                f"{templates.text('usage-error')}\n{format_exception_md(e)}\n\n"
+                f"{md.escape(getattr(e, 'help_txt', 'See /info for usage info'))}"
             )
-            markdown_safe_send(context.bot, update.effective_chat.id, text)
+            _send_reply(context, update.effective_chat.id, text)
             logger.info(f"served {command_info} (with usage/algorithm error)")
         except Exception as e:
-            text = f"{Text.load('internal-error')}"
-            markdown_safe_send(context.bot, update.effective_chat.id, text)
+            text = templates.text("internal-error")
+            _send_reply(context, update.effective_chat.id, text)
             logger.exception(f"{command_info}: unexpected exception", exc_info=e)
         finally:
             logger.debug(f"exiting {command_info}")
@@ -231,22 +282,71 @@ class SEMarathonBotSystem:
     updater: tge.Updater
     dispatcher: tge.Dispatcher
     job_queue: tge.JobQueue
-
-    def __init__(self, token: str, **kwargs):
+    store: SessionStore
+    outbox: Outbox
+    commands: MailboxExecutor
+    timers: TimerWheel
+    update_window: datetime.timedelta
+    live_mode: bool
+
+    def __init__(
+        self,
+        token: str,
+        store_path: str = STORE_PATH,
+        update_window: datetime.timedelta = UPDATE_WINDOW,
+        live_mode: bool = False,
+        startup_timer: Optional[PhaseTimer] = None,
+        **kwargs,
+    ):
         """
         Initialize a new bot instance and bind it to a certain bot username.
 
-        Arguments are the same as for :class:`telegram.ext.Updater` with the exception
-        of use_context, which is automatically set to ``True`` (and cannot be changed).
+        Sessions saved by a previous instance (in the store at ``store_path``) are
+        restored, and their running marathons resumed. Score updates are announced
+        in a single message per chat for every ``update_window``. In live mode (off
+        by default), the status, leaderboard and countdown of a running marathon
+        are shown in a single pinned message that is edited in place, instead of in
+        periodic messages.
+
+        Startup avoids slow work that isn't needed right away: the command list is
+        only sent to Telegram if it changed since the last start, and the site
+        search index is built in the background. The time taken by each phase is
+        recorded in ``startup_timer`` (or a new :class:`PhaseTimer`).
+
+        Other arguments are the same as for :class:`telegram.ext.Updater` with the
+        exception of use_context, which is automatically set to ``True`` (and cannot
+        be changed).
         """
 
-        self.updater = tge.Updater(token, use_context=True, **kwargs)
-        self.bot = self.updater.bot
-        self.dispatcher = self.updater.dispatcher
-        self.job_queue = self.updater.job_queue
-
-        self._setup_handlers()
+        self.startup_timer = timer = startup_timer or PhaseTimer()
+        with timer.phase("templates"):
+            templates.load_templates()  # fails right away if a template is missing
+        with timer.phase("updater"):
+            self.updater = tge.Updater(token, use_context=True, **kwargs)
+            self.bot = self.updater.bot
+            self.dispatcher = self.updater.dispatcher
+            self.job_queue = self.updater.job_queue
+        with timer.phase("store"):
+            self.store = SessionStore(store_path)
+        self.outbox = Outbox()
+        self.commands = MailboxExecutor()
+        self.timers = TimerWheel()
+        self.timers.start()
+        self.update_window = update_window
+        self.live_mode = live_mode
+        self._token_id = token.split(":", 1)[0]  # the bot's user id
+
+        with timer.phase("handlers"):
+            self._setup_handlers()
+        with timer.phase("commands"):
+            self._register_commands()
         self.dispatcher.bot_data["bot_system"] = self
+        # builds the site lookup index in the meantime, so that inline queries are fast
+        threading.Thread(
+            name="SiteSearchIndex", target=lambda: mth.SITES.search_index, daemon=True
+        ).start()
+        with timer.phase("sessions"):
+            self._restore_sessions()
 
     @property
     def sessions(self):
@@ -261,7 +361,25 @@ class SEMarathonBotSystem:
     @cmdhandler(callback_type=_CommandCallbackType.FREE_FUNCTION)
     def info(update: tg.Update, context: tge.CallbackContext):
         """General information about this bot and credits"""
-        update.message.reply_markdown_v2(Text.load("info"))
+        update.message.reply_markdown_v2(templates.text("info"))
+
+    # noinspection PyUnusedLocal
+    @staticmethod
+    def inline_site_lookup(update: tg.Update, context: tge.CallbackContext):
+        """Answer inline queries with the SE sites that best match the query"""
+        query = update.inline_query.query
+        results = [
+            tg.InlineQueryResultArticle(
+                id=site.api_site_parameter,
+                title=site.name,
+                description=f"{site.api_site_parameter} – {site.site_url}",
+                input_message_content=tg.InputTextMessageContent(
+                    site.api_site_parameter
+                ),
+            )
+            for site in mth.SITES.search(query, limit=INLINE_QUERY_RESULTS)
+        ]
+        update.inline_query.answer(results, cache_time=INLINE_QUERY_CACHE_TIME)
 
     # noinspection PyUnusedLocal
     @cmdhandler(callback_type=_CommandCallbackType.BOT_SYSTEM_METHOD)
@@ -269,7 +387,7 @@ class SEMarathonBotSystem:
         """Start a session in the current chat (start listening for commands)"""
         chat_id = update.message.chat_id
         session = SEMarathonBotSystem.Session(self, chat_id)
-        update.message.reply_text(text=Text.load("start"))
+        update.message.reply_text(text=templates.text("start"))
         return session
 
     # noinspection PyUnusedLocal
@@ -280,7 +398,8 @@ class SEMarathonBotSystem:
         id: int
         marathon: Optional[mth.Marathon]
         operation: Optional["SEMarathonBotSystem.Session.Operation"]
-        jobs: List[tge.Job]
+        digest: ScoreDigest
+        live_message: Optional[LiveMessage["concurrent.futures.Future[tg.Message]"]]
 
         def __init__(self, bot_system: "SEMarathonBotSystem", chat_id: int):
             """Initialize a new session and attach it to the given chat."""
@@ -288,9 +407,13 @@ class SEMarathonBotSystem:
             self.id = chat_id
             self.marathon = None
             self.operation = None
-            self.jobs = []
+            self.digest = ScoreDigest()
+            self._digest_timer: Optional[Timer] = None
+            self._suspended = False
+            self.live_message = None
 
             self.bot_system.dispatcher.chat_data[chat_id]["session"] = self
+            self.bot_system.store.save_session(chat_id)
 
         class Operation:
             session: "SEMarathonBotSystem.Session"
@@ -319,8 +442,10 @@ class SEMarathonBotSystem:
             self, update: tg.Update, context: tge.CallbackContext
         ) -> mth.Marathon:
             """Create a new marathon"""
-            self.marathon = mth.Marathon()
-            self.send_message(text=Text.load("new-marathon"))
+            self.marathon = mth.Marathon(ledger_key=str(self.id))
+            self.bot_system.store.delete_marathon(self.id)
+            self.bot_system.store.save_marathon(self.id, self.marathon)
+            self.send_message(text=templates.text("new-marathon"))
             return self.marathon
 
         @cmdhandler()
@@ -334,12 +459,16 @@ class SEMarathonBotSystem:
         @marathon_method
         def set_sites(self, update: tg.Update, context: tge.CallbackContext):
             """Set the SE sites to be tracked during the marathon"""
+            progress = self._progress_message()
             self.marathon.clear_sites()
-            for site in context.args:
+            for i, site in enumerate(context.args):
+                progress.update(rf"Setting sites\.\.\. \({i}/{len(context.args)}\)")
                 self.marathon.add_site(site)
+            self.bot_system.store.save_marathon(self.id, self.marathon)
+            for participant in self.marathon.participants.values():
+                self.bot_system.store.save_participant(self.id, participant)
 
-            text = f"Successfully set sites to:\n{self._sites_text()}"
-            self.send_message(text=text)
+            progress.finish(f"Successfully set sites to:\n{self._sites_text()}")
 
         @cmdhandler()
         @marathon_method
@@ -347,21 +476,28 @@ class SEMarathonBotSystem:
             """Add participants to the marathon"""
 
             def lines(p: mth.Participant):
-                yield f"Added *{p.name}* to marathon:"
+                yield f"Added *{md.escape(p.name)}* to marathon:"
                 for site in self.marathon.sites:
                     user = p.user_profiles[site]
                     yield (
-                        rf" \- _{escape_mdv2(mth.SITES[site]['name'])}_ : "
+                        rf" \- _{md.escape(mth.SITES[site].name)}_ : "
                         f"[user ID {user.user_id}]({user.link})"
                     )
-                yield ""
-                yield r"Please verify the IDs are correct\."
 
-            for name, network_id in more_itertools.pairwise(context.args):
+            # (a single message, edited as the participants' accounts are looked up)
+            progress = self._progress_message(disable_web_page_preview=True)
+            added = []
+            pairs = list(more_itertools.pairwise(context.args))
+            for i, (name, network_id) in enumerate(pairs):
+                adding = rf"Adding *{md.escape(name)}*\.\.\. \({i}/{len(pairs)}\)"
+                progress.update("\n\n".join([*added, adding]))
                 participant = mth.Participant(self.marathon, name, int(network_id))
                 self.marathon.add_participant(participant)
-                text = "\n".join(lines(participant))
-                self.send_message(text=text, disable_web_page_preview=True)
+                self.bot_system.store.save_participant(self.id, participant)
+                added.append("\n".join(lines(participant)))
+            mth.get_association_cache().flush()  # (once for the whole batch)
+            added.append(r"Please verify the IDs are correct\.")
+            progress.finish("\n\n".join(added))
 
         # TODO: remove participant
 
@@ -382,9 +518,10 @@ class SEMarathonBotSystem:
                 self.marathon.duration = duration = datetime.timedelta(
                     hours=hours, minutes=minutes
                 )
+                self.bot_system.store.save_marathon(self.id, self.marathon)
                 self.send_message(
                     rf"Set the duration to "
-                    rf"*{escape_mdv2(str(duration))}* \(_hh:mm:ss_\)"
+                    rf"*{md.escape(str(duration))}* \(_hh:mm:ss_\)"
                 )
             except ValueError:
                 raise ArgValueError("Invalid duration given")
@@ -410,55 +547,112 @@ class SEMarathonBotSystem:
                     raise ArgCountError("Expected one or two arguments")
 
                 date_time = datetime.datetime.combine(day, time_of_day)
-                self.bot_system.job_queue.run_once(
-                    callback=self.start_scheduled_marathon,
-                    when=date_time,
-                    context=self.id,
+                self._schedule_timer(
+                    date_time - datetime.datetime.now(),
+                    self.start_scheduled_marathon,
+                    name="scheduled start",
                 )
                 self.send_message(
-                    f"Scheduled marathon start for *{escape_mdv2(str(date_time))}*"
+                    f"Scheduled marathon start for *{md.escape(str(date_time))}*"
                 )
             except ValueError:
                 raise ArgValueError("Invalid date/time given")
 
         def _start_marathon(self):
             self.marathon.start(handler=self._marathon_update_handler())
+            self.bot_system.store.save_marathon(self.id, self.marathon)
             self.send_message(r"*_Alright, marathon has begun\!_*")
-            self.jobs.append(
-                self.bot_system.job_queue.run_repeating(
-                    name="periodic updates",
-                    callback=self.send_status_update,
-                    interval=self.marathon.duration / 10,
-                    context=self.id,
-                )
+            self._schedule_timers()
+
+        def resume_marathon(self):
+            """Resume a marathon that was interrupted by a restart of the bot"""
+            self.marathon.start(
+                handler=self._marathon_update_handler(),
+                start_time=self.marathon.start_time,
             )
-            self.jobs.append(
-                self.bot_system.job_queue.run_repeating(
-                    name="minute countdown",
-                    callback=self.countdown,
-                    interval=datetime.timedelta(minutes=1),
-                    first=self.marathon.end_time - datetime.timedelta(minutes=5),
-                    context=self.id,
-                )
+            self.send_message(r"_Marathon resumed after a restart of the bot\._")
+            self._schedule_timers()
+
+        def finish_marathon_ended_while_down(self):
+            """Announce the end of a marathon that ended while the bot was down
+
+            (The scores are the ones recorded in the last poll before that.)
+            """
+            self.send_message(
+                r"_The marathon ended while the bot was down; these are the scores "
+                r"as of the last check before that\._",
+                priority=Priority.HIGH,
             )
-            self.jobs.append(
-                self.bot_system.job_queue.run_repeating(
-                    name="15 seconds countdown",
-                    callback=self.countdown,
-                    interval=datetime.timedelta(seconds=45),
-                    first=self.marathon.end_time - datetime.timedelta(seconds=45),
-                    context=self.id,
+            self._marathon_end_handler()
+
+        def _schedule_timers(self):
+            if self.bot_system.live_mode:
+                self.live_message = LiveMessage(
+                    post=self._post_live_message, edit=self._edit_message
                 )
-            )
-            self.jobs.append(
-                self.bot_system.job_queue.run_repeating(
-                    name="5 seconds countdown",
-                    callback=self.countdown,
-                    interval=datetime.timedelta(seconds=1),
-                    first=self.marathon.end_time - datetime.timedelta(seconds=5),
-                    context=self.id,
+                self._schedule_timer(
+                    0,
+                    self.refresh_live_message,
+                    interval=LIVE_REFRESH_INTERVAL,
+                    name="live message",
+                    coalesce=True,
                 )
+                return
+            interval = self.marathon.duration / 10
+            self._schedule_timer(
+                interval,
+                self.send_status_update,
+                interval=interval,
+                name="periodic updates",
             )
+            for name, first, interval in COUNTDOWNS:
+                self._schedule_countdown(name, first, interval)
+
+        def _schedule_countdown(
+            self, name: str, first: datetime.timedelta, interval: datetime.timedelta
+        ):
+            """Schedule a countdown every `interval`, from `first` before the end"""
+            delay = self.marathon.end_time - first - datetime.datetime.now()
+            if delay < datetime.timedelta(0):
+                # (resumed marathon) skips the countdown messages already due
+                delay %= interval
+            self._schedule_timer(delay, self.countdown, interval=interval, name=name)
+
+        def _schedule_timer(
+            self, delay, callback: Callable[[], Any], coalesce: bool = False, **kwargs
+        ) -> Timer:
+            """Schedule a timer whose callback runs in the chat's command mailbox
+
+            So timer callbacks never run concurrently with a command (or with each
+            other) in the same chat: e.g. a scheduled start can't interleave with
+            ``/set_sites``.
+
+            :param delay: see :meth:`TimerWheel.schedule`
+            :param callback: function to call
+            :param coalesce: whether to skip a call if the mailbox already has calls
+                             waiting (for periodic refreshes, which would otherwise
+                             pile up behind a slow command)
+            :param kwargs: see :meth:`TimerWheel.schedule`
+            """
+            commands = self.bot_system.commands
+
+            def submit():
+                if coalesce and commands.pending(self.id):
+                    return
+                self._submit_to_mailbox(callback)
+
+            return self.bot_system.timers.schedule(self.id, delay, submit, **kwargs)
+
+        def _submit_to_mailbox(self, callback: Callable[[], Any]) -> None:
+            """Run a callback in the chat's command mailbox (logging any failure)"""
+
+            def log_failure(future: concurrent.futures.Future):
+                exc = future.exception()
+                if exc is not None:
+                    logger.exception(f"{callback} raised an exception", exc_info=exc)
+
+            future = self.bot_system.commands.submit(self.id, callback)
+            future.add_done_callback(log_failure)
 
         @cmdhandler()
         @require_confirmation(target=_start_marathon)
@@ -482,6 +676,24 @@ class SEMarathonBotSystem:
             """Show the leaderboard"""
             self.send_message(text=self._leaderboard_text())
 
+        @cmdhandler()
+        @marathon_method
+        def rank(self, update: tg.Update, context: tge.CallbackContext):
+            """Show the rank of a participant"""
+            if len(context.args) != 1:
+                raise ArgCountError("Expected one argument (participant name)")
+            name = context.args[0]
+            try:
+                participant = self.marathon.participants[name]
+            except KeyError:
+                raise ArgValueError(f"No participant named {name!r}")
+            leaderboard = self.marathon.leaderboard
+            score = md.escape(str(participant.score))
+            self.send_message(
+                rf"*{md.escape(name)}* is number {leaderboard.rank(participant)} "
+                rf"of {len(leaderboard)} with {score} points"
+            )
+
         @cmdhandler()
         @running_marathon_method
         def time(
@@ -489,7 +701,7 @@ class SEMarathonBotSystem:
         ) -> datetime.timedelta:
             """Time remaining until the end of the marathon"""
             remaining = self.marathon.end_time - datetime.datetime.now()
-            self.send_message(f"*Time remaining:* {escape_mdv2(str(remaining))}")
+            self.send_message(f"*Time remaining:* {md.escape(str(remaining))}")
             return remaining
 
         @cmdhandler()
@@ -508,14 +720,28 @@ class SEMarathonBotSystem:
         def _shutdown(self, message=True):
             if self.marathon is not None:
                 self.marathon.stop()
-            for job in self.bot_system.job_queue.jobs():
-                job.schedule_removal()
+            self.bot_system.timers.cancel_all(self.id)
             del self.bot_system.dispatcher.chat_data[self.id]["session"]
+            self.bot_system.store.delete_session(self.id)
             if message:
                 self.send_message(
                     text="I'm now sleeping. Reactivate with /start.", parse_mode=None
                 )
 
+        def suspend(self):
+            """Stop the session's activity without ending it (e.g. on server shutdown)
+
+            Unlike :meth:`_shutdown`, the session (and its marathon, if running) is
+            kept in the bot system's store, to be restored on the next start.
+            """
+            if self.marathon is not None and self.marathon.is_running:
+                self._suspended = True
+                self.marathon.stop()
+                # lets the update handler flush pending updates before shutdown
+                self.marathon.notifications.join(SUSPEND_TIMEOUT)
+            self.bot_system.timers.cancel_all(self.id)
+            del self.bot_system.dispatcher.chat_data[self.id]["session"]
+
         @cmdhandler()
         @require_confirmation(target=_shutdown)
         def shutdown(self, update: tg.Update, context: tge.CallbackContext):
@@ -544,27 +770,38 @@ class SEMarathonBotSystem:
 
         # ------------------------------- Job callbacks  ----------------------------
 
-        def send_status_update(self, context: tge.CallbackContext):
+        def send_status_update(self):
             text = f"{self._status_text()}\n\n{self._leaderboard_text()}"
-            self.send_message(text)
+            self.send_message(text, priority=Priority.LOW)
 
-        def countdown(self, context: tge.CallbackContext):
+        def countdown(self):
             _, remaining = self.marathon.elapsed_remaining
             seconds = int(remaining.total_seconds())
             minutes = seconds // 60
             fmt = f"{minutes} minutes" if minutes >= 1 else f"{seconds} seconds"
-            self.send_message(f"*{fmt} remaining!*")
+            self.send_message(f"*{fmt} remaining\\!*", priority=Priority.HIGH)
 
-        def start_scheduled_marathon(self, context: tge.CallbackContext):
+        def refresh_live_message(self):
+            if self.marathon.is_running:
+                self.live_message.update(self._live_text())
+
+        def start_scheduled_marathon(self):
             self._start_marathon()
 
+        def send_digest(self, priority: Priority = Priority.NORMAL):
+            digest = self.digest.drain()
+            if digest.deltas or digest.overtakes:
+                self.send_message(self._digest_text(digest), priority=priority)
+                if self.live_message is not None:
+                    self.refresh_live_message()
+
         # ---------------------------- Utility methods  ----------------------------
 
         def check_marathon_created(self) -> None:
             if not self.marathon:
                 raise UsageError(
                     "Marathon not yet created",
-                    help_txt=Text.load("marathon-not-created"),
+                    help_txt=templates.text("marathon-not-created"),
                 )
 
         def check_marathon_running(self) -> None:
@@ -575,17 +812,32 @@ class SEMarathonBotSystem:
             if self.operation is None:
                 raise UsageError("No ongoing operation")
 
-        def send_message(self, text, parse_mode=ParseMode.MARKDOWN_V2, **kwargs):
+        def send_message(
+            self,
+            text,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            priority: Priority = Priority.NORMAL,
+            **kwargs,
+        ) -> "concurrent.futures.Future[tg.Message]":
             """Send a message to the chat to which this session is associated
 
+            The message is queued on the bot system's :class:`Outbox`, which sends
+            it as soon as Telegram's rate limits allow.
+
             :param text: text to send in the message
             :param parse_mode: parse mode to use. If the `text` parameter has a
                                ``parse_mode`` attribute, that is used instead and this
                                parameter is ignored.
+            :param priority: priority of the message in the outbox
+
+            :return: a future with the sent message
             """
             if hasattr(text, "parse_mode"):
                 parse_mode = text.parse_mode
-            return markdown_safe_send(self.bot_system.bot, self.id, text, parse_mode)
+            send = functools.partial(
+                markdown_safe_send, self.bot_system.bot, self.id, text, parse_mode
+            )
+            return self.bot_system.outbox.submit(self.id, send, priority)
 
         def _settings_text(self) -> str:
             def lines():
@@ -599,7 +851,7 @@ class SEMarathonBotSystem:
             def lines():
                 yield "*Sites*:"
                 for site in self.marathon.sites:
-                    site_name_md = escape_mdv2(mth.SITES[site]["name"])
+                    site_name_md = md.escape(mth.SITES[site].name)
                     yield f"\t\\- _{site_name_md}_"
 
             return "\n".join(lines())
@@ -608,64 +860,204 @@ class SEMarathonBotSystem:
             def lines():
                 yield "*Participants*:"
                 for name, participant in self.marathon.participants.items():
-                    yield rf" \- {name} \({participant.network_id}\)"
+                    yield rf" \- {md.escape(name)} \({participant.network_id}\)"
 
             return "\n".join(lines())
 
         def _leaderboard_text(self) -> str:
             def lines():
                 yield "__LEADERBOARD__"
-                participants = self.marathon.participants.values()
-                leaderboard = sorted(participants, key=lambda x: x.score, reverse=True)
-                for i, p in enumerate(leaderboard, 1):
-                    yield rf"{i}\. *{escape_mdv2(str(p))}* – {p.score} points"
+                leaderboard = self.marathon.leaderboard
+                top = leaderboard.top(LEADERBOARD_SIZE)
+                for i, (p, score) in enumerate(top, 1):
+                    score_md = md.escape(str(score))
+                    yield rf"{i}\. *{md.escape(str(p))}* – {score_md} points"
+                if len(leaderboard) > len(top):
+                    yield rf"_\.\.\. and {len(leaderboard) - len(top)} more_"
 
             return "\n".join(lines())
 
-        def _status_text(self) -> str:
+        def _status_text(
+            self, resolution: datetime.timedelta = datetime.timedelta(0)
+        ) -> str:
+            """Status of the marathon, with times rounded down to `resolution`"""
             if self.marathon.is_running:
                 elapsed, remaining = self.marathon.elapsed_remaining
-                return Text.load("running-status").format(
-                    elapsed=escape_mdv2(str(elapsed)),
-                    remaining=escape_mdv2(str(remaining)),
-                )
+                if resolution:
+                    elapsed -= elapsed % resolution
+                    remaining -= remaining % resolution
+                return templates.running_status(elapsed, remaining)
             else:
                 return "Marathon is not running"
 
+        def _live_text(self) -> str:
+            _, remaining = self.marathon.elapsed_remaining
+            if remaining > LIVE_COUNTDOWN_START:
+                resolution = datetime.timedelta(minutes=1)
+            else:
+                resolution = datetime.timedelta(seconds=1)
+            return f"{self._status_text(resolution)}\n\n{self._leaderboard_text()}"
+
+        def _post_live_message(
+            self, text: str
+        ) -> "concurrent.futures.Future[tg.Message]":
+            def post():
+                bot = self.bot_system.bot
+                message = markdown_safe_send(bot, self.id, text)
+                try:
+                    bot.pin_chat_message(
+                        self.id, message.message_id, disable_notification=True
+                    )
+                except tg.error.TelegramError as exc:
+                    logger.warning(f"Couldn't pin live message in {self.id}: {exc}")
+                return message
+
+            return self.bot_system.outbox.submit(self.id, post, Priority.HIGH)
+
+        def _edit_message(
+            self,
+            posted: "concurrent.futures.Future[tg.Message]",
+            text: str,
+            priority: Priority = Priority.LOW,
+            **kwargs,
+        ) -> "concurrent.futures.Future[tg.Message]":
+            """Edit a message sent with :meth:`send_message` (through the outbox)
+
+            The edit is only queued once the message has been sent.
+            """
+
+            def edit(message: tg.Message):
+                return self.bot_system.bot.edit_message_text(
+                    text,
+                    self.id,
+                    message.message_id,
+                    parse_mode=ParseMode.MARKDOWN_V2,
+                    **kwargs,
+                )
+
+            return self.bot_system.outbox.submit_after(posted, self.id, edit, priority)
+
+        def _progress_message(
+            self, **kwargs
+        ) -> LiveMessage["concurrent.futures.Future[tg.Message]"]:
+            """A message that is edited in place to show the progress of a command
+
+            :param kwargs: additional arguments for sending and editing the message
+            """
+            return LiveMessage(
+                post=functools.partial(self.send_message, **kwargs),
+                edit=functools.partial(
+                    self._edit_message, priority=Priority.NORMAL, **kwargs
+                ),
+                min_interval=PROGRESS_EDIT_INTERVAL,
+            )
+
+        def _close_live_message(self):
+            live_message, self.live_message = self.live_message, None
+            if live_message is None or live_message.message is None:
+                return
+            posted = live_message.message
+            text = f"_*Marathon has ended\\!*_\n\n{self._leaderboard_text()}"
+            live_message.finish(text)
+
+            def unpin(message: tg.Message):
+                bot = self.bot_system.bot
+                try:
+                    bot.unpin_chat_message(self.id, message.message_id)
+                except tg.error.TelegramError as exc:
+                    logger.warning(f"Couldn't unpin live message in {self.id}: {exc}")
+
+            self.bot_system.outbox.submit_after(posted, self.id, unpin, Priority.LOW)
+
+        def _digest_text(self, digest: Digest) -> str:
+            sites = digest.sites
+            rows = [["", *sites, "total"]]
+            for participant, per_site in sorted(
+                digest.deltas.items(), key=lambda item: -sum(item[1].values())
+            ):
+                rows.append(
+                    [
+                        str(participant),
+                        *(f"{per_site[s]:+}" if s in per_site else "" for s in sites),
+                        f"{sum(per_site.values()):+}",
+                    ]
+                )
+            widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+            table = "\n".join(
+                "  ".join(
+                    cell.ljust(width) if i == 0 else cell.rjust(width)
+                    for i, (cell, width) in enumerate(zip(row, widths))
+                ).rstrip()
+                for row in rows
+            )
+
+            def lines():
+                yield "__SCORE UPDATES__"
+                if digest.deltas:
+                    yield f"```\n{md.escape(table, entity_type='pre')}\n```"
+                for overtake in digest.overtakes:
+                    yield (
+                        f"*{md.escape(str(overtake.overtaker))}* overtook "
+                        f"*{md.escape(str(overtake.overtaken))}*\\!"
+                    )
+
+            return "\n".join(lines())
+
         @coroutine
         def _marathon_update_handler(self) -> Generator[None, mth.ScoreUpdate, None]:
             try:
                 while True:
                     update = yield
                     logger.debug(f"Received a marathon update for {update.participant}")
-                    per_site = ", ".join(
-                        f" _{mth.SITES[site]['name']}_  ({increment:+})"
-                        for site, increment in update.per_site.items()
-                    )
-                    text = (
-                        f"*{escape_mdv2(str(update.participant))}* just gained "
-                        f"*{update.total:+}* reputation on {per_site}"
+                    if self.digest.add(update):
+                        self._digest_timer = self._schedule_timer(
+                            self.bot_system.update_window,
+                            self.send_digest,
+                            name="score digest",
+                        )
+                    self.bot_system.store.save_progress(
+                        self.id, update.participant.user_profiles.values()
                     )
-                    self.send_message(text)
             except GeneratorExit:
+                if self._suspended:
+                    # the marathon will be resumed when the session is restored
+                    if self._digest_timer is not None:
+                        self._digest_timer.cancel()
+                    self.send_digest(priority=Priority.HIGH)
+                    return
                 # marathon has stopped (either at the scheduled time or prematurely)
                 logger.debug("Notifying chat of end of marathon")
-                self._marathon_end_handler()
+                # (in the chat's mailbox, not to interleave with commands or timers)
+                self._submit_to_mailbox(self._marathon_end_handler)
 
         def _marathon_end_handler(self):
-            for job in self.jobs:
-                job.schedule_removal()
-            self.send_message(r"_*Marathon has ended\!*_")
-            scores = {p: p.score for p in self.marathon.participants.values()}
-            winner, _ = max(scores.items(), key=lambda t: t[1], default=(None, None))
+            self.bot_system.timers.cancel_all(self.id)
+            self.send_digest(priority=Priority.HIGH)
+            self._close_live_message()
+            if self.bot_system.sessions.get(self.id) is self:
+                # (unless the session was shut down, which deletes it from the store)
+                self.bot_system.store.save_marathon(self.id, self.marathon)
+            self.send_message(r"_*Marathon has ended\!*_", priority=Priority.HIGH)
+            winner, _ = next(iter(self.marathon.leaderboard.top(1)), (None, None))
             self._send_winner(winner)
-            self.send_message(self._leaderboard_text())
+            self.send_message(self._leaderboard_text(), priority=Priority.HIGH)
 
         def _send_winner(self, winner):
-            lines = (f"And the winner is\\.\\.\\.", f"🎉🎉 *{winner}* 🎉🎉")
-            message = self.send_message(lines[0])
-            time.sleep(1)
-            message.edit_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN_V2)
+            winner_md = md.escape(str(winner))
+            lines = (r"And the winner is\.\.\.", f"🎉🎉 *{winner_md}* 🎉🎉")
+            posted = self.send_message(lines[0], priority=Priority.HIGH)
+
+            def edit(message: tg.Message):
+                return message.edit_text(
+                    "\n".join(lines), parse_mode=ParseMode.MARKDOWN_V2
+                )
+
+            def reveal():
+                outbox = self.bot_system.outbox
+                outbox.submit_after(posted, self.id, edit, Priority.HIGH)
+
+            # (doesn't block the notification thread while waiting)
+            get_scheduler().call_later(WINNER_REVEAL_DELAY, reveal)
 
     @classmethod
     def _collect_command_callbacks(cls):
@@ -678,6 +1070,19 @@ class SEMarathonBotSystem:
             if hasattr(callback, "command_handler")
         ]
 
+    def _restore_sessions(self):
+        for stored in self.store.load():
+            session = SEMarathonBotSystem.Session(self, stored.chat_id)
+            session.marathon = stored.marathon
+            if not stored.running:
+                continue
+            if stored.marathon.end_time <= datetime.datetime.now():
+                logger.warning(f"Marathon in chat {stored.chat_id} ended while down")
+                session.finish_marathon_ended_while_down()
+                continue
+            logger.info(f"Resuming marathon in chat {stored.chat_id}")
+            session.resume_marathon()
+
     def _setup_handlers(self):
         callbacks = self._collect_command_callbacks()
         for callback in callbacks:
@@ -685,16 +1090,29 @@ class SEMarathonBotSystem:
                 f"Adding command handler for {callback.command_handler.command}"
             )
             self.dispatcher.add_handler(callback.command_handler)
+        self.dispatcher.add_handler(tge.InlineQueryHandler(self.inline_site_lookup))
 
+    def _register_commands(self):
+        """Send the command list to Telegram (unless it's the one sent last time)"""
         cmd_list = [
             callback.command_info
-            for callback in sorted(callbacks, key=lambda c: c.register)
+            for callback in sorted(
+                self._collect_command_callbacks(), key=lambda c: c.register
+            )
             if callback.register
         ]
+        digest = hashlib.sha256(
+            json.dumps([[cmd.command, cmd.description] for cmd in cmd_list]).encode()
+        ).hexdigest()
+        key = f"command-list:{self._token_id}"
+        if self.store.get_value(key) == digest:
+            logger.debug("Command list unchanged; not registering it again")
+            return
         logger.debug(
             f"Registering command list on Telegram: {[cmd.command for cmd in cmd_list]}"
         )
         self.bot.set_my_commands(cmd_list)
+        self.store.set_value(key, digest)
 
 
 # Hide decorators (as they're intended to be used only with the above class)
@@ -744,6 +1162,11 @@ def _get_session(context: tge.CallbackContext) -> SEMarathonBotSystem.Session:
         )
 
 
+def _send_reply(context: tge.CallbackContext, chat_id: int, text: str):
+    send = functools.partial(markdown_safe_send, context.bot, chat_id, text)
+    _get_bot_system(context).outbox.submit(chat_id, send, Priority.HIGH)
+
+
 def markdown_safe_send(
     bot: tg.Bot,
     chat_id: int,
@@ -751,15 +1174,25 @@ def markdown_safe_send(
     parse_mode: tg.ParseMode = ParseMode.MARKDOWN_V2,
 ) -> tg.Message:
     """
-    Tries to reply to ``original_message`` in Markdown; falls back to plain text
-    if it can't be parsed correctly.
+    Sends ``message`` in Markdown; falls back to plain text if it can't be parsed
+    correctly.
+
+    MarkdownV2 markup is validated locally (see :func:`semarathon.markdown.validate`)
+    so that malformed messages are sent as plain text right away, instead of after
+    a failed request. Either way, the escaping backslashes are removed.
     """
-    all_modes = [ParseMode.MARKDOWN_V2, ParseMode.MARKDOWN]
-    modes = all_modes[all_modes.index(parse_mode) :] if parse_mode else []
-    for mode in modes:
+    if parse_mode == ParseMode.MARKDOWN_V2:
         try:
-            return bot.send_message(chat_id, message, parse_mode=mode)
-        except tg.error.BadRequest as exc:
-            logger.exception(f"Failed to parse as {mode}", exc_info=exc)
-            continue
-    return bot.send_message(chat_id, message, parse_mode=None)
+            md.validate(message)
+        except md.MarkdownError as exc:
+            logger.warning(f"Sending as plain text; invalid MarkdownV2: {exc}")
+            message, parse_mode = md.unescape(message), None
+    try:
+        return bot.send_message(chat_id, message, parse_mode=parse_mode)
+    except tg.error.BadRequest as exc:
+        if parse_mode is None:
+            raise
+        logger.warning(f"Failed to parse as {parse_mode} ({exc}); sending as text")
+        if parse_mode == ParseMode.MARKDOWN_V2:
+            message = md.unescape(message)
+        return bot.send_message(chat_id, message, parse_mode=None)
@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, Hashable, List, NamedTuple, TYPE_CHECKING
+
+from semarathon.leaderboard import Overtake
+
+if TYPE_CHECKING:
+    from semarathon.marathon import ScoreUpdate
+
+
+class Digest(NamedTuple):
+    deltas: Dict[Hashable, Dict[str, int]]  # participant -> site -> increment
+    overtakes: List[Overtake]
+
+    @property
+    def sites(self) -> List[str]:
+        """Every site with changes in the digest, in order of first appearance"""
+        sites: Dict[str, None] = {}  # used as an ordered set
+        for per_site in self.deltas.values():
+            sites.update(dict.fromkeys(per_site))
+        return list(sites)
+
+
+class ScoreDigest:
+    """Buffer that coalesces score updates into a single digest
+
+    Increments for the same participant and site are summed, and overtakes that
+    cancel out (A overtakes B, then B overtakes A) are dropped, so that a burst of
+    updates can be announced in one message.
+    """
+
+    def __init__(self):
+        self._deltas: Dict[Hashable, Dict[str, int]] = {}
+        self._overtakes: List[Overtake] = []
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self._deltas or self._overtakes)
+
+    def add(self, update: "ScoreUpdate") -> bool:
+        """Add a score update to the digest
+
+        :return: whether the digest was empty before (i.e. whether this update
+                 starts a new digest)
+        """
+        with self._lock:
+            was_empty = not (self._deltas or self._overtakes)
+            per_site = self._deltas.setdefault(update.participant, {})
+            for site, increment in update.per_site.items():
+                per_site[site] = per_site.get(site, 0) + increment
+            for overtake in update.overtakes:
+                reverse = Overtake(overtake.overtaken, overtake.overtaker)
+                if reverse in self._overtakes:
+                    self._overtakes.remove(reverse)
+                else:
+                    self._overtakes.append(overtake)
+            return was_empty
+
+    def drain(self) -> Digest:
+        """Return the digest of the updates added so far, and empty the buffer"""
+        with self._lock:
+            deltas = {
+                participant: {site: n for site, n in per_site.items() if n}
+                for participant, per_site in self._deltas.items()
+            }
+            digest = Digest(
+                {participant: d for participant, d in deltas.items() if d},
+                self._overtakes,
+            )
+            self._deltas, self._overtakes = {}, []
+            return digest
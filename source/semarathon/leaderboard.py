@@ -0,0 +1,96 @@
+import itertools
+import threading
+from typing import Dict, Generic, Hashable, List, NamedTuple, Optional, Tuple, TypeVar
+
+from sortedcontainers import SortedList
+
+K = TypeVar("K", bound=Hashable)
+
+
+class Overtake(NamedTuple):
+    overtaker: Hashable
+    overtaken: Hashable
+
+
+class Leaderboard(Generic[K]):
+    """Ranking of players by score that is updated in place
+
+    Backed by a sorted container, so that updating a score, querying a rank and
+    slicing the top-K all take logarithmic time (plus K), instead of re-sorting
+    every player on every read. Ties are broken in favour of whoever reached the
+    score first.
+    """
+
+    def __init__(self):
+        self._ranking: "SortedList[Tuple[int, int, K]]" = SortedList()
+        self._entries: Dict[K, Tuple[int, int, K]] = {}
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, player: K) -> bool:
+        return player in self._entries
+
+    def add(self, player: K, score: int = 0) -> None:
+        """Add a player (or reset the score of an existing one)"""
+        with self._lock:
+            self.remove(player)
+            entry = (-score, next(self._counter), player)
+            self._entries[player] = entry
+            self._ranking.add(entry)
+
+    def remove(self, player: K) -> None:
+        with self._lock:
+            entry = self._entries.pop(player, None)
+            if entry is not None:
+                self._ranking.remove(entry)
+
+    def score(self, player: K) -> int:
+        return -self._entries[player][0]
+
+    def rank(self, player: K) -> int:
+        """1-based rank of a player
+
+        :raises KeyError: if the player isn't in the leaderboard
+        """
+        with self._lock:
+            return self._ranking.index(self._entries[player]) + 1
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[K, int]]:
+        """The (at most) `k` best players, with their scores, best first"""
+        with self._lock:
+            return [
+                (player, -negative_score)
+                for negative_score, _, player in self._ranking.islice(0, k)
+            ]
+
+    def update(self, player: K, score: int) -> List[Overtake]:
+        """Set a player's score and return the overtakes caused by the change
+
+        :param player: a player (added to the leaderboard if it isn't already)
+        :param score: the player's new score
+
+        :return: a list of overtakes, in rank order (if `player` moved up, they're
+                 the overtaker in all of them; if they moved down, the overtaken)
+        """
+        with self._lock:
+            if player not in self._entries:
+                self.add(player, score)
+                return []
+            old_entry = self._entries[player]
+            if -score == old_entry[0]:
+                return []  # (keeps the player's place among those tied with them)
+            old_index = self._ranking.index(old_entry)
+            self._ranking.remove(old_entry)
+            new_entry = (-score, next(self._counter), player)
+            self._entries[player] = new_entry
+            self._ranking.add(new_entry)
+            new_index = self._ranking.index(new_entry)
+            if new_index < old_index:
+                passed = self._ranking.islice(new_index + 1, old_index + 1)
+                return [Overtake(player, other) for _, _, other in passed]
+            else:
+                passed = self._ranking.islice(old_index, new_index)
+                return [Overtake(other, player) for _, _, other in passed]
@@ -0,0 +1,206 @@
+"""Append-only ledger of the reputation events seen during a marathon
+
+Events are stored as fixed-size binary records in a memory-mapped file, so that
+appending is cheap and the whole history can be replayed (e.g. to recompute scores
+from scratch, or to aggregate them by site or time window) without querying the
+SE API again. Participant and site names are interned into small integer indexes,
+which are kept in a JSON file alongside the ledger.
+"""
+
+import collections
+import datetime
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Callable, Dict, Hashable, Iterator, List, NamedTuple, Optional
+
+MAGIC = b"SEML"
+VERSION = 1
+HEADER = struct.Struct("<4sIQ")  # magic, version, number of records
+RECORD = struct.Struct("<qiiqi")  # timestamp, participant, site, post id, change
+DEFAULT_CAPACITY = 1024  # initial number of records
+
+
+class LedgerEntry(NamedTuple):
+    timestamp: datetime.datetime
+    participant: str
+    site: str
+    post_id: int
+    change: int
+
+
+class ReputationLedger:
+    """Append-only, memory-mapped log of (timestamp, participant, site, post, change)"""
+
+    path: str
+
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY):
+        """Open the ledger at `path`, creating it if it doesn't exist
+
+        :param path: path of the ledger file
+        :param capacity: initial capacity (in records) for a new ledger file
+        """
+        self.path = path
+        self._names_path = f"{path}.json"
+        self._lock = threading.Lock()
+        self._participants: List[str] = []
+        self._sites: List[str] = []
+        if os.path.exists(path):
+            with open(self._names_path, encoding="utf-8") as file:
+                names = json.load(file)
+            self._participants, self._sites = names["participants"], names["sites"]
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, VERSION, 0))
+                file.truncate(HEADER.size + capacity * RECORD.size)
+            self._save_names()
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, self._count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} isn't a reputation ledger (version {VERSION})")
+        self._participant_ids = {name: i for i, name in enumerate(self._participants)}
+        self._site_ids = {name: i for i, name in enumerate(self._sites)}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[LedgerEntry]:
+        return self.replay()
+
+    def append(
+        self,
+        timestamp: datetime.datetime,
+        participant: str,
+        site: str,
+        post_id: int,
+        change: int,
+    ) -> None:
+        """Append a reputation event to the ledger"""
+        with self._lock:
+            if HEADER.size + (self._count + 1) * RECORD.size > len(self._map):
+                self._grow()
+            record = (
+                int(timestamp.timestamp()),
+                self._intern(participant, self._participants, self._participant_ids),
+                self._intern(site, self._sites, self._site_ids),
+                post_id,
+                change,
+            )
+            offset = HEADER.size + self._count * RECORD.size
+            RECORD.pack_into(self._map, offset, *record)
+            self._count += 1
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, self._count)
+
+    def replay(self) -> Iterator[LedgerEntry]:
+        """Iterate over every event in the ledger, in order of appending"""
+        with self._lock:
+            end = HEADER.size + self._count * RECORD.size
+            data = bytes(self._map[HEADER.size : end])
+            participants, sites = list(self._participants), list(self._sites)
+        for timestamp, participant, site, post_id, change in RECORD.iter_unpack(data):
+            yield LedgerEntry(
+                datetime.datetime.fromtimestamp(timestamp),
+                participants[participant],
+                sites[site],
+                post_id,
+                change,
+            )
+
+    def aggregate(
+        self, key: Callable[[LedgerEntry], Hashable], **filters
+    ) -> Dict[Hashable, int]:
+        """Sum reputation changes grouped by an arbitrary key
+
+        :param key: function that maps each event to the group it belongs to
+        :param filters: see :meth:`select`
+
+        :return: mapping from group to the total change in that group
+        """
+        totals: Dict[Hashable, int] = collections.defaultdict(int)
+        for entry in self.select(**filters):
+            totals[key(entry)] += entry.change
+        return dict(totals)
+
+    def select(
+        self,
+        participant: Optional[str] = None,
+        site: Optional[str] = None,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+    ) -> Iterator[LedgerEntry]:
+        """Replay the events for a given participant, site and/or time range"""
+        for entry in self.replay():
+            if (
+                (participant is None or entry.participant == participant)
+                and (site is None or entry.site == site)
+                and (start is None or entry.timestamp >= start)
+                and (end is None or entry.timestamp < end)
+            ):
+                yield entry
+
+    def scores(self, **filters) -> Dict[str, int]:
+        """Recompute the score of each participant from scratch"""
+        return self.aggregate(lambda entry: entry.participant, **filters)
+
+    def scores_by_site(self, **filters) -> Dict[str, Dict[str, int]]:
+        """Recompute the score of each participant on each site from scratch"""
+        scores: Dict[str, Dict[str, int]] = collections.defaultdict(dict)
+        totals = self.aggregate(
+            lambda entry: (entry.participant, entry.site), **filters
+        )
+        for (participant, site), total in totals.items():
+            scores[participant][site] = total
+        return dict(scores)
+
+    def timeline(
+        self, window: datetime.timedelta, origin: datetime.datetime, **filters
+    ) -> Dict[datetime.datetime, int]:
+        """Total reputation change in consecutive time windows
+
+        :param window: length of each time window
+        :param origin: start of the first window (e.g. the start of the marathon)
+        :param filters: see :meth:`select`
+
+        :return: mapping from the start of each (non-empty) window to its total
+        """
+        return self.aggregate(
+            lambda entry: origin + ((entry.timestamp - origin) // window) * window,
+            **filters,
+        )
+
+    def flush(self) -> None:
+        with self._lock:
+            self._map.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._map.closed:
+                self._map.flush()
+                self._map.close()
+            self._file.close()
+
+    def _intern(self, name: str, names: List[str], ids: Dict[str, int]) -> int:
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+            self._save_names()
+        return ids[name]
+
+    def _save_names(self):
+        names = {"participants": self._participants, "sites": self._sites}
+        temp_path = f"{self._names_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(names, file)
+        os.replace(temp_path, self._names_path)
+
+    def _grow(self):
+        new_size = HEADER.size + 2 * (len(self._map) - HEADER.size)
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(new_size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
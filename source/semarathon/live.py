@@ -0,0 +1,102 @@
+"""Messages that are kept up to date by editing them in place
+
+A :class:`LiveMessage` is posted once and then edited whenever its rendered text
+changes, instead of posting a new message for every status update. Edits with
+unchanged text are skipped (Telegram rejects them anyway), and edits are
+throttled: an update that comes too soon after the previous edit is deferred,
+and only the latest text is sent when the deferred edit runs.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+from semarathon.scheduler import get_scheduler
+
+M = TypeVar("M")  # type of the handle for a posted message
+
+LIVE_EDIT_INTERVAL = 3.0  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class LiveMessage(Generic[M]):
+    """A message that is posted once and then edited in place"""
+
+    def __init__(
+        self,
+        post: Callable[[str], M],
+        edit: Callable[[M, str], Any],
+        min_interval: float = LIVE_EDIT_INTERVAL,
+        call_later: Optional[Callable[[float, Callable[[], None]], Any]] = None,
+    ):
+        """Initialise a live message (without posting it yet)
+
+        :param post: function that posts a message with the given text, and returns
+                     a handle to the posted message
+        :param edit: function that edits a posted message to the given text
+        :param min_interval: minimum interval between edits (in seconds)
+        :param call_later: function used to schedule deferred edits (by default,
+                           :meth:`PollScheduler.call_later` of the process-wide
+                           scheduler)
+        """
+        self._post = post
+        self._edit = edit
+        self.min_interval = min_interval
+        self._call_later = call_later or get_scheduler().call_later
+        self.message: Optional[M] = None
+        self._text: Optional[str] = None  # text currently shown
+        self._pending: Optional[str] = None  # text of the deferred edit (if any)
+        self._last_edit = -float("inf")
+        self._lock = threading.RLock()
+        self.edits = 0
+        self.skipped = 0
+
+    def update(self, text: str) -> None:
+        """Show the given text (posting the message first if needed)
+
+        The edit is skipped if the text hasn't changed, and deferred if the last
+        edit was less than :attr:`min_interval` ago.
+        """
+        with self._lock:
+            if self.message is None:
+                self.message = self._post(text)
+                self._text = text
+                self._last_edit = time.monotonic()
+                return
+            if text == (self._pending or self._text):
+                self.skipped += 1
+                return
+            delay = self._last_edit + self.min_interval - time.monotonic()
+            if delay > 0:
+                if self._pending is None:
+                    self._call_later(delay, self._flush)
+                else:
+                    self.skipped += 1  # supersedes the previous pending text
+                self._pending = text
+                return
+            self._pending = None
+            self._do_edit(text)
+
+    def finish(self, text: str) -> None:
+        """Show the final text right away (regardless of :attr:`min_interval`)"""
+        with self._lock:
+            self.min_interval = 0
+            self.update(text)
+
+    def _flush(self):
+        with self._lock:
+            text, self._pending = self._pending, None
+            if text is not None and text != self._text:
+                self._do_edit(text)
+
+    def _do_edit(self, text: str):
+        try:
+            self._edit(self.message, text)
+        except Exception as exc:
+            logger.warning(f"Couldn't edit live message: {exc}")
+            return
+        self._text = text
+        self._last_edit = time.monotonic()
+        self.edits += 1
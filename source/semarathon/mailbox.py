@@ -0,0 +1,82 @@
+"""Executor that runs tasks in order per key, and concurrently across keys
+
+Bot commands are run off the dispatcher thread, so that a command that makes slow
+network requests (e.g. adding participants) in one chat doesn't hold up commands
+in every other chat. Commands in the same chat must still run one at a time and
+in the order they were received: each key (chat id) has a mailbox of pending
+tasks, and at most one task per mailbox runs at any time, on a shared pool.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import threading
+from typing import Callable, Deque, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_MAX_COMMAND_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+_Task = Tuple[Callable[[], T], "concurrent.futures.Future[T]"]
+
+
+class MailboxExecutor:
+    """Runs tasks on a shared pool, one at a time and in order for each key"""
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_COMMAND_WORKERS,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ):
+        """Initialise a new executor
+
+        :param max_workers: maximum number of tasks (with different keys) running at
+                            once
+        :param executor: executor on which tasks are run (by default, a new pool of
+                         `max_workers` threads)
+        """
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="CommandWorker"
+        )
+        self._mailboxes: Dict[Hashable, Deque[_Task]] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self, key: Hashable, fn: Callable[..., T], *args, **kwargs
+    ) -> "concurrent.futures.Future[T]":
+        """Queue a call to ``fn(*args, **kwargs)`` in the mailbox for `key`
+
+        :return: a future with the result of the call
+        """
+        future: "concurrent.futures.Future[T]" = concurrent.futures.Future()
+        task = (lambda: fn(*args, **kwargs), future)
+        with self._lock:
+            mailbox = self._mailboxes.get(key)
+            if mailbox is not None:  # a task for this key is running
+                mailbox.append(task)
+                return future
+            self._mailboxes[key] = collections.deque()
+        self._executor.submit(self._run, key, task)
+        return future
+
+    def pending(self, key: Hashable) -> int:
+        """Number of tasks for `key` waiting for the running one to finish"""
+        with self._lock:
+            return len(self._mailboxes.get(key, ()))
+
+    def _run(self, key: Hashable, task: _Task):
+        while True:
+            fn, future = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                except BaseException as exc:
+                    future.set_exception(exc)
+            with self._lock:
+                mailbox = self._mailboxes[key]
+                if not mailbox:
+                    del self._mailboxes[key]
+                    return
+                task = mailbox.popleft()
@@ -1,35 +1,60 @@
+import concurrent.futures
 import datetime
+import enum
 import functools
 import json
 import logging
+import math
+import os
 import re
+import threading
+import time
+import weakref
 from typing import (
     Dict,
     Generator,
     Iterable,
     Iterator,
+    List,
     Mapping,
     Optional,
     Sequence,
+    TYPE_CHECKING,
     Tuple,
     Union,
 )
 
-import stackauth
+import more_itertools
 import stackexchange as se
 from multimethod import multimethod
 
-from semarathon.utils import ReadOnlyDictView, Text, TimedStoppableThread
+from semarathon.leaderboard import Leaderboard, Overtake
+from semarathon.ledger import ReputationLedger
+from semarathon.notifications import Backpressure, UpdateQueue
+from semarathon.quota import get_quota_tracker
+from semarathon.scheduler import ScheduledCall, get_scheduler
+from semarathon.sites import ROOT_DIR, SITES
+from semarathon.utils import ReadOnlyDictView, Text
+
+if TYPE_CHECKING:
+    import stackauth
 
-with open("data/SE-Sites.json") as db:
-    SITES = json.load(db)
-SITES_BY_URL = {site["site_url"]: site for site in SITES.values()}
 DEFAULT_SITES_KEYS = ("stackoverflow", "math", "tex")
-SE_APP_KEY = Text.load("se-app-key")
+MAX_IDS_PER_REQUEST = 100  # limit imposed by the SE API on vectorized ids
+ASSOCIATIONS_CACHE_PATH = os.path.join(ROOT_DIR, "data", "cache", "associations.json")
+ASSOCIATIONS_CACHE_TTL = datetime.timedelta(days=7)
+ASSOCIATIONS_MIN_REFRESH = datetime.timedelta(minutes=5)
+ASSOCIATIONS_SAVE_DELAY = datetime.timedelta(seconds=30)
+LEDGER_DIR = os.path.join(ROOT_DIR, "data", "ledgers")
 
 logger = logging.getLogger(__name__)
 
-_stack_auth = stackauth.StackAuth()
+
+class PollMode(enum.Enum):
+    """How poll cycles find out about reputation changes"""
+
+    DETAIL = enum.auto()  # fetch the reputation detail of every user
+    TOTALS = enum.auto()  # fetch total reputations; detail only for those that moved
 
 
 class Participant:
@@ -41,6 +66,7 @@ class Participant:
         self._name = name
         self.network_id = network_id
         self._users: Dict[str, Participant.UserProfile] = {}
+        self._score = 0
 
     def __str__(self):
         return self.name
@@ -53,25 +79,49 @@ class Participant:
         return self._name
 
     @property
-    def score(self):
-        return sum(u.score for u in self._users.values())
+    def score(self) -> int:
+        return self._score
 
     @property
     def user_profiles(self) -> Mapping[str, "Participant.UserProfile"]:
         return ReadOnlyDictView(self._users)
 
+    def add_score(self, increment: int) -> None:
+        """Account for a change in the score of one of the user profiles"""
+        self._score += increment
+
     class UserProfile:
         participant: "Participant"
         site_key: str
         score: int
 
         def __init__(self, participant: "Participant", site_user: se.User):
+            self._init_state(
+                participant,
+                SITES.by_url(site_user.site.domain).api_site_parameter,
+                site_user.id,
+                site_user.display_name,
+            )
+
+        def _init_state(
+            self,
+            participant: "Participant",
+            site_key: str,
+            user_id: int,
+            display_name: str,
+            score: int = 0,
+            last_checked: Optional[datetime.datetime] = None,
+        ) -> None:
+            """Set every attribute (shared by :meth:`__init__` and :meth:`restore`)"""
             self.participant = participant
-            url = _domain_to_url(site_user.site.domain)
-            self.site_key = SITES_BY_URL[url]["api_site_parameter"]
-            self._site_user = site_user
-            self.score = 0
-            self._last_checked: Optional[datetime.datetime] = None
+            self.site_key = site_key
+            self._user_id = user_id
+            self._display_name = display_name
+            self.score = score
+            self._last_checked: Optional[datetime.datetime] = last_checked
+            self._poll_interval: Optional[datetime.timedelta] = None
+            self._next_poll: Optional[datetime.datetime] = None
+            self._reputation: Optional[int] = None
 
         @classmethod
         def from_id(
@@ -115,17 +165,65 @@ class Participant:
                 raise MultipleUsersFoundError(site_key, username, results)
             return Participant.UserProfile(participant, results[0])
 
+        @classmethod
+        def restore(
+            cls,
+            participant: "Participant",
+            site_key: str,
+            user_id: int,
+            display_name: str,
+            score: int = 0,
+            last_checked: Optional[datetime.datetime] = None,
+        ) -> "Participant.UserProfile":
+            """Recreate a UserProfile object from saved state, without querying the API
+
+            :param participant: marathon Participant to which this user profile pertains
+            :param site_key: site API key for the SE site this user pertains to
+            :param user_id: user id for the given site
+            :param display_name: the user's display name
+            :param score: score accumulated so far in the marathon
+            :param last_checked: time up to which reputation changes were accounted for
+
+            :return: a UserProfile object with the given state
+            """
+            profile = cls.__new__(cls)
+            profile._init_state(
+                participant, site_key, user_id, display_name, score, last_checked
+            )
+            return profile
+
         @property
         def user_id(self) -> int:
-            return self._site_user.id
+            return self._user_id
 
         @property
         def display_name(self) -> str:
-            return self._site_user.display_name
+            return self._display_name
 
         @property
         def link(self):
-            return f"https://{self._site_user.site.domain}/users/{self.user_id}/"
+            return f"https://{SITES[self.site_key].domain}/users/{self.user_id}/"
+
+        @property
+        def last_checked(self) -> Optional[datetime.datetime]:
+            """Time of the latest reputation change accounted for (if any)"""
+            return self._last_checked
+
+        @property
+        def watermark(self) -> datetime.datetime:
+            """Time up to which reputation changes have been accounted for
+
+            :raises MarathonRuntimeError: if the marathon isn't running
+            """
+            if not self.participant.marathon.is_running:
+                raise MarathonRuntimeError(
+                    "Tried to check for updates when marathon isn't running"
+                )
+            return self._watermark
+
+        @property
+        def _watermark(self) -> datetime.datetime:
+            return self._last_checked or self.participant.marathon.start_time
 
         def update(self) -> int:
             """Return any score changes since the last time that was checked
@@ -140,26 +238,89 @@ class Participant:
                      `update` or the start of the marathon
             :raises MarathonRuntimeError: if called before the marathon starts
             """
-            marathon = self.participant.marathon
-            if not marathon.is_running:
-                raise MarathonRuntimeError(
-                    "Called update() when marathon isn't running"
-                )
-            last_time = self._last_checked or marathon.start_time
-            updates: Sequence[se.RepChange] = self._site_user.reputation_detail.fetch(
-                fromdate=int(last_time.timestamp())
-            )
-            increment = sum(
-                u.json_ob.reputation_change for u in updates if u.on_date > last_time
+            changes = fetch_reputation_changes(
+                self.site_key, [self.user_id], self.watermark
             )
-            if len(updates) > 0:
-                self._last_checked = updates[0].on_date
+            return self.record_changes(changes[self.user_id])
+
+        @property
+        def reputation(self) -> Optional[int]:
+            """Last total reputation recorded (see :meth:`record_reputation`), if any"""
+            return self._reputation
+
+        def reputation_moved(self, reputation: Optional[int]) -> bool:
+            """Whether a total reputation differs from the last one recorded
+
+            (``True`` if no total had been recorded yet.)
+            """
+            return reputation != self._reputation
+
+        def record_reputation(self, reputation: Optional[int]) -> None:
+            """Record the user's current total reputation
+
+            Should only be called once the changes up to that total have been
+            accounted for (see :meth:`record_changes`); otherwise, changes that
+            failed to be fetched would go unnoticed until the total moves again.
+            """
+            self._reputation = reputation
+
+        def is_due(self, now: datetime.datetime) -> bool:
+            """Whether this user profile should be polled in a cycle at time `now`"""
+            return self._next_poll is None or self._next_poll <= now
+
+        def reschedule(self, now: datetime.datetime, changed: bool) -> None:
+            """Schedule the next poll of this user profile after a poll at `now`
+
+            Active users are polled every :attr:`Marathon.refresh_interval`; each
+            poll without changes doubles the interval for this user, up to
+            :attr:`Marathon.max_refresh_interval`.
+
+            :param now: time of the poll cycle in which this profile was polled
+            :param changed: whether the user's reputation changed since the last poll
+            """
+            marathon = self.participant.marathon
+            if changed or self._poll_interval is None:
+                interval = marathon.refresh_interval
+            else:
+                interval = min(2 * self._poll_interval, marathon.max_refresh_interval)
+            self._poll_interval = interval
+            self._next_poll = now + interval
+
+        def record_changes(self, changes: Iterable[se.RepChange]) -> int:
+            """Account for a set of reputation changes fetched for this user
+
+            Changes that happened before the current :attr:`watermark` are ignored,
+            so the same changes can be safely fed more than once.
+
+            :param changes: reputation changes for this user (in any order)
+            :return: the increment (or decrement) in score due to the new changes
+            """
+            last_time = self.watermark
+            new_changes = [c for c in changes if c.on_date > last_time]
+            increment = sum(c.json_ob.reputation_change for c in new_changes)
+            if new_changes:
+                self._last_checked = max(c.on_date for c in new_changes)
             self.score += increment
+            self.participant.add_score(increment)
+            ledger = self.participant.marathon.ledger
+            if ledger is not None:
+                for change in new_changes:
+                    ledger.append(
+                        change.on_date,
+                        self.participant.name,
+                        self.site_key,
+                        getattr(change.json_ob, "post_id", 0),
+                        change.json_ob.reputation_change,
+                    )
             return increment
 
     @multimethod
     def add_user_profile(self, user_profile) -> None:
+        previous = self._users.get(user_profile.site_key)
+        if previous is not None:
+            self._score -= previous.score
         self._users[user_profile.site_key] = user_profile
+        self._score += user_profile.score
 
     @add_user_profile.register
     def add_user_profile(self, site_key: str, user_id: int) -> None:
@@ -174,22 +335,25 @@ class Participant:
     @add_user_profile.register
     def add_user_profile(self, site_key: str) -> None:
         """Add user by association to the network account"""
-        url = SITES[site_key]["site_url"]
-        results = _stack_auth.associated_from_assoc(self.network_id, only_valid=True)
-        matching = [ua for ua in results if ua.json_ob.site_url == url]
-        assert len(matching) <= 1
-        if not matching:
+        url = SITES[site_key].site_url
+        accounts = get_association_cache().get(self.network_id)
+        if url not in accounts:
+            # the account might have been created after the associations were cached
+            accounts = get_association_cache().get(self.network_id, refresh=True)
+        if url not in accounts:
             raise UserNotFoundError(site_key, f"{self.network_id} (network id)")
-        self.add_user_profile(site_key, matching[0].json_ob.user_id)
+        self.add_user_profile(site_key, accounts[url])
 
 
 class ScoreUpdate:
     participant: Participant
     per_site: Dict[str, int]
+    overtakes: List[Overtake]
 
     def __init__(self, participant):
         self.participant = participant
         self.per_site = {}
+        self.overtakes = []
 
     @property
     def total(self) -> int:
@@ -203,6 +367,13 @@ class ScoreUpdate:
                 self.per_site[site] = increment
         return self
 
+    def merge(self, other: "ScoreUpdate") -> "ScoreUpdate":
+        """Fold a later update for the same participant into this one"""
+        for site, increment in other.per_site.items():
+            self.per_site[site] = self.per_site.get(site, 0) + increment
+        self.overtakes.extend(other.overtakes)
+        return self
+
     def __bool__(self) -> bool:
         return bool(self.per_site)
 
@@ -210,6 +381,8 @@ class ScoreUpdate:
 class Marathon:
     sites: Mapping[str, se.Site]
     participants: Dict[str, Participant]
+    leaderboard: Leaderboard[Participant]
+    ledger: Optional[ReputationLedger]
     duration: datetime.timedelta
     start_time: Optional[datetime.datetime]
     end_time: Optional[datetime.datetime]
@@ -220,25 +393,73 @@ class Marathon:
         *sites: str,
         duration: Union[float, datetime.timedelta] = 4,
         refresh_interval: datetime.timedelta = datetime.timedelta(minutes=5),
+        max_refresh_interval: Optional[datetime.timedelta] = None,
+        poll_mode: PollMode = PollMode.DETAIL,
+        ledger_dir: Optional[str] = LEDGER_DIR,
+        ledger_key: Optional[str] = None,
+        backpressure: Backpressure = Backpressure.COALESCE,
     ):
         """Initialise a new marathon
 
         :param sites: API keys for the SE sites to track
         :param duration: duration of the marathon
+        :param refresh_interval: interval between poll cycles, and minimum interval
+                                 between polls of any given user profile
+        :param max_refresh_interval: maximum interval between polls of an idle user
+                                     profile (by default, the same as
+                                     `refresh_interval`, i.e. no adaptive polling)
+        :param poll_mode: how poll cycles find out about reputation changes (see
+                          :class:`PollMode`)
+        :param ledger_dir: directory in which to keep the ledger of reputation
+                           events seen during the marathon (or ``None`` to not
+                           keep one)
+        :param ledger_key: stable name for the marathon (e.g. the id of its chat);
+                           together with the start time, it names the ledger file,
+                           so that a marathon resumed after a restart reopens its
+                           ledger instead of starting a new one
+        :param backpressure: what to do when updates are produced faster than the
+                             update handler consumes them (see
+                             :class:`~semarathon.notifications.Backpressure`)
         """
         sites = sites or DEFAULT_SITES_KEYS
         self._sites = {key: get_api(key) for key in sites}
         self.participants = {}
+        self.leaderboard = Leaderboard()
         self.duration = duration
         self.start_time = None
         self.end_time = None
         self.refresh_interval = refresh_interval
-        self._poll_thread: Optional[TimedStoppableThread] = None
+        self.max_refresh_interval = max_refresh_interval
+        self.poll_mode = poll_mode
+        self.ledger = None
+        self._ledger_dir = ledger_dir
+        self.ledger_key = ledger_key
+        self.backpressure = backpressure
+        self.notifications: Optional[UpdateQueue] = None
+        self._stop_event: Optional[threading.Event] = None
+        self._lock = threading.RLock()
+        self._scheduled: Dict[str, ScheduledCall] = {}
 
     @property
     def sites(self):
         return ReadOnlyDictView(self._sites)
 
+    @property
+    def max_refresh_interval(self) -> datetime.timedelta:
+        return max(
+            self._max_refresh_interval or self.refresh_interval, self.refresh_interval
+        )
+
+    @max_refresh_interval.setter
+    def max_refresh_interval(self, value: Optional[datetime.timedelta]):
+        self._max_refresh_interval = value
+
+    @property
+    def requests_per_cycle(self) -> int:
+        """Number of API requests made by a poll cycle (at most)"""
+        batches = math.ceil(len(self.participants) / MAX_IDS_PER_REQUEST)
+        return len(self._sites) * batches
+
     @property
     def duration(self):
         return self._duration
@@ -264,90 +485,533 @@ class Marathon:
         now = datetime.datetime.now()
         return now - self.start_time, self.end_time - now
 
+    @property
+    def ledger_path(self) -> Optional[str]:
+        """Path of the marathon's ledger file (``None`` if it doesn't keep one)"""
+        if self._ledger_dir is None or self.start_time is None:
+            return None
+        name = f"{self.start_time:%Y%m%d-%H%M%S-%f}"
+        if self.ledger_key is not None:
+            name = f"{self.ledger_key}-{name}"
+        return os.path.join(self._ledger_dir, f"{name}.ledger")
+
     @property
     def is_running(self) -> bool:
-        if self._poll_thread is None:
-            return False
-        stopped = self._poll_thread.stopped
-        alive = self._poll_thread.is_alive()
-        if not stopped and not alive:
-            raise MarathonRuntimeError(
-                f"{self._poll_thread} died without stopping: {stopped=}, {alive=}"
-            )
-        return alive
+        return self._stop_event is not None and not self._stop_event.is_set()
 
     def add_site(self, site_key: str):
-        self._sites[site_key] = get_api(site_key)
-        for participant in self.participants.values():
-            participant.add_user_profile(site_key)
+        api = get_api(site_key)
+        with self._lock:
+            self._sites[site_key] = api
+            for participant in self.participants.values():
+                participant.add_user_profile(site_key)
 
     def clear_sites(self):
-        self._sites.clear()
+        with self._lock:
+            self._sites.clear()
 
     @multimethod
     def add_participant(self, participant: Participant) -> None:
-        self.participants[participant.name] = participant
+        # (the participant isn't shared yet, so its profiles are looked up unlocked)
         for site in self.sites:
-            participant.add_user_profile(site)
+            if site not in participant.user_profiles:
+                participant.add_user_profile(site)
+        with self._lock:
+            previous = self.participants.get(participant.name)
+            if previous is not None:
+                self.leaderboard.remove(previous)
+            self.participants[participant.name] = participant
+            self.leaderboard.add(participant, participant.score)
 
     @add_participant.register
     def add_participant(self, name: str, network_id: int) -> None:
         self.add_participant(Participant(self, name, network_id))
 
     def poll(self) -> Iterator[ScoreUpdate]:
-        """Lazily yield updates for each participant whose reputation has changed"""
-        for participant in self.participants.values():
-            if update := ScoreUpdate(participant).fetch_updates(self.sites):
-                yield update
-
-    def start(self, handler: Generator[None, ScoreUpdate, None]):
-        """Start the marathon in a separate thread
+        """Yield updates for each participant whose reputation has changed
+
+        Reputation changes are fetched in batches: one request per site for every
+        :data:`MAX_IDS_PER_REQUEST` participants, instead of one request per
+        participant per site. All of the requests of a cycle are made concurrently on
+        the scheduler's shared fetch pool; updates are still yielded in participant
+        order.
+
+        Only user profiles that are due (see
+        :meth:`Participant.UserProfile.reschedule`) are polled. Users that have been
+        polled in the last half refresh interval by another marathon are served from
+        the shared :class:`ReputationFeed` instead.
+
+        In :attr:`PollMode.TOTALS` mode (which is also used whenever the API quota
+        runs short), the reputation detail is only fetched for users whose total
+        reputation has moved. When falling back to it, the totals of users that
+        haven't got one recorded yet are only recorded (instead of fetching their
+        detail as well), so that the fallback never makes more requests than a
+        detail cycle would.
+        """
+        now = datetime.datetime.now()
+        profiles = self._due_profiles(now)
+        reputations = None
+        if self.poll_mode is PollMode.TOTALS:
+            profiles, reputations = self._moved_profiles(now, profiles)
+        elif get_quota_tracker().stretch_factor() > 1:
+            profiles, reputations = self._moved_profiles(
+                now, profiles, record_unknown=True
+            )
+        if not profiles:
+            return
+        queries = self._poll_queries(profiles)
+        changes = get_reputation_feed().fetch(
+            queries, get_scheduler().fetch_pool, max_age=self.refresh_interval / 2
+        )
+        yield from self._record_poll(now, profiles, changes, reputations)
 
-        Creates a new thread that polls the Stack Exchange API
+    def _due_profiles(
+        self, now: datetime.datetime
+    ) -> Dict[str, Dict[str, Participant.UserProfile]]:
+        """User profiles to poll in a cycle at `now`, grouped by site"""
+        profiles = {}
+        for site in self.sites:
+            site_profiles = {
+                name: participant.user_profiles[site]
+                for name, participant in self.participants.items()
+                if participant.user_profiles[site].is_due(now)
+            }
+            if site_profiles:
+                profiles[site] = site_profiles
+        return profiles
+
+    @staticmethod
+    def _moved_profiles(
+        now: datetime.datetime,
+        profiles: Mapping[str, Mapping[str, Participant.UserProfile]],
+        record_unknown: bool = False,
+    ) -> Tuple[
+        Dict[str, Dict[str, Participant.UserProfile]], Dict[str, Dict[int, int]]
+    ]:
+        """Filter the profiles whose total reputation has moved
+
+        Profiles whose reputation hasn't moved are rescheduled as unchanged. The
+        new totals aren't recorded yet: that's left to :meth:`_record_poll`, once
+        the detail of the changes has been fetched.
+
+        :param record_unknown: whether to record the totals of profiles that haven't
+                               got one yet (rescheduling them as unchanged), instead
+                               of counting them as moved (any earlier changes are
+                               still fetched, from the profile's watermark, the
+                               next time its detail is)
+        :return: the moved profiles, and the fetched totals (by site and user id)
+        """
+        queries = {
+            site: [profile.user_id for profile in site_profiles.values()]
+            for site, site_profiles in profiles.items()
+        }
+        reputations = fetch_all_reputations(queries, get_scheduler().fetch_pool)
+        moved = {}
+        for site, site_profiles in profiles.items():
+            site_moved = {}
+            for name, profile in site_profiles.items():
+                reputation = reputations[site].get(profile.user_id)
+                if record_unknown and profile.reputation is None:
+                    profile.record_reputation(reputation)
+                    profile.reschedule(now, changed=False)
+                elif profile.reputation_moved(reputation):
+                    site_moved[name] = profile
+                else:
+                    profile.reschedule(now, changed=False)
+            if site_moved:
+                moved[site] = site_moved
+        return moved, reputations
+
+    def snapshot_reputations(self) -> None:
+        """Record the current total reputation of every user profile
+
+        Uses one batched request per site (per :data:`MAX_IDS_PER_REQUEST` users).
+        """
+        queries = {
+            site: [p.user_profiles[site].user_id for p in self.participants.values()]
+            for site in self.sites
+        }
+        reputations = fetch_all_reputations(queries, get_scheduler().fetch_pool)
+        for site in self.sites:
+            for participant in self.participants.values():
+                profile = participant.user_profiles[site]
+                profile.record_reputation(reputations[site].get(profile.user_id))
+
+    @staticmethod
+    def _poll_queries(
+        profiles: Mapping[str, Mapping[str, Participant.UserProfile]]
+    ) -> Dict[str, Tuple[List[int], datetime.datetime]]:
+        """Arguments for :func:`fetch_all_reputation_changes` for a poll cycle"""
+        return {
+            site: (
+                [profile.user_id for profile in site_profiles.values()],
+                min(profile.watermark for profile in site_profiles.values()),
+            )
+            for site, site_profiles in profiles.items()
+        }
 
-        :param handler: coroutine to which updates will be sent
+    def _record_poll(
+        self,
+        now: datetime.datetime,
+        profiles: Mapping[str, Mapping[str, Participant.UserProfile]],
+        changes: Mapping[str, Mapping[int, Iterable[se.RepChange]]],
+        reputations: Optional[Mapping[str, Mapping[int, int]]] = None,
+    ) -> List[ScoreUpdate]:
+        """Record the changes fetched in a poll cycle and build the score updates
+
+        :param reputations: total reputations fetched in the cycle (if any), by site
+                            and user id; each is recorded once the user's changes
+                            are
         """
-        timeout = self.refresh_interval.total_seconds()
+        updates = {
+            name: ScoreUpdate(participant)
+            for name, participant in self.participants.items()
+        }
+        for site, site_profiles in profiles.items():
+            for name, profile in site_profiles.items():
+                increment = profile.record_changes(changes[site][profile.user_id])
+                if reputations is not None:
+                    profile.record_reputation(reputations[site].get(profile.user_id))
+                profile.reschedule(now, changed=bool(increment))
+                if increment:
+                    updates[name].per_site[site] = increment
+        updates = [update for update in updates.values() if update]
+        for update in updates:
+            participant = update.participant
+            update.overtakes = self.leaderboard.update(participant, participant.score)
+        return updates
+
+    def start(
+        self,
+        handler: Generator[None, ScoreUpdate, None],
+        start_time: Optional[datetime.datetime] = None,
+    ):
+        """Start the marathon
 
-        def run():
-            logger.info("Marathon thread started")
-            while not self._poll_thread.stop_event.wait(timeout=timeout):
-                for update in self.poll():
-                    try:
-                        handler.send(update)
-                    except Exception as exc:
-                        logger.exception(
-                            "Marathon update handler raised an exception", exc_info=exc
-                        )
-            logger.info("Ending marathon thread")
-            handler.close()
+        Poll cycles (which query the Stack Exchange API) and the end of the marathon
+        are scheduled on the process-wide :class:`~semarathon.scheduler.PollScheduler`,
+        so no threads are dedicated to a single marathon. Updates are delivered to
+        the handler through a bounded :class:`~semarathon.notifications.UpdateQueue`,
+        so a slow handler doesn't hold up the poll cycles.
 
-        self._check_all_participants_have_users()
-        self.start_time = datetime.datetime.now()
-        self.end_time = self.start_time + self.duration
-        self._poll_thread = TimedStoppableThread(
-            duration=self.duration, name="MarathonPoll", target=run, daemon=True
+        :param handler: coroutine to which updates will be sent
+        :param start_time: time at which the marathon started, to resume a marathon
+                           that was interrupted (by default, now)
+        """
+        self._begin(start_time)
+        if self.poll_mode is PollMode.TOTALS and start_time is None:
+            # (when resuming, the first cycle fetches the detail for every user, to
+            # catch up with the changes made while the marathon was interrupted)
+            self.snapshot_reputations()
+        self.notifications = UpdateQueue(handler, policy=self.backpressure)
+        scheduler = get_scheduler()
+        self._scheduled["end"] = scheduler.call_later(
+            self.end_time - datetime.datetime.now(), self._finish
         )
-        self._poll_thread.start()
+        self._scheduled["poll"] = scheduler.call_later(
+            self.refresh_interval, self._poll_cycle
+        )
+        logger.info("Marathon started")
 
     def stop(self):
         if self.is_running:
             logger.debug("Stopping marathon")
-            self._poll_thread.stop()
-            self._poll_thread.join()
+            self._finish()
         else:
             logger.warning("Tried to stop a marathon that isn't running")
 
+    def _begin(self, start_time: Optional[datetime.datetime] = None):
+        self._check_all_participants_have_users()
+        self.start_time = start_time or datetime.datetime.now()
+        self.end_time = self.start_time + self.duration
+        self._stop_event = threading.Event()
+        if self._ledger_dir is not None:
+            self.ledger = ReputationLedger(self.ledger_path)
+        get_quota_tracker().register(self)
+        for profile in self._user_profiles():
+            get_reputation_feed().subscribe(profile)
+
+    def _end(self):
+        for profile in self._user_profiles():
+            get_reputation_feed().unsubscribe(profile)
+        self._stop_event.set()
+        get_quota_tracker().unregister(self)
+        if self.ledger is not None:
+            self.ledger.close()
+
+    def _poll_cycle(self):
+        with self._lock:
+            if not self.is_running:
+                return
+            try:
+                for update in self.poll():
+                    if not self.is_running:
+                        break
+                    self.notifications.put(update)
+            except Exception as exc:
+                logger.exception("Marathon poll cycle failed", exc_info=exc)
+            if self.is_running:
+                stretch = get_quota_tracker().stretch_factor()
+                if stretch > 1:
+                    logger.info(f"Stretching poll interval by {stretch:.2f} (quota)")
+                self._scheduled["poll"] = get_scheduler().call_later(
+                    self.refresh_interval * stretch, self._poll_cycle
+                )
+
+    def _finish(self):
+        # waits for any poll cycle in progress to complete
+        with self._lock:
+            if not self.is_running:
+                return
+            self._end()
+            for call in self._scheduled.values():
+                call.cancel()
+            self._scheduled.clear()
+        logger.info("Ending marathon")
+        self.notifications.close()
+
+    def _user_profiles(self) -> Iterator[Participant.UserProfile]:
+        for participant in self.participants.values():
+            yield from participant.user_profiles.values()
+
     def _check_all_participants_have_users(self):
         for participant in self.participants.values():
             for site in self._sites:
                 if site not in participant.user_profiles:
                     raise SEMarathonError(
-                        f"Missing a {SITES[site]['name']} user profile "
+                        f"Missing a {SITES[site].name} user profile "
                         f"for {participant}"
                     )
 
 
+# ---------------------------- Shared fetch layer  ----------------------------
+
+
+class ReputationFeed:
+    """Shared fetch layer for reputation changes, keyed by (site key, user id)
+
+    The same SE user can take part in several marathons at once. Instead of each
+    :class:`Participant.UserProfile` fetching its reputation changes independently,
+    user profiles of running marathons subscribe to this feed, which keeps a buffer
+    of recent reputation events per (site, user) pair. A request is answered from
+    the buffer if it was filled recently enough, so each user's events are fetched
+    once per cycle regardless of how many marathons they play in; every profile
+    then computes its own increment from its own watermark.
+    """
+
+    class _Entry:
+        def __init__(self):
+            self.events: List[se.RepChange] = []
+            self.covered_since: Optional[datetime.datetime] = None
+            self.fetched_at: Optional[datetime.datetime] = None
+            self.subscribers: "weakref.WeakSet[Participant.UserProfile]" = (
+                weakref.WeakSet()
+            )
+
+        def covers(self, since: datetime.datetime, fresh_after: datetime.datetime):
+            return (
+                self.fetched_at is not None
+                and self.fetched_at >= fresh_after
+                and self.covered_since <= since
+            )
+
+        def update(
+            self,
+            since: datetime.datetime,
+            now: datetime.datetime,
+            changes: Iterable[se.RepChange],
+        ):
+            # the API's ``fromdate`` has a resolution of seconds
+            boundary = datetime.datetime.fromtimestamp(int(since.timestamp()))
+            kept = [event for event in self.events if event.on_date < boundary]
+            self.events = kept + list(changes)
+            if self.covered_since is None or self.covered_since > since:
+                self.covered_since = since
+            self.fetched_at = now
+
+        def trim(self):
+            """Forget events that every subscriber has already accounted for"""
+            if not self.subscribers:
+                return
+            low = min(profile._watermark for profile in self.subscribers)
+            self.events = [event for event in self.events if event.on_date > low]
+            self.covered_since = max(self.covered_since, low)
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, int], ReputationFeed._Entry] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, profile: Participant.UserProfile) -> None:
+        with self._lock:
+            key = (profile.site_key, profile.user_id)
+            self._entries.setdefault(key, self._Entry()).subscribers.add(profile)
+
+    def unsubscribe(self, profile: Participant.UserProfile) -> None:
+        with self._lock:
+            key = (profile.site_key, profile.user_id)
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.subscribers.discard(profile)
+            if not entry.subscribers:
+                del self._entries[key]
+
+    def fetch(
+        self,
+        queries: Mapping[str, Tuple[Iterable[int], datetime.datetime]],
+        executor: Optional[concurrent.futures.Executor] = None,
+        max_age: datetime.timedelta = datetime.timedelta(0),
+    ) -> Dict[str, Dict[int, List[se.RepChange]]]:
+        """Same as :func:`fetch_all_reputation_changes`, but shared across marathons
+
+        :param queries: see :func:`fetch_all_reputation_changes`
+        :param executor: see :func:`fetch_all_reputation_changes`
+        :param max_age: maximum age of buffered events to be reused instead of
+                        fetching them again
+
+        :return: see :func:`fetch_all_reputation_changes` (the changes of each user
+                 may include changes before the requested time)
+        """
+        now = datetime.datetime.now()
+        changes: Dict[str, Dict[int, List[se.RepChange]]] = {}
+        stale_queries = {}
+        with self._lock:
+            for site_key, (user_ids, since) in queries.items():
+                site_changes = changes[site_key] = {}
+                stale_ids = []
+                for user_id in user_ids:
+                    entry = self._entries.get((site_key, user_id))
+                    if entry is not None and entry.covers(since, now - max_age):
+                        site_changes[user_id] = list(entry.events)
+                    else:
+                        stale_ids.append(user_id)
+                if stale_ids:
+                    stale_queries[site_key] = (stale_ids, since)
+
+        fetched = fetch_all_reputation_changes(stale_queries, executor)
+        with self._lock:
+            for site_key, site_changes in fetched.items():
+                _, since = stale_queries[site_key]
+                for user_id, user_changes in site_changes.items():
+                    changes[site_key][user_id] = user_changes
+                    entry = self._entries.get((site_key, user_id))
+                    if entry is not None:
+                        entry.update(since, now, user_changes)
+                        entry.trim()
+        return changes
+
+
+@functools.lru_cache(maxsize=None)
+def get_reputation_feed() -> ReputationFeed:
+    """Get the process-wide reputation feed shared by all marathons"""
+    return ReputationFeed()
+
+
+class AssociationCache:
+    """TTL cache of the site accounts associated to each SE network account
+
+    Maps each network id to its associated accounts (user ids indexed by site URL)
+    as returned by StackAuth. It's shared across marathons, and persisted to a JSON
+    file so that it survives restarts. New entries are written to the file in
+    batches: at most once every `save_delay`, and on :meth:`flush`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = ASSOCIATIONS_CACHE_PATH,
+        ttl: datetime.timedelta = ASSOCIATIONS_CACHE_TTL,
+        save_delay: datetime.timedelta = ASSOCIATIONS_SAVE_DELAY,
+    ):
+        """Initialise the cache, loading any entries persisted at `path`
+
+        :param path: path of the file in which entries are persisted (if any)
+        :param ttl: time after which a cached entry is fetched again
+        :param save_delay: time between a new entry and the write of the file (the
+                           entries fetched in the meantime are written along with
+                           it)
+        """
+        self.path = path
+        self.ttl = ttl
+        self.save_delay = save_delay
+        self._entries: Dict[int, Tuple[float, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+        self._scheduled_save: Optional[ScheduledCall] = None
+        self._load()
+
+    def get(self, network_id: int, refresh: bool = False) -> Mapping[str, int]:
+        """Get the accounts associated to a network account
+
+        :param network_id: id of the SE network account
+        :param refresh: whether to fetch the associations again even if they're
+                        cached (unless they were fetched less than
+                        :data:`ASSOCIATIONS_MIN_REFRESH` ago)
+
+        :return: mapping from site URL to the user id in that site
+        """
+        with self._lock:
+            fetched, accounts = self._entries.get(network_id, (None, None))
+        age = None if fetched is None else time.time() - fetched
+        expired = age is None or age > self.ttl.total_seconds()
+        if expired or (refresh and age > ASSOCIATIONS_MIN_REFRESH.total_seconds()):
+            accounts = self._fetch(network_id)
+        return ReadOnlyDictView(accounts)
+
+    def _fetch(self, network_id: int) -> Dict[str, int]:
+        results = get_stack_auth().associated_from_assoc(network_id, only_valid=True)
+        accounts = {ua.json_ob.site_url: ua.json_ob.user_id for ua in results}
+        with self._lock:
+            self._entries[network_id] = (time.time(), accounts)
+            if self.path is not None and self._scheduled_save is None:
+                self._scheduled_save = get_scheduler().call_later(
+                    self.save_delay, self.flush
+                )
+        return accounts
+
+    def flush(self) -> None:
+        """Write any entries fetched since the last write to the file"""
+        with self._lock:
+            if self._scheduled_save is None:
+                return
+            self._scheduled_save.cancel()
+            self._scheduled_save = None
+            self._save()
+
+    def _load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning(f"Ignoring corrupt association cache at {self.path}")
+            return
+        self._entries = {
+            int(network_id): (entry["fetched"], entry["accounts"])
+            for network_id, entry in data.items()
+        }
+
+    def _save(self):
+        if self.path is None:
+            return
+        data = {
+            str(network_id): {"fetched": fetched, "accounts": accounts}
+            for network_id, (fetched, accounts) in self._entries.items()
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(temp_path, self.path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_association_cache() -> AssociationCache:
+    """Get the process-wide network account association cache"""
+    return AssociationCache()
+
+
 # ------------------------------- Exceptions  -------------------------------
 
 
@@ -373,7 +1037,7 @@ class UserNotFoundError(UserLookupError):
     def __str__(self):
         return (
             f"User {repr(self.username_or_id)} not found at "
-            f"{SITES[self.site_key]['name']}"
+            f"{SITES[self.site_key].name}"
         )
 
 
@@ -389,7 +1053,7 @@ class MultipleUsersFoundError(UserLookupError):
     def __str__(self):
         return (
             f"Multiple candidates found for user {repr(self.username_or_id)} "
-            f"at {SITES[self.site_key]['name']} (found {len(self.candidates)} matches)"
+            f"at {SITES[self.site_key].name} (found {len(self.candidates)} matches)"
         )
 
 
@@ -400,13 +1064,129 @@ class SiteError(SEMarathonError):
 
 
 class SiteNotFoundError(SiteError, LookupError):
+    def __init__(self, site):
+        super(SiteNotFoundError, self).__init__(site)
+        self.suggestions = [s.api_site_parameter for s in SITES.search(site, limit=3)]
+
     def __str__(self):
-        return f"Site '{self.site}' not found on SE network"
+        msg = f"Site '{self.site}' not found on SE network"
+        if self.suggestions:
+            msg += f" (did you mean {' or '.join(self.suggestions)}?)"
+        return msg
 
 
 # ------------------------------- Misc helpers  -------------------------------
 
 
+def fetch_reputation_changes(
+    site_key: str, user_ids: Iterable[int], since: datetime.datetime
+) -> Dict[int, List[se.RepChange]]:
+    """Fetch the reputation changes of several users of a site since a given time
+
+    Uses the vectorized ``/users/{ids}/reputation`` endpoint, so that only one
+    request (per page of results) is made for every :data:`MAX_IDS_PER_REQUEST`
+    users.
+
+    :param site_key: site API key for the SE site the users pertain to
+    :param user_ids: ids of the users whose reputation changes should be fetched
+    :param since: only changes from this time onwards are fetched
+
+    :return: a mapping from each of the given user ids to its reputation changes
+    """
+    return fetch_all_reputation_changes({site_key: (user_ids, since)})[site_key]
+
+
+def fetch_all_reputation_changes(
+    queries: Mapping[str, Tuple[Iterable[int], datetime.datetime]],
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> Dict[str, Dict[int, List[se.RepChange]]]:
+    """Fetch the reputation changes of several users across several sites
+
+    Same as :func:`fetch_reputation_changes`, but for several sites at once. If an
+    executor is given, the requests for every site and batch of users are made
+    concurrently on it.
+
+    :param queries: mapping from site API key to a tuple of (user ids, since)
+    :param executor: executor on which to make the requests (if any)
+
+    :return: a mapping from site API key to the reputation changes of each user
+    """
+    changes: Dict[str, Dict[int, List[se.RepChange]]] = {}
+    requests = []
+    for site_key, (user_ids, since) in queries.items():
+        site_changes = changes[site_key] = {}
+        for user_id in user_ids:
+            site_changes.setdefault(user_id, [])
+        fromdate = int(since.timestamp())
+        for chunk in more_itertools.chunked(site_changes, MAX_IDS_PER_REQUEST):
+            requests.append((site_key, chunk, fromdate))
+
+    map_ = executor.map if executor is not None else map
+    results = map_(lambda request: _fetch_reputation_chunk(*request), requests)
+    for (site_key, _, _), chunk_changes in zip(requests, results):
+        for change in chunk_changes:
+            changes[site_key][change.json_ob.user_id].append(change)
+    return changes
+
+
+def fetch_all_reputations(
+    queries: Mapping[str, Iterable[int]],
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> Dict[str, Dict[int, int]]:
+    """Fetch the total reputation of several users across several sites
+
+    Uses the vectorized ``/users/{ids}`` endpoint, so that only one request is
+    made per site for every :data:`MAX_IDS_PER_REQUEST` users.
+
+    :param queries: mapping from site API key to the ids of the users to query
+    :param executor: executor on which to make the requests (if any)
+
+    :return: a mapping from site API key to the reputation of each user
+    """
+    requests = [
+        (site_key, chunk)
+        for site_key, user_ids in queries.items()
+        for chunk in more_itertools.chunked(set(user_ids), MAX_IDS_PER_REQUEST)
+    ]
+
+    def fetch(request):
+        site_key, user_ids = request
+        return get_api(site_key).users(user_ids, pagesize=MAX_IDS_PER_REQUEST)
+
+    map_ = executor.map if executor is not None else map
+    results = map_(fetch, requests)
+    reputations: Dict[str, Dict[int, int]] = {site_key: {} for site_key in queries}
+    for (site_key, _), users in zip(requests, results):
+        for user in users:
+            reputations[site_key][user.id] = user.reputation
+    return reputations
+
+
+def _fetch_reputation_chunk(
+    site_key: str, user_ids: Sequence[int], fromdate: int
+) -> List[se.RepChange]:
+    site = get_api(site_key)
+    url = f"users/{';'.join(map(str, user_ids))}/reputation"
+    kwargs = {"fromdate": fromdate, "pagesize": 100}
+    page = site.build(url, se.RepChange, "rep_changes", kwargs)
+    changes = list(page)
+    while page.has_more:
+        page = page.fetch_next()
+        changes.extend(page)
+    return changes
+
+
+class _QuotaTrackingSite(se.Site):
+    """Site that reports the quota in every API response to the quota tracker"""
+
+    def _request(self, to, params):
+        json_ob = super()._request(to, params)
+        if "quota_remaining" in json_ob and "quota_max" in json_ob:
+            quota = json_ob["quota_remaining"], json_ob["quota_max"]
+            get_quota_tracker().observe(*quota)
+        return json_ob
+
+
 @functools.lru_cache
 def get_api(key: str, **kwargs) -> se.Site:
     """Get a Site object corresponding to the given site key
@@ -417,7 +1197,20 @@ def get_api(key: str, **kwargs) -> se.Site:
     domain = _get_domain(key)
     kwargs.setdefault("cache", 60)
     kwargs.setdefault("impose_throttling", True)
-    return se.Site(domain, app_key=SE_APP_KEY, **kwargs)
+    return _QuotaTrackingSite(domain, app_key=get_app_key(), **kwargs)
+
+
+def get_app_key() -> str:
+    """Get the bot's SE API app key (read from disk on first use)"""
+    return Text.load("se-app-key")
+
+
+@functools.lru_cache(maxsize=None)
+def get_stack_auth() -> "stackauth.StackAuth":
+    """Get the StackAuth client (created on first use)"""
+    import stackauth  # (only needed to look up network accounts)
+
+    return stackauth.StackAuth()
 
 
 def _to_site_domain(site: Union[str, se.Site]):
@@ -431,15 +1224,6 @@ def _to_site_domain(site: Union[str, se.Site]):
 
 def _get_domain(site_api_key: str):
     try:
-        url = SITES[site_api_key]["site_url"]
-        return _extract_domain(url)
+        return SITES[site_api_key].domain
     except KeyError:
         raise SiteNotFoundError(site_api_key)
-
-
-def _extract_domain(url: str):
-    return re.match(r"https?://(?P<domain>[^/]*)", url).group("domain")
-
-
-def _domain_to_url(domain: str):
-    return f"https://{domain}"
@@ -0,0 +1,136 @@
+"""Local handling of Telegram's MarkdownV2 markup
+
+Telegram rejects a whole message (with a ``BadRequest`` error) if its MarkdownV2
+markup is malformed: entities that aren't closed or are improperly nested, or any
+of the reserved characters left unescaped outside of an entity marker. The
+:func:`validate` function checks for this locally, so that a parse mode can be
+chosen before sending instead of by trial and error; :func:`escape` escapes text
+so that it can be safely interpolated into markup.
+"""
+
+import functools
+import re
+from typing import List, Optional
+
+RESERVED_CHARS = r"_*[]()~`>#+-=|{}.!"
+ESCAPE_CACHE_SIZE = 4096
+
+_ESCAPE_PATTERNS = {
+    None: re.compile(r"([\\" + re.escape(RESERVED_CHARS) + "])"),
+    "pre": re.compile(r"([\\`])"),
+    "code": re.compile(r"([\\`])"),
+    "text_link": re.compile(r"([\\)])"),
+}
+_UNESCAPE_PATTERN = re.compile(r"\\([\x01-\x7e])")
+# entity markers that are toggled (opened and closed by the same marker)
+_TOGGLE_MARKERS = ("||", "__", "*", "_", "~")
+
+
+class MarkdownError(ValueError):
+    position: int
+
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} (at position {position})")
+        self.position = position
+
+
+@functools.lru_cache(maxsize=ESCAPE_CACHE_SIZE)
+def escape(text: str, entity_type: Optional[str] = None) -> str:
+    """Escape text so that it's rendered literally in a MarkdownV2 message
+
+    :param text: text to escape
+    :param entity_type: type of the entity in which the text is to be placed
+                        (``"pre"``, ``"code"`` or ``"text_link"``, for the URL part
+                        of a link), or ``None`` for regular text
+
+    :return: the escaped text
+    """
+    return _ESCAPE_PATTERNS[entity_type].sub(r"\\\1", text)
+
+
+def unescape(text: str) -> str:
+    """Remove the escaping backslashes from MarkdownV2 text (but not the markup)"""
+    return _UNESCAPE_PATTERN.sub(r"\1", text)
+
+
+def validate(text: str) -> None:
+    """Check whether a text is well-formed MarkdownV2
+
+    :raises MarkdownError: if it isn't (the message describes the first problem)
+    """
+    open_entities: List[str] = []
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i]
+        if char == "\\":
+            if i + 1 == length or not "\x01" <= text[i + 1] <= "\x7e":
+                raise MarkdownError("Backslash doesn't escape anything", i)
+            i += 2
+        elif text.startswith("```", i):
+            i = _skip_code(text, i + 3, "```") + 3
+        elif char == "`":
+            i = _skip_code(text, i + 1, "`") + 1
+        elif char == "[":
+            open_entities.append("[")
+            i += 1
+        elif char == "]":
+            if not open_entities or open_entities[-1] != "[":
+                raise MarkdownError("Unescaped ']'", i)
+            if not text.startswith("(", i + 1):
+                raise MarkdownError("Link text not followed by a URL", i)
+            open_entities.pop()
+            i = _skip_url(text, i + 2) + 1
+        elif char == ">" and (i == 0 or text[i - 1] == "\n"):
+            i += 1  # block quote
+        else:
+            marker = next((m for m in _TOGGLE_MARKERS if text.startswith(m, i)), None)
+            if marker is None:
+                if char in RESERVED_CHARS:
+                    raise MarkdownError(f"Unescaped {char!r}", i)
+                i += 1
+                continue
+            if open_entities and open_entities[-1] == marker:
+                open_entities.pop()
+            elif marker in open_entities:
+                raise MarkdownError(f"Improperly nested {marker!r}", i)
+            else:
+                open_entities.append(marker)
+            i += len(marker)
+    if open_entities:
+        raise MarkdownError(f"Unclosed {open_entities[-1]!r}", length)
+
+
+def is_valid(text: str) -> bool:
+    try:
+        validate(text)
+        return True
+    except MarkdownError:
+        return False
+
+
+def _skip_code(text: str, start: int, delimiter: str) -> int:
+    """Index of the delimiter that closes a code entity starting at `start`"""
+    i = start
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+        elif text.startswith(delimiter, i):
+            return i
+        elif text[i] == "`":
+            raise MarkdownError("Unescaped '`' in code", i)
+        else:
+            i += 1
+    raise MarkdownError(f"Unclosed {delimiter!r}", start)
+
+
+def _skip_url(text: str, start: int) -> int:
+    """Index of the parenthesis that closes a link URL starting at `start`"""
+    i = start
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+        elif text[i] == ")":
+            return i
+        else:
+            i += 1
+    raise MarkdownError("Unclosed link URL", start)
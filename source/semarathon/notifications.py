@@ -0,0 +1,163 @@
+"""Bounded queue between a marathon's poll cycles and its update handler
+
+Poll cycles put score updates on an :class:`UpdateQueue` instead of calling the
+update handler directly, so that slow handlers (e.g. ones that send Telegram
+messages) don't delay the next poll. Updates are delivered to the handler, in
+order, on a shared pool of notification threads. If the handler can't keep up
+and the queue fills, the :class:`Backpressure` policy decides what gives way.
+"""
+
+import collections
+import concurrent.futures
+import enum
+import functools
+import logging
+import threading
+import time
+from typing import Deque, Generator, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from semarathon.marathon import ScoreUpdate
+
+DEFAULT_MAX_SIZE = 64
+DEFAULT_MAX_NOTIFICATION_WORKERS = 16
+
+logger = logging.getLogger(__name__)
+
+
+class Backpressure(enum.Enum):
+    """What to do with a new update when the queue is full"""
+
+    COALESCE = enum.auto()  # merge it into a queued update for the same participant
+    DROP_OLDEST = enum.auto()  # drop the oldest queued update
+
+
+class QueueMetrics(NamedTuple):
+    depth: int  # updates waiting to be delivered
+    max_depth: int
+    delivered: int
+    coalesced: int
+    dropped: int
+    lag: float  # seconds between queueing and delivery of the last update
+    max_lag: float
+
+
+class UpdateQueue:
+    """Bounded queue of score updates, delivered to a handler on a worker thread"""
+
+    def __init__(
+        self,
+        handler: Generator[None, "ScoreUpdate", None],
+        max_size: int = DEFAULT_MAX_SIZE,
+        policy: Backpressure = Backpressure.COALESCE,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ):
+        """Initialise a new queue
+
+        :param handler: coroutine to which updates are sent (closed once the queue
+                        is closed and drained)
+        :param max_size: maximum number of queued updates
+        :param policy: what to do with a new update when the queue is full (if
+                       coalescing isn't possible, the oldest update is dropped)
+        :param executor: executor on which updates are delivered (by default, the
+                         process-wide notification pool)
+        """
+        self.handler = handler
+        self.max_size = max_size
+        self.policy = policy
+        self._executor = executor or get_notification_pool()
+        self._queue: Deque[Tuple["ScoreUpdate", float]] = collections.deque()
+        self._lock = threading.Lock()
+        self._draining = False
+        self._closing = False
+        self._max_depth = 0
+        self._delivered = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self._lag = 0.0
+        self._max_lag = 0.0
+        self._drained = threading.Event()
+
+    @property
+    def metrics(self) -> QueueMetrics:
+        with self._lock:
+            return QueueMetrics(
+                depth=len(self._queue),
+                max_depth=self._max_depth,
+                delivered=self._delivered,
+                coalesced=self._coalesced,
+                dropped=self._dropped,
+                lag=self._lag,
+                max_lag=self._max_lag,
+            )
+
+    def put(self, update: "ScoreUpdate") -> None:
+        """Queue an update for delivery (applying backpressure if the queue is full)"""
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("Tried to put an update on a closed queue")
+            if len(self._queue) >= self.max_size and not self._make_room(update):
+                return
+            self._queue.append((update, time.monotonic()))
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._schedule_drain()
+
+    def close(self) -> None:
+        """Close the queue: the handler is closed once queued updates are delivered"""
+        with self._lock:
+            self._closing = True
+            self._schedule_drain()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the queue is closed and drained (and the handler closed)"""
+        return self._drained.wait(timeout)
+
+    def _make_room(self, update: "ScoreUpdate") -> bool:
+        """Apply the backpressure policy; return whether `update` should be queued"""
+        if self.policy is Backpressure.COALESCE:
+            for queued, _ in self._queue:
+                if queued.participant is update.participant:
+                    queued.merge(update)
+                    self._coalesced += 1
+                    return False
+        self._queue.popleft()
+        self._dropped += 1
+        logger.warning(f"Update queue full: dropped an update ({self._dropped} so far)")
+        return True
+
+    def _schedule_drain(self):
+        if not self._draining:
+            self._draining = True
+            self._executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._draining = False
+                    closing = self._closing
+                    break
+                update, queued_at = self._queue.popleft()
+                self._lag = time.monotonic() - queued_at
+                self._max_lag = max(self._max_lag, self._lag)
+                self._delivered += 1
+            try:
+                self.handler.send(update)
+            except Exception as exc:
+                logger.exception(
+                    "Marathon update handler raised an exception", exc_info=exc
+                )
+        if closing and not self._drained.is_set():
+            try:
+                self.handler.close()
+            except Exception as exc:
+                logger.exception("Closing the update handler failed", exc_info=exc)
+            self._drained.set()
+
+
+@functools.lru_cache(maxsize=None)
+def get_notification_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Get the process-wide pool on which update handlers run"""
+    return concurrent.futures.ThreadPoolExecutor(
+        DEFAULT_MAX_NOTIFICATION_WORKERS, thread_name_prefix="MarathonNotify"
+    )
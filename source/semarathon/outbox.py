@@ -0,0 +1,285 @@
+"""Rate-limited queue for outbound Telegram messages
+
+Telegram limits how fast a bot can send messages: about one message per second
+in any given chat, 20 messages per minute in a group, and 30 messages per second
+overall. Exceeding them gets the bot flood-waited (with a ``RetryAfter`` error).
+The :class:`Outbox` queues messages and sends each one only once the token
+buckets for its chat and the global bucket allow it. Messages are sent in order
+of priority, and in order of submission within a chat and priority.
+"""
+
+import concurrent.futures
+import enum
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+GLOBAL_RATE = 30.0  # messages per second
+CHAT_RATE = 1.0  # messages per second
+GROUP_RATE = 20 / 60  # messages per second (sustained; bursts up to GROUP_BURST)
+GROUP_BURST = 20
+MAX_SEND_WORKERS = 8
+QUEUE_DEPTH_WARNING = 100
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    HIGH = 0  # countdowns, end of marathon, replies to failed commands
+    NORMAL = 1  # replies to commands
+    LOW = 2  # routine status posts
+
+
+class TokenBucket:
+    """Token bucket that refills at a constant rate, up to a given capacity"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """Initialise a (full) bucket
+
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens (i.e. maximum burst size)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available at time `now` (0 if one is)"""
+        self._refill(now)
+        return max((1 - self._tokens) / self.rate, 0.0)
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def _refill(self, now: float):
+        elapsed = max(now - self._updated, 0.0)
+        self._tokens = min(self._tokens + elapsed * self.rate, self.capacity)
+        self._updated = now
+
+
+class _Message:
+    def __init__(
+        self,
+        chat_id: int,
+        send: Callable[[], T],
+        priority: Priority,
+        sequence: int,
+    ):
+        self.chat_id = chat_id
+        self.send = send
+        self.priority = priority
+        self.sequence = sequence
+        self.future: "concurrent.futures.Future[T]" = concurrent.futures.Future()
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        return self.priority, self.sequence
+
+
+class Outbox:
+    """Queue of outbound messages, sent as fast as Telegram's limits allow"""
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        group_rate: float = GROUP_RATE,
+        group_burst: int = GROUP_BURST,
+        max_workers: int = MAX_SEND_WORKERS,
+    ):
+        """Initialise a new outbox
+
+        :param global_rate: maximum messages per second, overall
+        :param chat_rate: maximum messages per second in any given chat
+        :param group_rate: maximum sustained messages per second in a group chat
+        :param group_burst: maximum burst of messages in a group chat
+        :param max_workers: maximum number of messages being sent at once
+        """
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._buckets: Dict[int, List[TokenBucket]] = {}
+        self._blocked_until: Dict[int, float] = {}
+        self._in_flight: Dict[int, _Message] = {}
+        self._queue: List[_Message] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="OutboxSender"
+        )
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def depth(self) -> int:
+        """Number of messages waiting to be sent"""
+        with self._condition:
+            return len(self._queue)
+
+    def depth_by_priority(self) -> Dict[Priority, int]:
+        with self._condition:
+            depths = dict.fromkeys(Priority, 0)
+            for message in self._queue:
+                depths[message.priority] += 1
+            return depths
+
+    def submit(
+        self,
+        chat_id: int,
+        send: Callable[[], T],
+        priority: Priority = Priority.NORMAL,
+    ) -> "concurrent.futures.Future[T]":
+        """Queue a message
+
+        :param chat_id: id of the chat to which the message is sent
+        :param send: function that sends the message (called in a worker thread);
+                     if it raises an exception with a ``retry_after`` attribute
+                     (like :class:`telegram.error.RetryAfter`), the chat is paused
+                     for that many seconds and the message is sent again
+        :param priority: priority of the message
+
+        :return: a future with the result of `send`
+        """
+        message = _Message(chat_id, send, priority, next(self._counter))
+        with self._condition:
+            self._queue.append(message)
+            depth = len(self._queue)
+            self._ensure_started()
+            self._condition.notify_all()
+        if depth >= QUEUE_DEPTH_WARNING and depth % QUEUE_DEPTH_WARNING == 0:
+            logger.warning(f"Outbox queue depth: {self.depth_by_priority()}")
+        return message.future
+
+    def submit_after(
+        self,
+        after: "concurrent.futures.Future",
+        chat_id: int,
+        send: Callable[[Any], T],
+        priority: Priority = Priority.NORMAL,
+    ) -> "concurrent.futures.Future[T]":
+        """Queue a message once another one (e.g. the message it edits) has been sent
+
+        The message is only queued once `after` is done, so that it never holds up
+        the chat (or a worker) while waiting for it, whatever their priorities.
+
+        :param after: future of the message to wait for (e.g. from :meth:`submit`)
+        :param chat_id: id of the chat to which the message is sent
+        :param send: function that sends the message, called with the result of
+                     `after` (see :meth:`submit`)
+        :param priority: priority of the message
+
+        :return: a future with the result of `send` (or with the exception of
+                 `after`, in which case `send` isn't called)
+        """
+        future: "concurrent.futures.Future[T]" = concurrent.futures.Future()
+
+        def copy_outcome(done: "concurrent.futures.Future"):
+            exc = done.exception()
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(done.result())
+
+        def queue(done: "concurrent.futures.Future"):
+            if done.exception() is not None:
+                copy_outcome(done)
+                return
+            result = done.result()
+            queued = self.submit(chat_id, lambda: send(result), priority)
+            queued.add_done_callback(copy_outcome)
+
+        after.add_done_callback(queue)
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued message has been sent
+
+        :return: whether the queue was drained before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                name="Outbox", target=self._dispatch_loop, daemon=True
+            )
+            self._thread.start()
+
+    def _chat_buckets(self, chat_id: int) -> List[TokenBucket]:
+        if chat_id not in self._buckets:
+            buckets = [TokenBucket(self._chat_rate)]
+            if chat_id < 0:  # groups, supergroups and channels
+                buckets.append(TokenBucket(self._group_rate, self._group_burst))
+            self._buckets[chat_id] = buckets
+        return self._buckets[chat_id]
+
+    def _next_message(self, now: float) -> Tuple[Optional[_Message], Optional[float]]:
+        """The next message that can be sent, or else how long to wait for one"""
+        wait = None
+        global_delay = self._global.delay(now)
+        seen_chats = set()
+        for message in sorted(self._queue, key=lambda m: m.key):
+            chat_id = message.chat_id
+            if chat_id in seen_chats or chat_id in self._in_flight:
+                continue  # keeps messages to the same chat in order
+            seen_chats.add(chat_id)
+            delay = max(
+                global_delay,
+                self._blocked_until.get(chat_id, now) - now,
+                *(bucket.delay(now) for bucket in self._chat_buckets(chat_id)),
+            )
+            if delay <= 0:
+                return message, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _dispatch_loop(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                message, wait = self._next_message(now)
+                if message is None:
+                    self._condition.wait(wait)
+                    continue
+                self._queue.remove(message)
+                self._global.consume(now)
+                for bucket in self._chat_buckets(message.chat_id):
+                    bucket.consume(now)
+                self._in_flight[message.chat_id] = message
+                self._workers.submit(self._send, message)
+
+    def _send(self, message: _Message):
+        requeue = False
+        try:
+            result = message.send()
+        except Exception as exc:
+            retry_after = getattr(exc, "retry_after", None)
+            if retry_after is None:
+                message.future.set_exception(exc)
+            else:
+                logger.warning(
+                    f"Flood control in chat {message.chat_id}: "
+                    f"retrying in {retry_after} seconds"
+                )
+                requeue = True
+        else:
+            message.future.set_result(result)
+        with self._condition:
+            del self._in_flight[message.chat_id]
+            if requeue:
+                self._blocked_until[message.chat_id] = time.monotonic() + retry_after
+                self._queue.append(message)
+            self._condition.notify_all()
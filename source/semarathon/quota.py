@@ -0,0 +1,122 @@
+import datetime
+import functools
+import logging
+import threading
+import weakref
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from semarathon.marathon import Marathon
+
+QUOTA_RESERVE_FRACTION = 0.05  # kept aside for commands (user lookups, etc.)
+MAX_STRETCH_FACTOR = 16.0
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaTracker:
+    """Keeps track of the remaining SE API quota and of the demand for it
+
+    The SE API reports the remaining daily quota (``quota_remaining``, out of
+    ``quota_max``) in every response; it is shared by every site queried with the
+    same app key. Running marathons register themselves so that their expected
+    demand until the end of the marathon (or until the quota resets, at midnight
+    UTC) can be weighed against the remaining quota.
+    """
+
+    remaining: Optional[int]
+    maximum: Optional[int]
+    updated: Optional[datetime.datetime]
+
+    def __init__(self, reserve_fraction: float = QUOTA_RESERVE_FRACTION):
+        """Initialise a new tracker
+
+        :param reserve_fraction: fraction of the maximum quota that shouldn't be
+                                 spent on poll cycles
+        """
+        self.remaining = None
+        self.maximum = None
+        self.updated = None
+        self.reserve_fraction = reserve_fraction
+        self._marathons: "weakref.WeakSet[Marathon]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def observe(self, remaining: int, maximum: int) -> None:
+        """Record the quota reported in an API response"""
+        with self._lock:
+            self.remaining = remaining
+            self.maximum = maximum
+            self.updated = datetime.datetime.now()
+        if remaining < maximum * self.reserve_fraction:
+            logger.warning(f"SE API quota running low: {remaining}/{maximum} left")
+
+    def register(self, marathon: "Marathon") -> None:
+        with self._lock:
+            self._marathons.add(marathon)
+
+    def unregister(self, marathon: "Marathon") -> None:
+        with self._lock:
+            self._marathons.discard(marathon)
+
+    @property
+    def fraction_remaining(self) -> float:
+        """Fraction of the daily quota that remains (1 if unknown)"""
+        if self.remaining is None or not self.maximum:
+            return 1.0
+        return self.remaining / self.maximum
+
+    def projected_demand(self, now: Optional[datetime.datetime] = None) -> float:
+        """Requests that running marathons will make until the next quota reset
+
+        Assumes every marathon polls at its base refresh interval, i.e. doesn't
+        account for the savings of adaptive polling (so it's an upper bound).
+        Marathons without a positive refresh interval can't be projected, so they're
+        left out.
+        """
+        now = now or datetime.datetime.now()
+        horizon_end = _next_quota_reset(now)
+        with self._lock:
+            marathons = list(self._marathons)
+        demand = 0.0
+        for marathon in marathons:
+            interval = marathon.refresh_interval
+            if not marathon.is_running or interval <= datetime.timedelta(0):
+                continue
+            horizon = min(marathon.end_time, horizon_end) - now
+            cycles = max(horizon / interval, 0)
+            demand += cycles * marathon.requests_per_cycle
+        return demand
+
+    def stretch_factor(self, now: Optional[datetime.datetime] = None) -> float:
+        """Factor by which poll intervals should be stretched to not run out of quota
+
+        :return: 1 if the remaining quota (minus the reserve) covers the projected
+                 demand, or the ratio of demand to available quota otherwise (capped
+                 at :data:`MAX_STRETCH_FACTOR`)
+        """
+        if self.remaining is None:
+            return 1.0
+        available = self.remaining - self.maximum * self.reserve_fraction
+        demand = self.projected_demand(now)
+        if demand <= max(available, 0):
+            return 1.0
+        if available <= 0:
+            return MAX_STRETCH_FACTOR
+        return min(demand / available, MAX_STRETCH_FACTOR)
+
+
+def _next_quota_reset(now: datetime.datetime) -> datetime.datetime:
+    """Next time the daily quota resets (midnight UTC), in naive local time"""
+    utc_now = now.astimezone(datetime.timezone.utc)
+    utc_midnight = datetime.datetime.combine(
+        utc_now.date() + datetime.timedelta(days=1),
+        datetime.time(),
+        tzinfo=datetime.timezone.utc,
+    )
+    return utc_midnight.astimezone().replace(tzinfo=None)
+
+
+@functools.lru_cache(maxsize=None)
+def get_quota_tracker() -> QuotaTracker:
+    """Get the process-wide quota tracker (fed by every API response)"""
+    return QuotaTracker()
@@ -0,0 +1,159 @@
+import concurrent.futures
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Tuple, Union
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_FETCH_WORKERS = 16
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledCall:
+    """Handle for a call scheduled on a :class:`PollScheduler`"""
+
+    deadline: float
+    callback: Callable[[], None]
+
+    def __init__(self, deadline: float, callback: Callable[[], None]):
+        self.deadline = deadline
+        self.callback = callback
+        self._cancelled = False
+
+    def __repr__(self):
+        return f"<ScheduledCall {self.callback} at {self.deadline}>"
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+
+
+class PollScheduler:
+    """Process-wide scheduler for the timed events of every running marathon
+
+    A single dispatcher thread keeps a priority queue of deadlines (poll cycles,
+    end of marathon, etc.) and hands each due call to a bounded pool of worker
+    threads, so the number of threads doesn't grow with the number of marathons.
+    Poll cycles fan out their API requests on a separate bounded pool,
+    :attr:`fetch_pool`, which caps the number of requests in flight process-wide.
+    """
+
+    fetch_pool: concurrent.futures.ThreadPoolExecutor
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_fetch_workers: int = DEFAULT_MAX_FETCH_WORKERS,
+    ):
+        """Initialise a new scheduler
+
+        :param max_workers: maximum number of scheduled calls running at once
+        :param max_fetch_workers: maximum number of concurrent API requests
+        """
+        self._queue: List[Tuple[float, int, ScheduledCall]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="MarathonWorker"
+        )
+        self.fetch_pool = concurrent.futures.ThreadPoolExecutor(
+            max_fetch_workers, thread_name_prefix="MarathonFetch"
+        )
+        self._thread: Optional[threading.Thread] = None
+
+    def call_later(
+        self,
+        delay: Union[float, datetime.timedelta],
+        callback: Callable[[], None],
+    ) -> ScheduledCall:
+        """Schedule a call after a given delay
+
+        :param delay: delay (in seconds if given as a number)
+        :param callback: function to call (in one of the worker threads)
+
+        :return: a handle with which the call can be cancelled
+        """
+        if isinstance(delay, datetime.timedelta):
+            delay = delay.total_seconds()
+        return self.call_at(time.monotonic() + delay, callback)
+
+    def call_at(self, deadline: float, callback: Callable[[], None]) -> ScheduledCall:
+        """Schedule a call at a given :func:`time.monotonic` deadline"""
+        call = ScheduledCall(deadline, callback)
+        with self._condition:
+            heapq.heappush(self._queue, (deadline, next(self._counter), call))
+            self._ensure_started()
+            self._condition.notify()
+        return call
+
+    @property
+    def pending(self) -> int:
+        """Number of calls that are still scheduled (including cancelled ones)"""
+        with self._condition:
+            return len(self._queue)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                name="MarathonScheduler", target=self._dispatch_loop, daemon=True
+            )
+            self._thread.start()
+
+    def _dispatch_loop(self):
+        logger.info("Marathon scheduler started")
+        with self._condition:
+            while True:
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                deadline, _, call = self._queue[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._queue)
+                if not call.cancelled:
+                    self._workers.submit(self._run, call)
+
+    @staticmethod
+    def _run(call: ScheduledCall):
+        if call.cancelled:
+            return
+        try:
+            call.callback()
+        except Exception as exc:
+            logger.exception(f"Scheduled call {call} raised an exception", exc_info=exc)
+
+
+_scheduler: Optional[PollScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> PollScheduler:
+    """Get the process-wide scheduler shared by all marathons"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PollScheduler()
+        return _scheduler
+
+
+def configure_scheduler(**kwargs) -> PollScheduler:
+    """Replace the process-wide scheduler with one with the given settings
+
+    Should be called before any marathon starts; marathons that are already
+    running keep using the previous scheduler until their next poll cycle.
+
+    :param kwargs: see :class:`PollScheduler`
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = PollScheduler(**kwargs)
+        return _scheduler
@@ -0,0 +1,253 @@
+"""Catalog of the sites in the Stack Exchange network
+
+The catalog is read from ``data/SE-Sites.json`` (a dump of the SE API's ``/sites``
+method) the first time it's needed. Only the fields the bot uses are kept, along
+with lookup indexes by API key, URL/alias and name. Both are saved to a compact
+binary cache that is read on subsequent loads instead of the JSON file, and only
+rebuilt when the JSON file changes.
+"""
+
+import bisect
+import collections
+import collections.abc
+import itertools
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SITES_JSON_PATH = os.path.join(ROOT_DIR, "data", "SE-Sites.json")
+SITES_CACHE_PATH = os.path.join(ROOT_DIR, "data", "cache", "SE-Sites.pickle")
+CACHE_FORMAT_VERSION = 1
+MIN_TRIGRAM_SIMILARITY = 0.2
+
+logger = logging.getLogger(__name__)
+
+
+class SiteInfo(NamedTuple):
+    api_site_parameter: str
+    site_url: str
+    name: str
+    aliases: Tuple[str, ...]
+
+    @property
+    def domain(self) -> str:
+        return url_to_domain(self.site_url)
+
+
+class SiteCatalog(collections.abc.Mapping):
+    """Read-only mapping from site API key to :class:`SiteInfo`, loaded lazily"""
+
+    def __init__(
+        self, path: str = SITES_JSON_PATH, cache_path: Optional[str] = SITES_CACHE_PATH
+    ):
+        """Initialise the catalog (without loading it yet)
+
+        :param path: path of the JSON dump of the SE API's ``/sites`` method
+        :param cache_path: path of the binary cache (or ``None`` to not use one)
+        """
+        self.path = path
+        self.cache_path = cache_path
+        self._sites: Optional[Dict[str, SiteInfo]] = None
+        self._by_domain: Dict[str, str] = {}
+        self._by_name: Dict[str, str] = {}
+        self._search_index: Optional["SiteSearchIndex"] = None
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> SiteInfo:
+        return self._loaded()[key]
+
+    def __len__(self) -> int:
+        return len(self._loaded())
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._loaded())
+
+    def by_url(self, url: str) -> SiteInfo:
+        """Look up a site by its URL or any of its aliases
+
+        :raises KeyError: if no site has the given URL
+        """
+        self._loaded()
+        return self[self._by_domain[url_to_domain(url)]]
+
+    def by_name(self, name: str) -> SiteInfo:
+        """Look up a site by its name (case-insensitive)
+
+        :raises KeyError: if no site has the given name
+        """
+        self._loaded()
+        return self[self._by_name[name.casefold()]]
+
+    def search(self, query: str, limit: int = 10) -> List[SiteInfo]:
+        """Find the sites that best match a query; see :meth:`SiteSearchIndex.search`"""
+        return [self[key] for key in self.search_index.search(query, limit)]
+
+    @property
+    def search_index(self) -> "SiteSearchIndex":
+        """Index for fuzzy lookups (built the first time it's accessed)"""
+        if self._search_index is None:
+            index = SiteSearchIndex(self._loaded().values())
+            with self._lock:
+                if self._search_index is None:
+                    self._search_index = index
+        return self._search_index
+
+    def _loaded(self) -> Dict[str, SiteInfo]:
+        if self._sites is None:
+            with self._lock:
+                if self._sites is None:
+                    self._load()
+        return self._sites
+
+    def _load(self):
+        stat = os.stat(self.path)
+        signature = (CACHE_FORMAT_VERSION, stat.st_size, stat.st_mtime_ns)
+        data = self._read_cache(signature)
+        if data is None:
+            data = self._build()
+            self._write_cache(signature, data)
+        sites, self._by_domain, self._by_name = data
+        self._sites = {site.api_site_parameter: site for site in sites}
+
+    def _build(self) -> Tuple[List[SiteInfo], Dict[str, str], Dict[str, str]]:
+        logger.info(f"Building site catalog from {self.path}")
+        with open(self.path, encoding="utf-8") as file:
+            raw_sites = json.load(file)
+        sites = [
+            SiteInfo(
+                api_site_parameter=site["api_site_parameter"],
+                site_url=site["site_url"],
+                name=site["name"],
+                aliases=tuple(site.get("aliases", ())),
+            )
+            for site in raw_sites.values()
+        ]
+        by_domain = {}
+        for site in sites:
+            for alias in site.aliases:
+                by_domain.setdefault(url_to_domain(alias), site.api_site_parameter)
+        # canonical URLs take precedence over aliases
+        by_domain.update({site.domain: site.api_site_parameter for site in sites})
+        by_name = {site.name.casefold(): site.api_site_parameter for site in sites}
+        return sites, by_domain, by_name
+
+    def _read_cache(self, signature: tuple):
+        if self.cache_path is None:
+            return None
+        try:
+            with open(self.cache_path, "rb") as file:
+                cached_signature, sites, by_domain, by_name = pickle.load(file)
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+            return None
+        if cached_signature != signature:
+            return None
+        return [SiteInfo(*site) for site in sites], by_domain, by_name
+
+    def _write_cache(self, signature: tuple, data):
+        if self.cache_path is None:
+            return
+        sites, by_domain, by_name = data
+        payload = (signature, [tuple(site) for site in sites], by_domain, by_name)
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, "wb") as file:
+                pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.cache_path)
+        except OSError as exc:
+            logger.warning(f"Couldn't write site catalog cache: {exc}")
+
+
+class SiteSearchIndex:
+    """Index for fast fuzzy lookup of sites by API key, name, URL or alias
+
+    Combines a sorted list of search terms (for prefix matches, by bisection) with
+    an inverted index of character trigrams (for typos), so that lookups don't need
+    to scan the whole catalog.
+    """
+
+    def __init__(self, sites: Iterable[SiteInfo]):
+        terms: Dict[str, str] = {}
+        for site in sites:
+            domains = [site.domain, *map(url_to_domain, site.aliases)]
+            for term in (
+                site.api_site_parameter,
+                site.name,
+                *domains,
+                # without the suffix (shared by many sites, so useless for lookups)
+                *(re.sub(r"\.(stackexchange\.)?(com|net)$", "", d) for d in domains),
+            ):
+                terms.setdefault(_normalise(term), site.api_site_parameter)
+        self._terms = sorted(terms.items())
+        self._term_to_key = terms
+        self._trigram_counts = {term: len(_trigrams(term)) for term in terms}
+        self._trigrams: Dict[str, Set[str]] = collections.defaultdict(set)
+        for term in terms:
+            for trigram in _trigrams(term):
+                self._trigrams[trigram].add(term)
+
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        """Find the sites that best match a (partial) query
+
+        Exact matches come first, then matches by prefix, then the closest matches
+        by trigram similarity.
+
+        :param query: partial or misspelt site API key, name, URL or alias
+        :param limit: maximum number of results
+
+        :return: API keys of the matching sites, best matches first
+        """
+        query = _normalise(query)
+        results: Dict[str, None] = {}  # used as an ordered set
+
+        def add(term):
+            results.setdefault(self._term_to_key[term])
+            return len(results) >= limit
+
+        if not query:
+            return []
+        if query in self._term_to_key and add(query):
+            return list(results)
+        start = bisect.bisect_left(self._terms, (query,))
+        for term, _ in itertools.islice(self._terms, start, None):
+            if not term.startswith(query):
+                break
+            if add(term):
+                return list(results)
+
+        query_trigrams = _trigrams(query)
+        shared = collections.Counter(
+            term
+            for trigram in query_trigrams
+            for term in self._trigrams.get(trigram, ())
+        )
+        scored = sorted(
+            (-count / (len(query_trigrams) + self._trigram_counts[term] - count), term)
+            for term, count in shared.items()
+        )
+        for score, term in scored:
+            if -score < MIN_TRIGRAM_SIMILARITY or add(term):
+                break
+        return list(results)
+
+
+def _normalise(term: str) -> str:
+    return " ".join(re.sub(r"[^\w.]+", " ", term.casefold()).split())
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def url_to_domain(url: str) -> str:
+    """Normalise a site URL (or alias) to a lowercase domain name"""
+    return re.sub(r"^(?:https?://)?(?:www\.)?", "", url.strip().lower()).split("/")[0]
+
+
+SITES = SiteCatalog()
@@ -0,0 +1,270 @@
+"""Durable storage for bot sessions and their marathons
+
+Sessions, marathon settings, participants and the progress of each user profile
+(score and watermark) are kept in a SQLite database in write-ahead-log mode, along
+with a few values of the bot's own state. Every write only touches the rows that
+changed (e.g. a poll cycle only updates the user profiles whose progress moved),
+so that the store can be kept up to date as the bot runs, and sessions can be
+restored on restart without querying the SE API.
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from semarathon import marathon as mth
+from semarathon.sites import ROOT_DIR
+
+STORE_PATH = os.path.join(ROOT_DIR, "data", "semarathon.sqlite3")
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    chat_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS marathons (
+    chat_id INTEGER PRIMARY KEY REFERENCES sessions ON DELETE CASCADE,
+    sites TEXT NOT NULL,
+    duration REAL NOT NULL,
+    refresh_interval REAL NOT NULL,
+    max_refresh_interval REAL NOT NULL,
+    poll_mode TEXT NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    running INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS participants (
+    chat_id INTEGER NOT NULL REFERENCES marathons ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    network_id INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, name)
+);
+CREATE TABLE IF NOT EXISTS user_profiles (
+    chat_id INTEGER NOT NULL,
+    participant TEXT NOT NULL,
+    site_key TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    display_name TEXT NOT NULL,
+    score INTEGER NOT NULL DEFAULT 0,
+    last_checked TEXT,
+    PRIMARY KEY (chat_id, participant, site_key),
+    FOREIGN KEY (chat_id, participant) REFERENCES participants ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS bot_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class StoredSession(NamedTuple):
+    chat_id: int
+    marathon: Optional[mth.Marathon]
+    running: bool  # whether the marathon was running when last saved
+
+
+class SessionStore:
+    """SQLite-backed store of bot sessions, written incrementally"""
+
+    path: str
+
+    def __init__(self, path: str = STORE_PATH):
+        """Open (or create) the store at `path`
+
+        :param path: path of the SQLite database (or ``":memory:"`` for a store
+                     that isn't persisted)
+        """
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("PRAGMA foreign_keys=ON")
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        # last progress written for each user profile, to only write what changed
+        self._progress: Dict[Tuple[int, str, str], Tuple[int, Optional[str]]] = {}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def get_value(self, key: str) -> Optional[str]:
+        """Get a value of the bot's own state (e.g. what was last sent to Telegram)"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM bot_state WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set_value(self, key: str, value: str) -> None:
+        self._execute("INSERT OR REPLACE INTO bot_state VALUES (?, ?)", (key, value))
+
+    def save_session(self, chat_id: int) -> None:
+        self._execute("INSERT OR IGNORE INTO sessions VALUES (?)", (chat_id,))
+
+    def delete_session(self, chat_id: int) -> None:
+        """Delete a session, along with its marathon (if any)"""
+        self._execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+        self._forget_progress(chat_id)
+
+    def delete_marathon(self, chat_id: int) -> None:
+        """Delete a session's marathon, along with its participants"""
+        self._execute("DELETE FROM marathons WHERE chat_id = ?", (chat_id,))
+        self._forget_progress(chat_id)
+
+    def save_marathon(self, chat_id: int, marathon: mth.Marathon) -> None:
+        """Save the settings and state of a session's marathon (not its participants)"""
+        row = (
+            json.dumps(list(marathon.sites)),
+            marathon.duration.total_seconds(),
+            marathon.refresh_interval.total_seconds(),
+            marathon.max_refresh_interval.total_seconds(),
+            marathon.poll_mode.name,
+            _to_text(marathon.start_time),
+            _to_text(marathon.end_time),
+            marathon.is_running,
+        )
+        self._execute(
+            "INSERT INTO marathons VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (chat_id) DO UPDATE SET sites = excluded.sites, "
+            "duration = excluded.duration, "
+            "refresh_interval = excluded.refresh_interval, "
+            "max_refresh_interval = excluded.max_refresh_interval, "
+            "poll_mode = excluded.poll_mode, start_time = excluded.start_time, "
+            "end_time = excluded.end_time, running = excluded.running",
+            (chat_id, *row),
+        )
+
+    def save_participant(self, chat_id: int, participant: mth.Participant) -> None:
+        """Save a participant and (all of) their user profiles"""
+        profiles = list(participant.user_profiles.values())
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO participants VALUES (?, ?, ?) ON CONFLICT (chat_id, name) "
+                "DO UPDATE SET network_id = excluded.network_id",
+                (chat_id, participant.name, participant.network_id),
+            )
+            self._connection.execute(
+                "DELETE FROM user_profiles WHERE chat_id = ? AND participant = ?",
+                (chat_id, participant.name),
+            )
+            self._connection.executemany(
+                "INSERT INTO user_profiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        chat_id,
+                        participant.name,
+                        profile.site_key,
+                        profile.user_id,
+                        profile.display_name,
+                        profile.score,
+                        _to_text(profile.last_checked),
+                    )
+                    for profile in profiles
+                ],
+            )
+            for profile in profiles:
+                key = (chat_id, participant.name, profile.site_key)
+                self._progress[key] = (profile.score, _to_text(profile.last_checked))
+
+    def save_progress(
+        self, chat_id: int, profiles: Iterable[mth.Participant.UserProfile]
+    ) -> int:
+        """Save the score and watermark of the user profiles whose progress changed
+
+        :return: number of user profiles written
+        """
+        rows = []
+        with self._lock:
+            for profile in profiles:
+                key = (chat_id, profile.participant.name, profile.site_key)
+                progress = (profile.score, _to_text(profile.last_checked))
+                if self._progress.get(key) != progress:
+                    rows.append((*progress, *key))
+                    self._progress[key] = progress
+            if rows:
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE user_profiles SET score = ?, last_checked = ? "
+                        "WHERE chat_id = ? AND participant = ? AND site_key = ?",
+                        rows,
+                    )
+        return len(rows)
+
+    def load(self) -> List[StoredSession]:
+        """Recreate every stored session and its marathon (without any API calls)"""
+        with self._lock:
+            chat_ids = self._connection.execute("SELECT chat_id FROM sessions")
+            chat_ids = [chat_id for chat_id, in chat_ids]
+            marathons = {
+                row[0]: row[1:]
+                for row in self._connection.execute("SELECT * FROM marathons")
+            }
+            participants = self._connection.execute(
+                "SELECT * FROM participants ORDER BY rowid"
+            ).fetchall()
+            profiles = self._connection.execute(
+                "SELECT * FROM user_profiles ORDER BY rowid"
+            ).fetchall()
+
+        sessions = {}
+        for chat_id in chat_ids:
+            if chat_id not in marathons:
+                sessions[chat_id] = StoredSession(chat_id, None, False)
+                continue
+            sites, duration, refresh, max_refresh, mode, start, end, running = (
+                marathons[chat_id]
+            )
+            sites = json.loads(sites)
+            marathon = mth.Marathon(
+                *sites,
+                duration=datetime.timedelta(seconds=duration),
+                refresh_interval=datetime.timedelta(seconds=refresh),
+                max_refresh_interval=datetime.timedelta(seconds=max_refresh),
+                poll_mode=mth.PollMode[mode],
+                ledger_key=str(chat_id),
+            )
+            if not sites:  # (a marathon without sites gets the default ones)
+                marathon.clear_sites()
+            marathon.start_time = _from_text(start)
+            marathon.end_time = _from_text(end)
+            sessions[chat_id] = StoredSession(chat_id, marathon, bool(running))
+
+        restored: Dict[Tuple[int, str], mth.Participant] = {}
+        for chat_id, name, network_id in participants:
+            marathon = sessions[chat_id].marathon
+            restored[chat_id, name] = mth.Participant(marathon, name, network_id)
+        for chat_id, name, site_key, user_id, display_name, score, checked in profiles:
+            participant = restored[chat_id, name]
+            profile = mth.Participant.UserProfile.restore(
+                participant, site_key, user_id, display_name, score, _from_text(checked)
+            )
+            participant.add_user_profile(profile)
+            self._progress[chat_id, name, site_key] = (score, checked)
+        for (chat_id, _), participant in restored.items():
+            participant.marathon.add_participant(participant)
+        return list(sessions.values())
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(sql, parameters)
+
+    def _forget_progress(self, chat_id: int):
+        with self._lock:
+            for key in [key for key in self._progress if key[0] == chat_id]:
+                del self._progress[key]
+
+
+def _to_text(value: Optional[datetime.datetime]) -> Optional[str]:
+    return None if value is None else value.isoformat()
+
+
+def _from_text(value: Optional[str]) -> Optional[datetime.datetime]:
+    return None if value is None else datetime.datetime.fromisoformat(value)
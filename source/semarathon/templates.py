@@ -0,0 +1,188 @@
+"""Registry of the bot's text templates, loaded once at startup
+
+The texts the bot sends (e.g. the ``/info`` reply, error replies and the status of
+a running marathon) are kept as files in the ``text`` folder: ``.md`` files are
+MarkdownV2, ``.txt`` files are plain text. The :class:`TemplateRegistry` reads the
+whole folder once (except for the secrets that are also kept there) and parses the
+``{placeholders}`` of each template, so that rendering a template doesn't touch
+the file system. :func:`load_templates` checks
+that every template the bot uses exists, with the expected placeholders, so that
+a missing or broken template makes the bot fail at startup instead of on the
+first message that uses it.
+"""
+
+import datetime
+import functools
+import os
+import string
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import telegram as tg
+
+from semarathon import markdown as md
+from semarathon.sites import ROOT_DIR
+from semarathon.utils import Text
+
+TEMPLATE_DIR = os.path.join(ROOT_DIR, "text")
+EXTENSION_PARSE_MODES = {".md": tg.ParseMode.MARKDOWN_V2, ".txt": None}
+# files in the text folder that aren't templates (see runbot.py and get_app_key)
+SECRET_NAMES = frozenset({"token", "se-app-key"})
+
+# templates used by the bot, with their placeholders
+TEMPLATE_FIELDS: Dict[str, FrozenSet[str]] = {
+    "info": frozenset(),
+    "internal-error": frozenset(),
+    "marathon-not-created": frozenset(),
+    "new-marathon": frozenset(),
+    "running-status": frozenset({"elapsed", "remaining"}),
+    "start": frozenset(),
+    "usage-error": frozenset(),
+}
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class Template:
+    """A text template, split into literal text and placeholders"""
+
+    name: str
+    parse_mode: Optional[str]
+    fields: FrozenSet[str]
+
+    def __init__(self, name: str, source: str, parse_mode: Optional[str]):
+        """Parse a template
+
+        :param name: name of the template (its file name, without the extension)
+        :param source: text of the template, with ``{field}`` placeholders
+        :param parse_mode: parse mode of the rendered text
+
+        :raises TemplateError: if a placeholder is malformed, or isn't a plain
+                               field name (format specs and conversions aren't
+                               supported)
+        """
+        self.name = name
+        self.parse_mode = parse_mode
+        try:
+            parsed = list(string.Formatter().parse(source))
+        except ValueError as exc:
+            raise TemplateError(f"Malformed template {name!r}: {exc}") from exc
+        self._parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in parsed:
+            if field is not None and (not field.isidentifier() or spec or conversion):
+                raise TemplateError(f"Unsupported placeholder in {name!r}: {field!r}")
+            self._parts.append((literal, field))
+        self.fields = frozenset(field for _, field in self._parts if field)
+        self._text = Text(source, parse_mode) if not self.fields else None
+
+    def __repr__(self):
+        return f"<Template {self.name} {sorted(self.fields)}>"
+
+    @property
+    def text(self) -> Text:
+        """The text of a template without placeholders"""
+        if self._text is None:
+            raise TemplateError(f"Template {self.name!r} has placeholders")
+        return self._text
+
+    def render(self, **values) -> Text:
+        """Fill in the placeholders
+
+        Values are converted to strings, and escaped if the template is MarkdownV2.
+
+        :raises TemplateError: if the values don't match the placeholders
+        """
+        if values.keys() != self.fields:
+            raise TemplateError(
+                f"Template {self.name!r} takes {sorted(self.fields)}, "
+                f"got {sorted(values)}"
+            )
+        if self.parse_mode == tg.ParseMode.MARKDOWN_V2:
+            values = {key: md.escape(str(value)) for key, value in values.items()}
+        rendered = "".join(
+            literal + (str(values[field]) if field else "")
+            for literal, field in self._parts
+        )
+        return Text(rendered, self.parse_mode)
+
+
+class TemplateRegistry:
+    """The text templates in a folder"""
+
+    def __init__(self, directory: str = TEMPLATE_DIR):
+        """Read and parse every template in a folder
+
+        :param directory: folder with the ``.md`` and ``.txt`` template files (if
+                          both exist for a name, the ``.md`` one is used); the
+                          files in :data:`SECRET_NAMES` are skipped
+        """
+        self.directory = directory
+        self._templates: Dict[str, Template] = {}
+        with os.scandir(directory) as entries:
+            files = [entry for entry in entries if entry.is_file()]
+        # (.md files last, so that they take precedence)
+        for entry in sorted(files, key=lambda e: e.name.endswith(".md")):
+            name, extension = os.path.splitext(entry.name)
+            if extension in EXTENSION_PARSE_MODES and name not in SECRET_NAMES:
+                with open(entry.path, encoding="utf-8") as file:
+                    source = file.read().strip()
+                parse_mode = EXTENSION_PARSE_MODES[extension]
+                self._templates[name] = Template(name, source, parse_mode)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+    def __getitem__(self, name: str) -> Template:
+        try:
+            return self._templates[name]
+        except KeyError:
+            raise TemplateError(f"No template {name!r} in {self.directory}") from None
+
+    def text(self, name: str) -> Text:
+        """The text of a template without placeholders"""
+        return self[name].text
+
+    def check(self, expected: Dict[str, Iterable[str]]) -> None:
+        """Check that the registry has the given templates, with the given fields
+
+        :param expected: placeholders expected in each template, by template name
+
+        :raises TemplateError: if any template is missing or has other placeholders
+                               (the message lists all the problems)
+        """
+        problems = []
+        for name, fields in expected.items():
+            if name not in self._templates:
+                problems.append(f"missing {name!r}")
+            elif self._templates[name].fields != frozenset(fields):
+                problems.append(
+                    f"{name!r} has placeholders {sorted(self[name].fields)}, "
+                    f"expected {sorted(fields)}"
+                )
+        if problems:
+            raise TemplateError(
+                f"Bad templates in {self.directory}: {'; '.join(problems)}"
+            )
+
+
+@functools.lru_cache(maxsize=None)
+def load_templates() -> TemplateRegistry:
+    """Get the process-wide template registry (loaded and checked on first call)
+
+    :raises TemplateError: if a template used by the bot is missing or broken
+    """
+    registry = TemplateRegistry()
+    registry.check(TEMPLATE_FIELDS)
+    return registry
+
+
+def text(name: str) -> Text:
+    """The text of a template without placeholders (e.g. ``"info"``)"""
+    return load_templates().text(name)
+
+
+def running_status(elapsed: datetime.timedelta, remaining: datetime.timedelta) -> Text:
+    return load_templates()["running-status"].render(
+        elapsed=elapsed, remaining=remaining
+    )
@@ -0,0 +1,261 @@
+"""Hierarchical timer wheel for the timed events of bot sessions
+
+Every session of the bot has a few timed events (status updates, countdowns,
+scheduled starts, etc.). Instead of one job queue entry each, they are kept on a
+single :class:`TimerWheel`: a hierarchy of circular arrays of slots, where each
+level covers :data:`SLOTS` times the span of the level below it. Timers are
+inserted into (and cancelled from) their slot in constant time, and timers that
+get close to their deadline are cascaded down to the finer levels. Timers are
+indexed by owner (e.g. a session's chat id), so that all of an owner's timers can
+be cancelled at once.
+"""
+
+import concurrent.futures
+import datetime
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set, Union
+
+SLOTS = 64  # slots per level
+LEVELS = 4  # with the default tick, the top level spans about 19 days
+DEFAULT_TICK = 0.1  # seconds
+DEFAULT_MAX_TIMER_WORKERS = 4
+
+Delay = Union[float, datetime.timedelta]
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """Handle for a timer on a :class:`TimerWheel`"""
+
+    owner: Hashable
+    callback: Callable[[], None]
+    deadline: int  # tick
+    interval: Optional[int]  # ticks
+
+    def __init__(
+        self,
+        wheel: "TimerWheel",
+        owner: Hashable,
+        callback: Callable[[], None],
+        deadline: int,
+        interval: Optional[int],
+        name: Optional[str],
+    ):
+        self._wheel = wheel
+        self.owner = owner
+        self.callback = callback
+        self.deadline = deadline
+        self.interval = interval
+        self.name = name
+        self._slot: Optional[Set["Timer"]] = None
+        self._cancelled = False
+
+    def __repr__(self):
+        return f"<Timer {self.name or self.callback} of {self.owner!r}>"
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        self._wheel.cancel(self)
+
+
+class TimerWheel:
+    """Timer wheel with constant time insertion and cancellation of timers
+
+    Due callbacks are run on a bounded pool of worker threads. Timers fire on the
+    first tick at or after their deadline, so their resolution is one tick.
+    """
+
+    def __init__(
+        self,
+        tick: float = DEFAULT_TICK,
+        executor: Optional[concurrent.futures.Executor] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialise a new (stopped) wheel
+
+        :param tick: duration of a tick (in seconds)
+        :param executor: executor on which callbacks are run (by default, a pool of
+                         :data:`DEFAULT_MAX_TIMER_WORKERS` threads)
+        :param clock: function returning the current time (in seconds)
+        """
+        self.tick = tick
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(
+            DEFAULT_MAX_TIMER_WORKERS, thread_name_prefix="SessionTimer"
+        )
+        self._clock = clock
+        self._levels: List[List[Set[Timer]]] = [
+            [set() for _ in range(SLOTS)] for _ in range(LEVELS)
+        ]
+        self._by_owner: Dict[Hashable, Set[Timer]] = {}
+        self._count = 0
+        self._current = self._now_tick()  # last tick that was processed
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self):
+        """Number of pending timers"""
+        return self._count
+
+    def schedule(
+        self,
+        owner: Hashable,
+        delay: Delay,
+        callback: Callable[[], None],
+        interval: Optional[Delay] = None,
+        name: Optional[str] = None,
+    ) -> Timer:
+        """Schedule a call
+
+        :param owner: key under which the timer is indexed (see :meth:`cancel_all`)
+        :param delay: delay until the (first) call (in seconds if given as a number);
+                      if not positive, the call is made on the next tick
+        :param callback: function to call (in one of the worker threads)
+        :param interval: if given, the call is repeated with this interval until the
+                         timer is cancelled
+        :param name: name of the timer (for logging)
+
+        :return: a handle with which the timer can be cancelled
+        """
+        with self._condition:
+            now = self._now_tick()
+            if self._count == 0:
+                self._current = max(self._current, now - 1)  # skips idle ticks
+            if interval is not None:
+                interval = max(self._to_ticks(interval), 1)
+            timer = Timer(
+                self,
+                owner,
+                callback,
+                deadline=max(self._current, now) + max(self._to_ticks(delay), 1),
+                interval=interval,
+                name=name,
+            )
+            self._by_owner.setdefault(owner, set()).add(timer)
+            self._count += 1
+            self._insert(timer)
+            self._condition.notify()
+        return timer
+
+    def cancel(self, timer: Timer) -> None:
+        with self._condition:
+            if timer._cancelled:
+                return
+            timer._cancelled = True
+            if timer._slot is not None:
+                timer._slot.discard(timer)
+                timer._slot = None
+            owned = self._by_owner.get(timer.owner)
+            if owned is not None:
+                owned.discard(timer)
+                if not owned:
+                    del self._by_owner[timer.owner]
+            self._count -= 1
+
+    def cancel_all(self, owner: Hashable) -> int:
+        """Cancel all the timers of an owner
+
+        :return: the number of timers that were cancelled
+        """
+        with self._condition:
+            timers = list(self._by_owner.get(owner, ()))
+            for timer in timers:
+                self.cancel(timer)
+            return len(timers)
+
+    def timers(self, owner: Hashable) -> List[Timer]:
+        """The pending timers of an owner"""
+        with self._condition:
+            return list(self._by_owner.get(owner, ()))
+
+    def start(self) -> None:
+        """Start the thread that runs the wheel"""
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    name="TimerWheel", target=self._run_loop, daemon=True
+                )
+                self._thread.start()
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """Process every tick up to the given time, and run the timers that are due
+
+        :param now: current time (by default, the time given by the wheel's clock)
+
+        :return: the number of timers that fired
+        """
+        target = self._now_tick(now)
+        fired = 0
+        with self._condition:
+            while self._current < target:
+                self._current += 1
+                self._cascade(self._current)
+                slot = self._levels[0][self._current % SLOTS]
+                due, slot_timers = [], list(slot)
+                slot.clear()
+                for timer in slot_timers:
+                    timer._slot = None
+                    if timer.deadline > self._current:
+                        self._insert(timer)  # (only possible if cascaded early)
+                    else:
+                        due.append(timer)
+                for timer in due:
+                    self._executor.submit(self._run, timer)
+                    if timer.interval is None:
+                        self.cancel(timer)
+                    else:
+                        timer.deadline += timer.interval
+                        self._insert(timer)
+                fired += len(due)
+        return fired
+
+    def _now_tick(self, now: Optional[float] = None) -> int:
+        return int((self._clock() if now is None else now) / self.tick)
+
+    def _to_ticks(self, delay: Delay) -> int:
+        if isinstance(delay, datetime.timedelta):
+            delay = delay.total_seconds()
+        return -int(-delay // self.tick)  # rounded up
+
+    def _insert(self, timer: Timer):
+        delta = timer.deadline - self._current
+        for level in range(LEVELS):
+            if delta < SLOTS ** (level + 1) or level == LEVELS - 1:
+                # (timers beyond the span of the wheel are cascaded again later)
+                index = min(timer.deadline, self._current + SLOTS ** (level + 1) - 1)
+                slot = self._levels[level][(index // SLOTS ** level) % SLOTS]
+                break
+        slot.add(timer)
+        timer._slot = slot
+
+    def _cascade(self, tick: int):
+        """Move down the timers of the higher level slots that start at `tick`"""
+        for level in reversed(range(1, LEVELS)):
+            if tick % SLOTS ** level == 0:
+                slot = self._levels[level][(tick // SLOTS ** level) % SLOTS]
+                timers = list(slot)
+                slot.clear()
+                for timer in timers:
+                    self._insert(timer)
+
+    def _run_loop(self):
+        with self._condition:
+            while True:
+                if self._count == 0:
+                    self._condition.wait()
+                    continue
+                self.advance()
+                next_tick = (self._current + 1) * self.tick
+                self._condition.wait(max(next_tick - self._clock(), 0))
+
+    @staticmethod
+    def _run(timer: Timer):
+        try:
+            timer.callback()
+        except Exception as exc:
+            logger.exception(f"{timer} raised an exception", exc_info=exc)
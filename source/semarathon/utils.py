@@ -1,13 +1,14 @@
 import collections.abc
-import datetime
+import contextlib
 import functools
-import logging
-import threading
-from typing import Callable, ClassVar, TypeVar, Union
+import time
+from typing import Callable, Dict, TypeVar
 
 import telegram as tg
 import telegram.ext.filters
 
+from semarathon import markdown
+
 
 def debug_print(msg: str):
     # noinspection SpellCheckingInspection
@@ -79,42 +80,6 @@ def coroutine(func: Callable):
     return start
 
 
-class StoppableThread(threading.Thread):
-    """Thread class with a stop() method. The thread itself has to check
-    regularly for the stopped() condition."""
-
-    logger: ClassVar[logging.Logger] = logging.getLogger("threading")
-
-    def __init__(self, *args, **kwargs):
-        super(StoppableThread, self).__init__(*args, **kwargs)
-        self.stop_event = threading.Event()
-
-    def stop(self):
-        self.stop_event.set()
-        self.logger.debug(f"stop_event set for thread {self}")
-
-    @property
-    def stopped(self):
-        return self.stop_event.is_set()
-
-
-class TimedStoppableThread(StoppableThread):
-    def __init__(self, duration: Union[float, datetime.timedelta], *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        if isinstance(duration, datetime.timedelta):
-            duration = duration.total_seconds()
-        self.timer = threading.Timer(duration, self.stop)
-
-    def run(self) -> None:
-        self.timer.start()
-        super().run()
-        self.logger.debug(f"End of thread {self}")
-
-    def stop(self):
-        super(TimedStoppableThread, self).stop()
-        self.timer.cancel()
-
-
 class ReadOnlyDictView(collections.abc.Mapping):
     def __init__(self, data):
         self._data = data
@@ -129,13 +94,40 @@ class ReadOnlyDictView(collections.abc.Mapping):
         return iter(self._data)
 
 
+class PhaseTimer:
+    """Measures how long each of a sequence of phases (e.g. of startup) takes"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}  # seconds, in order of first occurrence
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def summary(self) -> str:
+        """One-line breakdown, e.g. ``"12.3 ms (imports 8.1 ms, store 4.2 ms)"``"""
+        breakdown = ", ".join(
+            f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.phases.items()
+        )
+        return f"{self.total * 1000:.1f} ms ({breakdown})"
+
+
 def format_exception_md(exception) -> str:
     """Format a markdown string from an exception, to be sent through Telegram"""
     assert isinstance(exception, Exception)
     msg = "`{}`".format(type(exception).__name__)
     extra = str(exception)
     if extra:
-        msg += "`:` {}".format(extra)
+        msg += "`:` {}".format(markdown.escape(extra))
     return msg
 
 
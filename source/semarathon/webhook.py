@@ -0,0 +1,124 @@
+"""Embedded HTTP server for receiving updates from Telegram through a webhook
+
+Instead of long polling, Telegram can push updates to the bot by POSTing them (as
+JSON) to a public URL. Each request carries the secret token registered along
+with the webhook in the ``X-Telegram-Bot-Api-Secret-Token`` header; requests
+without the right token are rejected. Accepted updates are put on the
+dispatcher's update queue, exactly like updates fetched by polling.
+"""
+
+import hmac
+import http
+import http.server
+import json
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+import telegram as tg
+import telegram.ext as tge
+
+ALLOWED_UPDATES: List[str] = ["message", "inline_query"]  # the types the bot handles
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE = 1 << 20  # bytes
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """HTTP server that feeds the updates POSTed by Telegram to a dispatcher"""
+
+    dispatcher: tge.Dispatcher
+
+    def __init__(
+        self,
+        dispatcher: tge.Dispatcher,
+        secret_token: str,
+        address: Tuple[str, int] = ("0.0.0.0", 8443),
+        path: str = "/",
+    ):
+        """Initialise a new (stopped) server
+
+        :param dispatcher: dispatcher to which updates are fed
+        :param secret_token: token that Telegram must send along with each update
+                             (the one given to :meth:`telegram.Bot.set_webhook`)
+        :param address: (host, port) address to listen on
+        :param path: URL path to which Telegram posts updates
+        """
+        self.dispatcher = dispatcher
+        self.secret_token = secret_token
+        self.path = path
+        self._server = http.server.ThreadingHTTPServer(address, self._make_handler())
+        self._server.daemon_threads = True
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def server_address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> None:
+        """Start serving (and start the dispatcher if it isn't running)"""
+        if not self.dispatcher.running:
+            self._start_thread("dispatcher", self.dispatcher.start)
+        self._start_thread("webhook", self._server.serve_forever)
+        logger.info(f"Listening for updates on {self.server_address}{self.path}")
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self.dispatcher.running:
+            self.dispatcher.stop()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def process(self, secret_token: Optional[str], body: bytes) -> http.HTTPStatus:
+        """Handle the body of a request posted to the webhook
+
+        :param secret_token: secret token sent with the request (if any)
+        :param body: the request's body (an update as JSON)
+
+        :return: the status with which to answer the request
+        """
+        if secret_token is None or not hmac.compare_digest(
+            secret_token.encode(), self.secret_token.encode()
+        ):
+            logger.warning("Rejected a webhook request with a wrong secret token")
+            return http.HTTPStatus.FORBIDDEN
+        try:
+            update = tg.Update.de_json(json.loads(body), self.dispatcher.bot)
+        except (ValueError, TypeError, KeyError) as exc:
+            logger.warning(f"Rejected a malformed update: {exc}")
+            return http.HTTPStatus.BAD_REQUEST
+        if update is None:
+            return http.HTTPStatus.BAD_REQUEST
+        self.dispatcher.update_queue.put(update)
+        return http.HTTPStatus.OK
+
+    def _start_thread(self, name: str, target):
+        thread = threading.Thread(name=f"Bot:{name}", target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _make_handler(self):
+        webhook = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != webhook.path:
+                    self.send_error(http.HTTPStatus.NOT_FOUND)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                if length > MAX_BODY_SIZE:
+                    self.send_error(http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    return
+                body = self.rfile.read(length)
+                status = webhook.process(self.headers.get(SECRET_TOKEN_HEADER), body)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"{self.address_string()} - {format % args}")
+
+        return Handler
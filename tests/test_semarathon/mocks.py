@@ -1,3 +1,4 @@
+import re
 import time
 from collections import defaultdict
 from unittest import mock
@@ -12,48 +13,44 @@ def mock_target_no_participants():
 
 
 class RepDetailsMock:
-    class UserMock(stackexchange.User):
-        def __init__(self, json, site, **kwargs):
-            super().__init__(json, site, **kwargs)
-
-            rep_changes = self._get_rep_changes(site)
-
-            rep_detail_mock = MagicMock()
-            rep_detail_mock.__len__.side_effect = lambda: len(
-                self._get_rep_changes(site)
-            )
-            rep_detail_mock.__iter__.side_effect = lambda: iter(
-                self._get_rep_changes(site)
-            )
-            rep_detail_mock.__getitem__.side_effect = lambda x: self._get_rep_changes(
-                site
-            )[x]
-            rep_detail_mock.fetch.return_value = rep_detail_mock
-
-            self.reputation_detail = rep_detail_mock
-
-        @staticmethod
-        def _get_rep_changes(site):
-            rep_change_json_mock = defaultdict(MagicMock)
-            rep_change_json_mock["reputation_change"] = 10
-            rep_change_json_mock["on_date"] = int(time.time())
-            rep_change = stackexchange.RepChange(rep_change_json_mock, site)
-            rep_changes = (rep_change,)
-            return rep_changes
-
-    URL_roots_mock = stackexchange.Site.URL_Roots
-    URL_roots_mock[UserMock] = URL_roots_mock[stackexchange.User]
+    """Makes every user gain 10 reputation points on each reputation query"""
+
+    REPUTATION_URL_PATTERN = re.compile(r"users/(?P<ids>[\d;]+)/reputation")
 
     def __init__(self):
-        self.patch_user = mock.patch("stackexchange.site.User", new=self.UserMock)
-        self.patch_url_roots = mock.patch(
-            "stackexchange.site.Site.URL_Roots", new=self.URL_roots_mock
+        self.reputation_requests = []
+        original_build = stackexchange.Site.build
+
+        def build(site, url, typ, collection, kw={}):
+            match = self.REPUTATION_URL_PATTERN.fullmatch(url)
+            if match is None:
+                return original_build(site, url, typ, collection, kw)
+            user_ids = [int(user_id) for user_id in match.group("ids").split(";")]
+            self.reputation_requests.append((site.domain, user_ids))
+            return self._get_rep_changes(site, user_ids)
+
+        self.patch_build = mock.patch("stackexchange.Site.build", new=build)
+
+    @staticmethod
+    def _get_rep_changes(site, user_ids):
+        rep_changes = MagicMock()
+        rep_changes.has_more = False
+        rep_changes.__iter__.side_effect = lambda: iter(
+            [RepDetailsMock._make_rep_change(site, user_id) for user_id in user_ids]
         )
+        return rep_changes
+
+    @staticmethod
+    def _make_rep_change(site, user_id):
+        rep_change_json_mock = defaultdict(MagicMock)
+        rep_change_json_mock["user_id"] = user_id
+        rep_change_json_mock["reputation_change"] = 10
+        rep_change_json_mock["on_date"] = int(time.time())
+        return stackexchange.RepChange(rep_change_json_mock, site)
 
     def __enter__(self):
-        self.patch_url_roots.__enter__()
-        return self.patch_user.__enter__()
+        self.patch_build.__enter__()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.patch_user.__exit__()
-        self.patch_url_roots.__exit__()
+        self.patch_build.__exit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+import http.server
+import json
+import re
+import threading
+import time
+import urllib.parse
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from semarathon import aio
+from semarathon import marathon as mth
+
+
+class StubSEApiHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every reputation query with a +10 change for each user"""
+
+    PATTERN = re.compile(r"/2\.2/users/(?P<ids>[\d;]+)/reputation")
+    requests = []
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        match = self.PATTERN.fullmatch(url.path)
+        if match is None:
+            self.send_error(404)
+            return
+        user_ids = [int(user_id) for user_id in match.group("ids").split(";")]
+        self.requests.append((user_ids, urllib.parse.parse_qs(url.query)))
+        on_date = int(time.time()) + 1
+        items = [
+            {"user_id": user_id, "reputation_change": 10, "on_date": on_date}
+            for user_id in user_ids
+        ]
+        body = json.dumps({"items": items, "has_more": False}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_api_root():
+    StubSEApiHandler.requests = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubSEApiHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/2.2"
+    server.shutdown()
+
+
+def make_participant(marathon, name, user_id):
+    participant = mth.Participant(marathon, name, user_id)
+    for site in marathon.sites:
+        site_user = MagicMock(id=user_id, display_name=name)
+        site_user.site.domain = mth.SITES[site].domain
+        user_profile = mth.Participant.UserProfile(participant, site_user)
+        participant.add_user_profile(user_profile)
+    marathon.participants[name] = participant
+    return participant
+
+
+# noinspection PyPep8Naming
+class TestAsyncMarathon:
+    def test_updates_stubServer_yieldsUpdatesInParticipantOrder(self, stub_api_root):
+        async def collect():
+            async with aio.AsyncApiClient(stub_api_root, app_key="") as client:
+                marathon = aio.AsyncMarathon(
+                    "stackoverflow",
+                    "math",
+                    client=client,
+                    duration=datetime.timedelta(seconds=0.3),
+                    refresh_interval=datetime.timedelta(seconds=0.1),
+                    ledger_dir=None,
+                )
+                make_participant(marathon, "alice", 1)
+                make_participant(marathon, "bob", 2)
+                return [update async for update in marathon.updates()], marathon
+
+        updates, marathon = asyncio.run(collect())
+
+        assert not marathon.is_running
+        assert [u.participant.name for u in updates[:2]] == ["alice", "bob"]
+        assert updates[0].per_site == {"stackoverflow": 10, "math": 10}
+        assert all(len(ids) == 2 for ids, _ in StubSEApiHandler.requests)
+
+
+# noinspection PyPep8Naming
+class TestAsyncApiClient:
+    def test_get_clientCreatedOutsideLoop_concurrentRequestsLimited(
+        self, stub_api_root
+    ):
+        client = aio.AsyncApiClient(stub_api_root, app_key="", max_concurrency=1)
+
+        async def fetch_all():
+            async with client:
+                paths = [f"users/{user_id}/reputation" for user_id in range(3)]
+                return await asyncio.gather(
+                    *(client.get(path, "stackoverflow") for path in paths)
+                )
+
+        for _ in range(2):  # (each run has its own event loop)
+            results = asyncio.run(fetch_all())
+            user_ids = [[item["user_id"] for item in items] for items in results]
+            assert user_ids == [[0], [1], [2]]
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+from semarathon.digest import ScoreDigest
+from semarathon.leaderboard import Overtake
+
+
+def make_update(participant, per_site, overtakes=()):
+    return SimpleNamespace(
+        participant=participant, per_site=per_site, overtakes=list(overtakes)
+    )
+
+
+# noinspection PyPep8Naming
+class TestScoreDigest:
+    def test_add_firstUpdate_startsDigest(self):
+        digest = ScoreDigest()
+        assert digest.add(make_update("a", {"math": 10}))
+        assert not digest.add(make_update("b", {"math": 5}))
+        assert digest
+
+    def test_drain_sameParticipantAndSite_sumsIncrements(self):
+        digest = ScoreDigest()
+        digest.add(make_update("a", {"math": 10, "stackoverflow": 2}))
+        digest.add(make_update("a", {"math": 15}))
+        digest.add(make_update("b", {"tex": 5}))
+        drained = digest.drain()
+        assert drained.deltas == {
+            "a": {"math": 25, "stackoverflow": 2},
+            "b": {"tex": 5},
+        }
+        assert drained.sites == ["math", "stackoverflow", "tex"]
+        assert not digest
+
+    def test_drain_cancellingChanges_dropped(self):
+        digest = ScoreDigest()
+        digest.add(make_update("a", {"math": 10}, [Overtake("a", "b")]))
+        digest.add(make_update("a", {"math": -10}, [Overtake("b", "a")]))
+        drained = digest.drain()
+        assert drained.deltas == {} and drained.overtakes == []
@@ -0,0 +1,48 @@
+import pytest
+
+from semarathon.leaderboard import Leaderboard, Overtake
+
+
+@pytest.fixture
+def leaderboard():
+    leaderboard = Leaderboard()
+    for player in ("a", "b", "c"):
+        leaderboard.add(player)
+    return leaderboard
+
+
+# noinspection PyPep8Naming
+class TestLeaderboard:
+    def test_top_afterUpdates_sortedByScore(self, leaderboard):
+        leaderboard.update("b", 20)
+        leaderboard.update("c", 10)
+        assert leaderboard.top() == [("b", 20), ("c", 10), ("a", 0)]
+        assert leaderboard.top(2) == [("b", 20), ("c", 10)]
+
+    def test_rank_afterUpdate_reflectsScore(self, leaderboard):
+        leaderboard.update("c", 5)
+        assert [leaderboard.rank(p) for p in ("a", "b", "c")] == [2, 3, 1]
+
+    def test_update_moveUp_overtakesPassedPlayers(self, leaderboard):
+        leaderboard.update("a", 10)
+        overtakes = leaderboard.update("c", 15)
+        assert overtakes == [Overtake("c", "a"), Overtake("c", "b")]
+
+    def test_update_moveDown_overtakenByPassedPlayers(self, leaderboard):
+        overtakes = leaderboard.update("a", -5)
+        assert overtakes == [Overtake("b", "a"), Overtake("c", "a")]
+
+    def test_update_tie_firstToReachScoreStaysAhead(self, leaderboard):
+        leaderboard.update("c", 10)
+        assert leaderboard.update("b", 10) == [Overtake("b", "a")]
+        assert leaderboard.top(2) == [("c", 10), ("b", 10)]
+
+    def test_update_unchangedScore_noOvertakesAndTiePlaceKept(self, leaderboard):
+        leaderboard.update("b", 10)
+        leaderboard.update("c", 10)
+        assert leaderboard.update("b", 10) == []
+        assert leaderboard.top(2) == [("b", 10), ("c", 10)]
+
+    def test_update_unknownPlayer_addedWithoutOvertakes(self, leaderboard):
+        assert leaderboard.update("d", 100) == []
+        assert leaderboard.rank("d") == 1
@@ -0,0 +1,61 @@
+import datetime
+
+import pytest
+
+from semarathon.ledger import LedgerEntry, ReputationLedger
+
+START = datetime.datetime(2020, 1, 1, 12)
+EVENTS = [
+    LedgerEntry(START, "alice", "stackoverflow", 1, 10),
+    LedgerEntry(START + datetime.timedelta(minutes=5), "bob", "math", 2, 15),
+    LedgerEntry(START + datetime.timedelta(minutes=30), "alice", "math", 3, -2),
+    LedgerEntry(START + datetime.timedelta(minutes=65), "alice", "meta", 5, 10),
+]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = ReputationLedger(str(tmp_path / "marathon.ledger"), capacity=2)
+    for event in EVENTS:
+        ledger.append(*event)
+    yield ledger
+    ledger.close()
+
+
+# noinspection PyPep8Naming
+class TestReputationLedger:
+    def test_replay_afterGrowing_returnsEventsInOrder(self, ledger):
+        assert len(ledger) == len(EVENTS)
+        assert list(ledger.replay()) == EVENTS
+
+    def test_init_existingLedger_reopensEvents(self, ledger):
+        ledger.close()
+        reopened = ReputationLedger(ledger.path)
+        reopened.append(START, "carol", "tex", 4, 5)
+        assert list(reopened) == [*EVENTS, LedgerEntry(START, "carol", "tex", 4, 5)]
+        reopened.close()
+
+    def test_scores_recomputesTotals(self, ledger):
+        assert ledger.scores() == {"alice": 18, "bob": 15}
+        assert ledger.scores(site="math") == {"alice": -2, "bob": 15}
+
+    def test_scoresBySite_groupsByParticipantAndSite(self, ledger):
+        assert ledger.scores_by_site() == {
+            "alice": {"stackoverflow": 10, "math": -2, "meta": 10},
+            "bob": {"math": 15},
+        }
+
+    def test_timeline_hourlyWindows_sumsPerWindow(self, ledger):
+        timeline = ledger.timeline(datetime.timedelta(hours=1), START)
+        assert timeline == {START: 23, START + datetime.timedelta(hours=1): 10}
+
+    def test_select_timeRange_filtersEvents(self, ledger):
+        end = START + datetime.timedelta(minutes=30)
+        assert list(ledger.select(start=START, end=end)) == EVENTS[:2]
+
+    def test_init_notALedger_raisesValueError(self, tmp_path):
+        path = tmp_path / "bogus.ledger"
+        path.write_bytes(b"\0" * 64)
+        (tmp_path / "bogus.ledger.json").write_text('{"participants": [], "sites": []}')
+        with pytest.raises(ValueError):
+            ReputationLedger(str(path))
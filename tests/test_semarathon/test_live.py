@@ -0,0 +1,63 @@
+from semarathon.live import LiveMessage
+
+
+class FakeChat:
+    def __init__(self):
+        self.posted = []
+        self.edits = []
+        self.deferred = []
+
+    def post(self, text):
+        self.posted.append(text)
+        return len(self.posted)
+
+    def edit(self, message, text):
+        self.edits.append((message, text))
+
+    def call_later(self, delay, callback):
+        self.deferred.append((delay, callback))
+
+
+def make_live_message(chat, min_interval=0.0):
+    return LiveMessage(chat.post, chat.edit, min_interval, call_later=chat.call_later)
+
+
+# noinspection PyPep8Naming
+class TestLiveMessage:
+    def test_update_first_postsThenEdits(self):
+        chat = FakeChat()
+        live_message = make_live_message(chat)
+        live_message.update("a")
+        live_message.update("b")
+        assert chat.posted == ["a"]
+        assert chat.edits == [(1, "b")]
+
+    def test_update_unchangedText_skipped(self):
+        chat = FakeChat()
+        live_message = make_live_message(chat)
+        live_message.update("a")
+        live_message.update("a")
+        assert chat.edits == []
+        assert live_message.skipped == 1
+
+    def test_update_tooSoon_deferredAndCoalesced(self):
+        chat = FakeChat()
+        live_message = make_live_message(chat, min_interval=60)
+        live_message.update("a")
+        live_message.update("b")
+        live_message.update("c")
+        assert chat.edits == []
+        [(delay, flush)] = chat.deferred
+        assert 0 < delay <= 60
+        flush()
+        assert chat.edits == [(1, "c")]
+
+    def test_finish_pendingEdit_shownRightAway(self):
+        chat = FakeChat()
+        live_message = make_live_message(chat, min_interval=60)
+        live_message.update("a")
+        live_message.update("b")
+        live_message.finish("done")
+        [(_, flush)] = chat.deferred
+        flush()
+        assert chat.edits == [(1, "done")]
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from semarathon.mailbox import MailboxExecutor
+
+
+@pytest.fixture
+def executor():
+    return MailboxExecutor(max_workers=4)
+
+
+# noinspection PyPep8Naming
+class TestMailboxExecutor:
+    def test_submit_sameKey_runInOrderOneAtATime(self, executor):
+        calls, running = [], []
+
+        def task(i):
+            running.append(i)
+            assert len(running) == 1
+            calls.append(i)
+            running.remove(i)
+
+        futures = [executor.submit("chat", task, i) for i in range(20)]
+        for future in futures:
+            future.result(timeout=1)
+        assert calls == list(range(20))
+
+    def test_submit_otherKeyBlocked_notHeldUp(self, executor):
+        release = threading.Event()
+        blocked = executor.submit("slow", release.wait)
+        queued = executor.submit("slow", lambda: "after")
+        assert executor.submit("fast", lambda: "done").result(timeout=1) == "done"
+        assert not blocked.done()
+        assert executor.pending("slow") == 1
+        release.set()
+        assert queued.result(timeout=1) == "after"
+
+    def test_submit_taskRaises_exceptionInFutureAndNextTaskRuns(self, executor):
+        failed = executor.submit("chat", lambda: 1 / 0)
+        after = executor.submit("chat", lambda: "ok")
+        with pytest.raises(ZeroDivisionError):
+            failed.result(timeout=1)
+        assert after.result(timeout=1) == "ok"
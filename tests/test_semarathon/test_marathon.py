@@ -1,7 +1,10 @@
+import concurrent.futures
 import datetime
 import json
 import random
+import threading
 import time
+from unittest.mock import MagicMock
 
 import pytest
 import requests
@@ -26,7 +29,7 @@ def use_single_http_session(monkeypatch):
 
 @pytest.fixture
 def marathon():
-    marathon = mth.Marathon()
+    marathon = mth.Marathon(ledger_dir=None)
     yield marathon
     marathon.stop()
 
@@ -153,3 +156,394 @@ class TestMarathon:
         marathon.start(mock_target_no_participants())
         marathon.stop()
         assert not marathon.is_running
+
+    def test_poll_severalParticipants_oneRequestPerSite(self, marathon):
+        for name, user_id in (("Anakhand", 8120429), ("maxbp", 11213456)):
+            participant = mth.Participant(marathon, name, user_id)
+            for site in marathon.sites:
+                participant.add_user_profile(
+                    mth.Participant.UserProfile.restore(
+                        participant, site, user_id, name
+                    )
+                )
+            marathon.add_participant(participant)
+        with RepDetailsMock() as rep_details_mock:
+            marathon.start(mock_target_no_participants())
+            time.sleep(1)
+            updates = list(marathon.poll())
+
+        assert len(rep_details_mock.reputation_requests) == len(marathon.sites)
+        assert [u.participant.name for u in updates] == ["Anakhand", "maxbp"]
+        for update in updates:
+            assert update.per_site == {site: 10 for site in marathon.sites}
+
+    def test_reschedule_noChanges_backsOffUpToMax(self):
+        marathon = mth.Marathon(
+            "stackoverflow",
+            refresh_interval=datetime.timedelta(minutes=1),
+            max_refresh_interval=datetime.timedelta(minutes=5),
+        )
+        participant = mth.Participant(marathon, "Anakhand", 8120429)
+        site_user = MagicMock(id=1)
+        site_user.site.domain = "stackoverflow.com"
+        profile = mth.Participant.UserProfile(participant, site_user)
+        now = datetime.datetime.now()
+
+        intervals = []
+        for _ in range(5):
+            assert profile.is_due(now)
+            profile.reschedule(now, changed=False)
+            intervals.append(profile._next_poll - now)
+            now = profile._next_poll
+        profile.reschedule(now, changed=True)
+
+        assert intervals == [datetime.timedelta(minutes=m) for m in (1, 2, 4, 5, 5)]
+        assert not profile.is_due(now)
+        assert profile.is_due(now + datetime.timedelta(minutes=1))
+
+    def test_poll_sameUserInTwoMarathons_fetchedOnce(self):
+        marathons = [mth.Marathon("stackoverflow", ledger_dir=None) for _ in range(2)]
+        for marathon in marathons:
+            participant = mth.Participant(marathon, "Anakhand", 8120429)
+            site_user = MagicMock(id=1)
+            site_user.site.domain = "stackoverflow.com"
+            participant.add_user_profile(
+                mth.Participant.UserProfile(participant, site_user)
+            )
+            marathon.participants[participant.name] = participant
+
+        with RepDetailsMock() as rep_details_mock:
+            try:
+                for marathon in marathons:
+                    marathon.start(mock_target_no_participants())
+                time.sleep(1)
+                updates = [list(marathon.poll()) for marathon in marathons]
+            finally:
+                for marathon in marathons:
+                    marathon.stop()
+
+        assert len(rep_details_mock.reputation_requests) == 1
+        assert [len(marathon_updates) for marathon_updates in updates] == [1, 1]
+
+
+# noinspection PyPep8Naming
+class TestAssociationCache:
+    @pytest.fixture
+    def associated_from_assoc(self, monkeypatch):
+        account = MagicMock()
+        account.json_ob.site_url = "https://stackoverflow.com"
+        account.json_ob.user_id = 1
+        mock = MagicMock(return_value=[account])
+        monkeypatch.setattr(mth.get_stack_auth(), "associated_from_assoc", mock)
+        return mock
+
+    def test_get_twice_fetchedOnce(self, tmp_path, associated_from_assoc):
+        cache = mth.AssociationCache(str(tmp_path / "associations.json"))
+        assert cache.get(8120429) == {"https://stackoverflow.com": 1}
+        assert cache.get(8120429) == {"https://stackoverflow.com": 1}
+        assert associated_from_assoc.call_count == 1
+
+    def test_get_newInstance_loadedFromDisk(self, tmp_path, associated_from_assoc):
+        path = str(tmp_path / "associations.json")
+        cache = mth.AssociationCache(path)
+        cache.get(8120429)
+        cache.flush()
+        assert mth.AssociationCache(path).get(8120429) == {
+            "https://stackoverflow.com": 1
+        }
+        assert associated_from_assoc.call_count == 1
+
+    def test_get_expired_fetchedAgain(self, tmp_path, associated_from_assoc):
+        cache = mth.AssociationCache(
+            str(tmp_path / "associations.json"), ttl=datetime.timedelta(0)
+        )
+        cache.get(8120429)
+        cache.get(8120429)
+        assert associated_from_assoc.call_count == 2
+
+    def test_get_severalAccounts_writtenOnceOnFlush(
+        self, tmp_path, associated_from_assoc, monkeypatch
+    ):
+        cache = mth.AssociationCache(str(tmp_path / "associations.json"))
+        save = MagicMock(wraps=cache._save)
+        monkeypatch.setattr(cache, "_save", save)
+        for network_id in range(10):
+            cache.get(network_id)
+        assert save.call_count == 0
+        cache.flush()
+        cache.flush()
+        assert save.call_count == 1
+        assert len(json.loads((tmp_path / "associations.json").read_text())) == 10
+
+
+def make_rep_change(user_id):
+    return MagicMock(json_ob=MagicMock(user_id=user_id, reputation_change=10))
+
+
+# noinspection PyPep8Naming
+class TestFetchAllReputationChanges:
+    @pytest.fixture
+    def fetch_chunk(self, monkeypatch):
+        """Fake chunk fetch that waits until every chunk has started
+
+        Chunks finish in reverse order of submission; a chunk fetch that isn't run
+        concurrently with the others breaks the barrier.
+        """
+        chunks = []
+        barrier = threading.Barrier(4, timeout=1)
+        finished = []
+
+        def fetch(site_key, user_ids, fromdate):
+            chunks.append((site_key, list(user_ids)))
+            index = barrier.wait()  # (in order of arrival)
+            time.sleep(0.02 * (barrier.parties - index))
+            finished.append((site_key, user_ids[0]))
+            return [make_rep_change(user_id) for user_id in reversed(user_ids)]
+
+        monkeypatch.setattr(mth, "_fetch_reputation_chunk", fetch)
+        fetch.chunks, fetch.finished = chunks, finished
+        return fetch
+
+    def test_executor_siteChunks_fetchedConcurrently(self, fetch_chunk):
+        user_ids = list(range(1, 2 * mth.MAX_IDS_PER_REQUEST + 1))
+        since = datetime.datetime.now()
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            changes = mth.fetch_all_reputation_changes(
+                {"stackoverflow": (user_ids, since), "math": (user_ids, since)},
+                executor,
+            )
+        assert len(fetch_chunk.chunks) == 4
+        assert {site: len(site_changes) for site, site_changes in changes.items()} == {
+            "stackoverflow": len(user_ids),
+            "math": len(user_ids),
+        }
+
+    def test_executor_chunksFinishOutOfOrder_mergedInParticipantOrder(
+        self, fetch_chunk
+    ):
+        user_ids = random.sample(range(1, 10000), 4 * mth.MAX_IDS_PER_REQUEST)
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            changes = mth.fetch_all_reputation_changes(
+                {"stackoverflow": (user_ids, datetime.datetime.now())}, executor
+            )
+        submitted = [(site, chunk[0]) for site, chunk in fetch_chunk.chunks]
+        assert fetch_chunk.finished != submitted
+        assert list(changes["stackoverflow"]) == user_ids
+        for user_id, user_changes in changes["stackoverflow"].items():
+            assert [change.json_ob.user_id for change in user_changes] == [user_id]
+
+
+class FakeTotalsApi:
+    """Stands in for the totals and detail fetches of poll cycles
+
+    Each user has a total reputation; raising it by some amount makes the next
+    detail fetch for that user return a change of that amount.
+    """
+
+    def __init__(self, monkeypatch):
+        self.totals = {}
+        self.pending = {}
+        self.totals_queries = []
+        self.detail_queries = []
+        self.fail_detail = False
+        monkeypatch.setattr(mth, "fetch_all_reputations", self.fetch_totals)
+        monkeypatch.setattr(mth, "fetch_all_reputation_changes", self.fetch_detail)
+
+    def gain(self, site, user_id, amount):
+        self.totals[site, user_id] += amount
+        self.pending[site, user_id] = self.pending.get((site, user_id), 0) + amount
+
+    def fetch_totals(self, queries, executor=None):
+        self.totals_queries.append({site: set(ids) for site, ids in queries.items()})
+        return {
+            site: {user_id: self.totals[site, user_id] for user_id in user_ids}
+            for site, user_ids in queries.items()
+        }
+
+    def fetch_detail(self, queries, executor=None):
+        self.detail_queries.append(
+            {site: set(user_ids) for site, (user_ids, _) in queries.items()}
+        )
+        if self.fail_detail:
+            raise ConnectionError("detail fetch failed")
+        changes = {}
+        for site, (user_ids, _) in queries.items():
+            changes[site] = {}
+            for user_id in user_ids:
+                amount = self.pending.pop((site, user_id), 0)
+                change = MagicMock(on_date=datetime.datetime.now())
+                change.json_ob.reputation_change = amount
+                changes[site][user_id] = [change] if amount else []
+        return changes
+
+
+# noinspection PyPep8Naming
+class TestTotalsPollMode:
+    USER_IDS = (1, 2, 3)
+
+    @pytest.fixture
+    def api(self, monkeypatch):
+        api = FakeTotalsApi(monkeypatch)
+        for user_id in self.USER_IDS:
+            api.totals["stackoverflow", user_id] = 100
+        return api
+
+    @pytest.fixture
+    def make_marathon(self, api):
+        marathons = []
+
+        def make(poll_mode=mth.PollMode.TOTALS):
+            marathon = mth.Marathon(
+                "stackoverflow",
+                refresh_interval=datetime.timedelta(minutes=1),
+                max_refresh_interval=datetime.timedelta(minutes=10),
+                poll_mode=poll_mode,
+                ledger_dir=None,
+            )
+            for user_id in self.USER_IDS:
+                participant = mth.Participant(marathon, f"user{user_id}", user_id)
+                participant.add_user_profile(
+                    mth.Participant.UserProfile.restore(
+                        participant, "stackoverflow", user_id, f"user{user_id}"
+                    )
+                )
+                marathon.add_participant(participant)
+            marathon.start(mock_target_no_participants())
+            marathons.append(marathon)
+            return marathon
+
+        yield make
+        for marathon in marathons:
+            marathon.stop()
+
+    @staticmethod
+    def profile(marathon, user_id):
+        return marathon.participants[f"user{user_id}"].user_profiles["stackoverflow"]
+
+    def test_poll_oneUserMoved_detailFetchedOnlyForMovedUser(self, api, make_marathon):
+        marathon = make_marathon()
+        api.gain("stackoverflow", 2, 10)
+        updates = list(marathon.poll())
+        assert api.detail_queries == [{"stackoverflow": {2}}]
+        assert [(u.participant.name, u.total) for u in updates] == [("user2", 10)]
+
+    def test_poll_unmovedUsers_backedOff(self, api, make_marathon):
+        marathon = make_marathon()
+        api.gain("stackoverflow", 2, 10)
+        list(marathon.poll())
+        now = datetime.datetime.now()
+        for user_id in (1, 3):
+            assert not self.profile(marathon, user_id).is_due(now)
+            assert self.profile(marathon, user_id)._poll_interval == (
+                marathon.refresh_interval
+            )
+        with freeze_time(now + marathon.refresh_interval):
+            list(marathon.poll())
+        interval = self.profile(marathon, 1)._poll_interval
+        assert interval == 2 * marathon.refresh_interval
+        assert api.detail_queries == [{"stackoverflow": {2}}]
+
+    def test_poll_detailFetchFails_retriedNextCycle(self, api, make_marathon):
+        marathon = make_marathon()
+        api.gain("stackoverflow", 2, 10)
+        api.fail_detail = True
+        with pytest.raises(ConnectionError):
+            list(marathon.poll())
+        api.fail_detail = False
+        updates = list(marathon.poll())  # (the total hasn't moved since)
+        assert api.detail_queries[-1] == {"stackoverflow": {2}}
+        assert [(u.participant.name, u.total) for u in updates] == [("user2", 10)]
+        assert not list(marathon.poll())  # (now recorded, and not due anyway)
+
+    def test_poll_detailModeShortOnQuota_fallsBackToTotals(
+        self, api, make_marathon, monkeypatch
+    ):
+        monkeypatch.setattr(mth.get_quota_tracker(), "stretch_factor", lambda: 2.0)
+        marathon = make_marathon(mth.PollMode.DETAIL)
+        assert not api.totals_queries  # (no snapshot in detail mode)
+        api.gain("stackoverflow", 2, 10)
+        assert not list(marathon.poll())  # (totals recorded, instead of the detail)
+        now = datetime.datetime.now()
+        assert api.totals_queries == [{"stackoverflow": set(self.USER_IDS)}]
+        assert not api.detail_queries
+        api.gain("stackoverflow", 3, 5)
+        with freeze_time(now + marathon.refresh_interval):
+            updates = list(marathon.poll())
+        assert api.detail_queries == [{"stackoverflow": {3}}]
+        assert [(u.participant.name, u.total) for u in updates] == [("user3", 5)]
+
+    def test_poll_detailModeQuotaRecovered_earlierChangesFetched(
+        self, api, make_marathon, monkeypatch
+    ):
+        tracker = mth.get_quota_tracker()
+        monkeypatch.setattr(tracker, "stretch_factor", lambda: 2.0)
+        marathon = make_marathon(mth.PollMode.DETAIL)
+        api.gain("stackoverflow", 2, 10)
+        list(marathon.poll())
+        now = datetime.datetime.now()
+        monkeypatch.setattr(tracker, "stretch_factor", lambda: 1.0)
+        with freeze_time(now + marathon.refresh_interval):
+            updates = list(marathon.poll())
+        assert [(u.participant.name, u.total) for u in updates] == [("user2", 10)]
+
+    def test_start_totalsMode_reputationsSnapshotted(self, api, make_marathon):
+        marathon = make_marathon()
+        assert api.totals_queries == [{"stackoverflow": set(self.USER_IDS)}]
+        assert not list(marathon.poll())
+        assert not api.detail_queries
+
+
+# noinspection PyPep8Naming
+class TestFetchAllReputations:
+    def test_fetchAllReputations_manyUsers_chunkedAndMerged(self, monkeypatch):
+        requests_ = []
+
+        def users(user_ids, pagesize):
+            requests_.append(list(user_ids))
+            return [MagicMock(id=i, reputation=i * 10) for i in user_ids]
+
+        api = MagicMock()
+        api.users.side_effect = users
+        monkeypatch.setattr(mth, "get_api", lambda site_key: api)
+        user_ids = list(range(1, mth.MAX_IDS_PER_REQUEST + 51))
+        reputations = mth.fetch_all_reputations({"stackoverflow": user_ids})
+        chunk_sizes = sorted(len(chunk) for chunk in requests_)
+        assert chunk_sizes == [50, mth.MAX_IDS_PER_REQUEST]
+        assert reputations == {"stackoverflow": {i: i * 10 for i in user_ids}}
+
+
+# noinspection PyPep8Naming
+class TestMarathonLedger:
+    def test_start_resumedWithSameKey_reopensLedger(self, tmp_path):
+        marathon = mth.Marathon(
+            "stackoverflow", ledger_dir=str(tmp_path), ledger_key="42"
+        )
+        marathon.start(mock_target_no_participants())
+        marathon.ledger.append(datetime.datetime.now(), "alice", "stackoverflow", 1, 10)
+        marathon.stop()
+        assert marathon.ledger._file.closed
+
+        resumed = mth.Marathon(
+            "stackoverflow", ledger_dir=str(tmp_path), ledger_key="42"
+        )
+        resumed.start(mock_target_no_participants(), start_time=marathon.start_time)
+        try:
+            assert resumed.ledger.path == marathon.ledger.path
+            assert len(resumed.ledger) == 1
+        finally:
+            resumed.stop()
+        assert len(list(tmp_path.glob("*.ledger"))) == 1
+
+
+# noinspection PyPep8Naming
+class TestUserProfile:
+    def test_restore_sameState_sameAttributesAsInit(self):
+        marathon = mth.Marathon("stackoverflow", ledger_dir=None)
+        participant = mth.Participant(marathon, "Anakhand", 8120429)
+        site_user = MagicMock(id=1, display_name="Anakhand")
+        site_user.site.domain = "stackoverflow.com"
+        created = mth.Participant.UserProfile(participant, site_user)
+        restored = mth.Participant.UserProfile.restore(
+            participant, "stackoverflow", 1, "Anakhand"
+        )
+        assert vars(restored) == vars(created)
@@ -0,0 +1,60 @@
+import collections
+import glob
+
+import pytest
+
+from semarathon import markdown as md
+
+
+# noinspection PyPep8Naming
+class TestEscape:
+    def test_escape_reservedChars_allEscaped(self):
+        escaped = md.escape("a_b*c [d](e) 1.5-2! \\")
+        assert escaped == r"a\_b\*c \[d\]\(e\) 1\.5\-2\! \\"
+        md.validate(escaped)
+
+    def test_escape_pre_onlyBackticksAndBackslashes(self):
+        assert md.escape("a_b `c` \\", entity_type="pre") == r"a_b \`c\` \\"
+
+    def test_unescape_escapedText_original(self):
+        text = "Winner: x_y (+10)!"
+        assert md.unescape(md.escape(text)) == text
+
+
+# noinspection PyPep8Naming
+class TestValidate:
+    @pytest.mark.parametrize(
+        "text",
+        [
+            r"*bold* _italic_ __underline__ ~strike~ ||spoiler||",
+            r"*bold _italic bold_ still bold*",
+            r"[link text](https://example.com/a_b-c.d)",
+            "`code with * and _` and\n```\npre block *\n```",
+            "> quote\nthen text\\.",
+        ],
+    )
+    def test_validate_wellFormed_passes(self, text):
+        md.validate(text)
+
+    @pytest.mark.parametrize(
+        "text, position",
+        [
+            ("3 minutes remaining!", 19),
+            ("*unclosed bold", 14),
+            ("*bold _italic* text_", 13),
+            ("[text] without url", 5),
+            ("`unclosed code", 1),
+            ("trailing backslash \\", 19),
+        ],
+    )
+    def test_validate_malformed_raisesAtPosition(self, text, position):
+        with pytest.raises(md.MarkdownError) as exc_info:
+            md.validate(text)
+        assert exc_info.value.position == position
+
+    @pytest.mark.parametrize("path", glob.glob("text/*.md"))
+    def test_validate_textFiles_wellFormed(self, path):
+        with open(path, encoding="utf-8") as file:
+            text = file.read().strip()
+        # some texts are templates
+        md.validate(text.format_map(collections.defaultdict(str)))
@@ -0,0 +1,91 @@
+from semarathon.notifications import Backpressure, UpdateQueue
+from semarathon.utils import coroutine
+
+
+class FakeUpdate:
+    def __init__(self, participant, **per_site):
+        self.participant = participant
+        self.per_site = per_site
+
+    def merge(self, other):
+        for site, increment in other.per_site.items():
+            self.per_site[site] = self.per_site.get(site, 0) + increment
+        return self
+
+
+class ManualExecutor:
+    """Executor that only runs submitted calls when told to"""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn):
+        self.calls.append(fn)
+
+    def run(self):
+        while self.calls:
+            self.calls.pop(0)()
+
+
+class Consumer:
+    def __init__(self):
+        self.received = []
+        self.closed = False
+        self.handler = self._handle()
+
+    @coroutine
+    def _handle(self):
+        try:
+            while True:
+                self.received.append((yield))
+        except GeneratorExit:
+            self.closed = True
+
+
+def make_queue(max_size=64, policy=Backpressure.COALESCE):
+    consumer, executor = Consumer(), ManualExecutor()
+    queue = UpdateQueue(consumer.handler, max_size, policy, executor=executor)
+    return queue, consumer, executor
+
+
+# noinspection PyPep8Naming
+class TestUpdateQueue:
+    def test_put_severalUpdates_deliveredInOrder(self):
+        queue, consumer, executor = make_queue()
+        updates = [FakeUpdate(name, so=1) for name in "abc"]
+        for update in updates:
+            queue.put(update)
+        assert consumer.received == []
+        executor.run()
+        assert consumer.received == updates
+        assert queue.metrics.delivered == 3
+        assert queue.metrics.max_depth == 3
+
+    def test_put_fullCoalesce_mergedIntoQueuedUpdate(self):
+        queue, consumer, executor = make_queue(max_size=2)
+        queue.put(FakeUpdate("a", so=1))
+        queue.put(FakeUpdate("b", so=2))
+        queue.put(FakeUpdate("a", so=3, math=4))
+        executor.run()
+        assert [u.participant for u in consumer.received] == ["a", "b"]
+        assert consumer.received[0].per_site == {"so": 4, "math": 4}
+        assert queue.metrics.coalesced == 1
+        assert queue.metrics.dropped == 0
+
+    def test_put_fullDropOldest_oldestDropped(self):
+        queue, consumer, executor = make_queue(2, Backpressure.DROP_OLDEST)
+        for name in "abc":
+            queue.put(FakeUpdate(name, so=1))
+        executor.run()
+        assert [u.participant for u in consumer.received] == ["b", "c"]
+        assert queue.metrics.dropped == 1
+
+    def test_close_pendingUpdates_deliveredBeforeClosingHandler(self):
+        queue, consumer, executor = make_queue()
+        queue.put(FakeUpdate("a", so=1))
+        queue.close()
+        assert not queue.join(0)
+        executor.run()
+        assert len(consumer.received) == 1
+        assert consumer.closed
+        assert queue.join(0)
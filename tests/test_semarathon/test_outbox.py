@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from semarathon.outbox import Outbox, Priority, TokenBucket
+
+
+class FloodError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+@pytest.fixture
+def outbox():
+    return Outbox(global_rate=1000, chat_rate=20, max_workers=2)
+
+
+# noinspection PyPep8Naming
+class TestTokenBucket:
+    def test_delay_afterBurst_waitsForRefill(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        now = time.monotonic()
+        bucket.consume(now)
+        bucket.consume(now)
+        assert bucket.delay(now) == pytest.approx(0.5)
+        assert bucket.delay(now + 0.5) == 0
+
+
+# noinspection PyPep8Naming
+class TestOutbox:
+    def test_submit_sameChat_sentInOrderOfPriority(self, outbox):
+        sent = []
+        gate = threading.Event()
+        outbox.submit(1, gate.wait)  # holds the chat while the rest are queued
+        outbox.submit(1, lambda: sent.append("status"), Priority.LOW)
+        outbox.submit(1, lambda: sent.append("reply"))
+        outbox.submit(1, lambda: sent.append("countdown"), Priority.HIGH)
+        gate.set()
+        assert outbox.flush(timeout=2)
+        assert sent == ["countdown", "reply", "status"]
+
+    def test_submit_chatRate_messagesSpacedOut(self, outbox):
+        sent_at = []
+        for _ in range(3):
+            outbox.submit(1, lambda: sent_at.append(time.monotonic()))
+        assert outbox.flush(timeout=2)
+        assert sent_at[2] - sent_at[0] >= 2 / 20 * 0.9
+
+    def test_submit_retryAfter_resentAfterPause(self, outbox):
+        attempts = []
+
+        def send():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise FloodError(0.1)
+            return "sent"
+
+        future = outbox.submit(1, send)
+        assert future.result(timeout=2) == "sent"
+        assert attempts[1] - attempts[0] >= 0.1
+
+    def test_submit_sendRaises_futureHasException(self, outbox):
+        def send():
+            raise ValueError("bad request")
+
+        with pytest.raises(ValueError):
+            outbox.submit(1, send).result(timeout=1)
+        assert outbox.depth == 0
+
+    def test_submitAfter_higherPriorityThanAwaited_sentAfterIt(self, outbox):
+        sent = []
+        gate = threading.Event()
+        outbox.submit(1, gate.wait)  # holds the chat while the rest are queued
+        posted = outbox.submit(
+            1, lambda: sent.append("post") or "message", Priority.LOW
+        )
+        edited = outbox.submit_after(
+            posted, 1, lambda message: sent.append(f"edit {message}"), Priority.HIGH
+        )
+        gate.set()
+        edited.result(timeout=2)
+        assert sent == ["post", "edit message"]
+
+    def test_submitAfter_awaitedFails_notSent(self, outbox):
+        def send():
+            raise ValueError("bad request")
+
+        sent = []
+        posted = outbox.submit(1, send)
+        edited = outbox.submit_after(posted, 1, sent.append)
+        with pytest.raises(ValueError):
+            edited.result(timeout=1)
+        assert not sent
@@ -0,0 +1,69 @@
+import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from semarathon.quota import MAX_STRETCH_FACTOR, QuotaTracker
+
+
+def make_running_marathon(remaining, refresh_interval, requests_per_cycle):
+    now = datetime.datetime.now()
+    return MagicMock(
+        is_running=True,
+        end_time=now + remaining,
+        refresh_interval=refresh_interval,
+        requests_per_cycle=requests_per_cycle,
+    )
+
+
+@pytest.fixture
+def tracker():
+    return QuotaTracker(reserve_fraction=0)
+
+
+# noinspection PyPep8Naming
+class TestQuotaTracker:
+    def test_stretchFactor_noObservations_one(self, tracker):
+        assert tracker.stretch_factor() == 1
+
+    def test_stretchFactor_enoughQuota_one(self, tracker):
+        marathon = make_running_marathon(
+            datetime.timedelta(minutes=10), datetime.timedelta(minutes=1), 5
+        )
+        tracker.register(marathon)
+        tracker.observe(1000, 10000)
+        assert tracker.stretch_factor() == 1
+
+    def test_stretchFactor_notEnoughQuota_demandOverAvailable(self, tracker):
+        marathon = make_running_marathon(
+            datetime.timedelta(minutes=10), datetime.timedelta(seconds=1), 1
+        )
+        tracker.register(marathon)
+        tracker.observe(100, 10000)
+        now = datetime.datetime.now()
+        demand = tracker.projected_demand(now)
+        assert demand == pytest.approx(600, rel=0.01)
+        assert tracker.stretch_factor(now) == pytest.approx(demand / 100)
+
+    def test_stretchFactor_quotaExhausted_capped(self, tracker):
+        tracker.register(
+            make_running_marathon(
+                datetime.timedelta(hours=1), datetime.timedelta(seconds=1), 1
+            )
+        )
+        tracker.observe(0, 10000)
+        assert tracker.stretch_factor() == MAX_STRETCH_FACTOR
+
+    def test_unregister_marathon_noDemand(self, tracker):
+        marathon = make_running_marathon(
+            datetime.timedelta(hours=1), datetime.timedelta(seconds=1), 1
+        )
+        tracker.register(marathon)
+        tracker.unregister(marathon)
+        assert tracker.projected_demand() == 0
+
+    def test_projectedDemand_zeroRefreshInterval_leftOut(self, tracker):
+        tracker.register(
+            make_running_marathon(datetime.timedelta(hours=1), datetime.timedelta(0), 1)
+        )
+        assert tracker.projected_demand() == 0
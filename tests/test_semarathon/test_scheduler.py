@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+from semarathon import scheduler as scheduler_module
+from semarathon.scheduler import PollScheduler, configure_scheduler, get_scheduler
+
+
+@pytest.fixture
+def scheduler():
+    return PollScheduler(max_workers=2)
+
+
+# noinspection PyPep8Naming
+class TestPollScheduler:
+    def test_callLater_severalCalls_runInDeadlineOrder(self, scheduler):
+        calls = []
+        done = threading.Event()
+        scheduler.call_later(0.1, lambda: (calls.append("second"), done.set()))
+        scheduler.call_later(0.05, lambda: calls.append("first"))
+        assert done.wait(timeout=1)
+        assert calls == ["first", "second"]
+
+    def test_callLater_delay_notRunBefore(self, scheduler):
+        start = time.monotonic()
+        ran_at = []
+        done = threading.Event()
+        scheduler.call_later(0.1, lambda: (ran_at.append(time.monotonic()), done.set()))
+        assert done.wait(timeout=1)
+        assert ran_at[0] - start >= 0.1
+
+    def test_cancel_beforeDeadline_notRun(self, scheduler):
+        calls = []
+        call = scheduler.call_later(0.05, lambda: calls.append(1))
+        call.cancel()
+        time.sleep(0.1)
+        assert not calls
+
+    def test_callLater_callbackRaises_schedulerKeepsRunning(self, scheduler):
+        done = threading.Event()
+        scheduler.call_later(0, lambda: 1 / 0)
+        scheduler.call_later(0.01, done.set)
+        assert done.wait(timeout=1)
+
+
+# noinspection PyPep8Naming
+class TestConfigureScheduler:
+    def test_configureScheduler_maxFetchWorkers_sharedPoolReplaced(self):
+        previous = get_scheduler()
+        try:
+            scheduler = configure_scheduler(max_fetch_workers=3)
+            assert get_scheduler() is scheduler is not previous
+            assert scheduler.fetch_pool._max_workers == 3
+        finally:
+            scheduler_module._scheduler = previous
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from semarathon.sites import SITES_JSON_PATH, SiteCatalog
+
+with open(SITES_JSON_PATH) as db:
+    RAW_SITES = json.load(db)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return SiteCatalog(cache_path=str(tmp_path / "sites.pickle"))
+
+
+# noinspection PyPep8Naming
+class TestSiteCatalog:
+    def test_getItem_everyKey_matchesJson(self, catalog):
+        assert set(catalog) == set(RAW_SITES)
+        for key, raw_site in RAW_SITES.items():
+            assert catalog[key].name == raw_site["name"]
+            assert catalog[key].site_url == raw_site["site_url"]
+
+    def test_byUrl_aliasOrUrl_found(self, catalog):
+        assert catalog.by_url("https://stackoverflow.com").name == "Stack Overflow"
+        assert catalog.by_url("http://www.stackoverflow.com/").name == "Stack Overflow"
+        assert catalog.by_url("math.stackexchange.com").api_site_parameter == "math"
+
+    def test_byName_anyCase_found(self, catalog):
+        assert catalog.by_name("stack overflow").api_site_parameter == "stackoverflow"
+
+    def test_load_secondInstance_readsCache(self, tmp_path, monkeypatch):
+        cache_path = str(tmp_path / "sites.pickle")
+        SiteCatalog(cache_path=cache_path)["math"]
+
+        def fail(self):
+            raise AssertionError("catalog rebuilt despite valid cache")
+
+        monkeypatch.setattr(SiteCatalog, "_build", fail)
+        assert SiteCatalog(cache_path=cache_path)["math"].name == "Mathematics"
+
+    def test_load_jsonChanged_rebuildsCache(self, tmp_path):
+        path = tmp_path / "sites.json"
+        path.write_text(json.dumps({"math": RAW_SITES["math"]}))
+        cache_path = str(tmp_path / "sites.pickle")
+        assert list(SiteCatalog(str(path), cache_path)) == ["math"]
+
+        path.write_text(json.dumps({"tex": RAW_SITES["tex"]}))
+        assert list(SiteCatalog(str(path), cache_path)) == ["tex"]
+
+    @pytest.mark.parametrize(
+        ["query", "expected"],
+        argvalues=[
+            ("math", "math"),
+            ("stackoverf", "stackoverflow"),
+            ("Server Fault", "serverfault"),
+            ("superuser.com", "superuser"),
+            ("mathemtics", "math"),
+            ("sprots", "sports"),
+        ],
+    )
+    def test_search_partialOrMisspelt_bestMatchFirst(self, catalog, query, expected):
+        assert catalog.search(query)[0].api_site_parameter == expected
+
+    def test_search_gibberish_noResults(self, catalog):
+        assert catalog.search("xyzzy") == []
@@ -0,0 +1,94 @@
+import datetime
+
+import pytest
+
+from semarathon import marathon as mth
+from semarathon.store import SessionStore
+
+CHAT_ID = 42
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SessionStore(str(tmp_path / "store.sqlite3"))
+    yield store
+    store.close()
+
+
+def make_marathon():
+    marathon = mth.Marathon(
+        "stackoverflow", "math", duration=datetime.timedelta(hours=2), ledger_dir=None
+    )
+    for name, network_id in (("Anakhand", 8120429), ("maxbp", 1234)):
+        participant = mth.Participant(marathon, name, network_id)
+        for site in marathon.sites:
+            participant.add_user_profile(
+                mth.Participant.UserProfile.restore(
+                    participant, site, network_id, name, score=0
+                )
+            )
+        marathon.add_participant(participant)
+    return marathon
+
+
+# noinspection PyPep8Naming
+class TestSessionStore:
+    def test_load_savedMarathon_restoresSettingsAndParticipants(self, store):
+        marathon = make_marathon()
+        store.save_session(CHAT_ID)
+        store.save_marathon(CHAT_ID, marathon)
+        for participant in marathon.participants.values():
+            store.save_participant(CHAT_ID, participant)
+
+        [stored] = SessionStore(store.path).load()
+
+        assert stored.chat_id == CHAT_ID and not stored.running
+        restored = stored.marathon
+        assert list(restored.sites) == ["stackoverflow", "math"]
+        assert restored.duration == datetime.timedelta(hours=2)
+        assert list(restored.participants) == ["Anakhand", "maxbp"]
+        profile = restored.participants["maxbp"].user_profiles["math"]
+        assert (profile.user_id, profile.display_name) == (1234, "maxbp")
+
+    def test_saveProgress_onlyChangedProfiles_written(self, store):
+        marathon = make_marathon()
+        store.save_session(CHAT_ID)
+        store.save_marathon(CHAT_ID, marathon)
+        for participant in marathon.participants.values():
+            store.save_participant(CHAT_ID, participant)
+        profile = marathon.participants["Anakhand"].user_profiles["math"]
+        profile.score = 25
+        profile._last_checked = datetime.datetime(2020, 1, 1, 12)
+
+        assert store.save_progress(CHAT_ID, marathon._user_profiles()) == 1
+        assert store.save_progress(CHAT_ID, marathon._user_profiles()) == 0
+
+        [stored] = SessionStore(store.path).load()
+        participant = stored.marathon.participants["Anakhand"]
+        assert participant.score == 25
+        assert participant.user_profiles["math"].last_checked == profile.last_checked
+
+    def test_load_marathonWithoutSites_noSitesRestored(self, store):
+        marathon = make_marathon()
+        marathon.clear_sites()
+        store.save_session(CHAT_ID)
+        store.save_marathon(CHAT_ID, marathon)
+
+        [stored] = SessionStore(store.path).load()
+
+        assert list(stored.marathon.sites) == []
+
+    def test_deleteSession_removesMarathon(self, store):
+        store.save_session(CHAT_ID)
+        store.save_marathon(CHAT_ID, make_marathon())
+        store.delete_session(CHAT_ID)
+        assert store.load() == []
+
+    def test_setValue_reopenedStore_valueKept(self, tmp_path):
+        path = str(tmp_path / "store.sqlite3")
+        store = SessionStore(path)
+        assert store.get_value("command-list:1") is None
+        store.set_value("command-list:1", "abc")
+        store.set_value("command-list:1", "def")
+        store.close()
+        assert SessionStore(path).get_value("command-list:1") == "def"
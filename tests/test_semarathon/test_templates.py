@@ -0,0 +1,50 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from semarathon import templates
+from semarathon.templates import TemplateError, TemplateRegistry
+
+
+def write_templates(directory, **sources):
+    for filename, source in sources.items():
+        (directory / filename.replace("_", ".")).write_text(source, encoding="utf-8")
+
+
+# noinspection PyPep8Naming
+class TestTemplateRegistry:
+    def test_check_repositoryTemplates_noProblems(self):
+        TemplateRegistry().check(templates.TEMPLATE_FIELDS)
+
+    def test_render_markdownTemplate_valuesEscaped(self, tmp_path):
+        write_templates(tmp_path, status_md="*Elapsed:* {elapsed}\n")
+        template = TemplateRegistry(str(tmp_path))["status"]
+        assert template.fields == {"elapsed"}
+        text = template.render(elapsed=datetime.timedelta(minutes=90))
+        assert text == r"*Elapsed:* 1:30:00"
+        assert text.parse_mode == "MarkdownV2"
+
+    def test_render_wrongValues_raises(self, tmp_path):
+        write_templates(tmp_path, status_txt="{elapsed}")
+        template = TemplateRegistry(str(tmp_path))["status"]
+        with pytest.raises(TemplateError):
+            template.render(remaining=1)
+
+    def test_check_missingAndWrongFields_allReported(self, tmp_path):
+        write_templates(tmp_path, info_md="Hello", status_txt="{elapsed}")
+        registry = TemplateRegistry(str(tmp_path))
+        with pytest.raises(TemplateError, match="'start'.*'status'"):
+            registry.check({"info": [], "start": [], "status": ["remaining"]})
+
+    def test_init_secretFiles_notLoaded(self, tmp_path):
+        write_templates(tmp_path, info_md="Hello", token_txt="123:abc")
+        registry = TemplateRegistry(str(tmp_path))
+        assert "info" in registry and "token" not in registry
+
+    def test_getitem_bothExtensions_markdownUsed(self, tmp_path):
+        write_templates(tmp_path, info_md=r"*Hi\!*", info_txt="Hi!")
+        text = TemplateRegistry(str(tmp_path)).text("info")
+        assert text == r"*Hi\!*"
+        assert text.parse_mode == "MarkdownV2"
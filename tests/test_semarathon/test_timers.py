@@ -0,0 +1,78 @@
+import datetime
+import random
+
+import pytest
+
+from semarathon.timers import SLOTS, TimerWheel
+
+
+class SynchronousExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def wheel(clock):
+    return TimerWheel(tick=1, executor=SynchronousExecutor(), clock=clock)
+
+
+# noinspection PyPep8Naming
+class TestTimerWheel:
+    def test_advance_timersAcrossLevels_fireAtDeadline(self, wheel):
+        fired = {}
+        delays = [1, 5, SLOTS - 1, SLOTS, SLOTS ** 2 + 3, SLOTS ** 3 * 2 + 7]
+        random.seed(0)
+        delays += random.sample(range(1, SLOTS ** 3 * 4), 50)
+        for delay in delays:
+            callback = lambda d=delay: fired.setdefault(d, wheel._current)
+            wheel.schedule("chat", delay, callback)
+        now = 0
+        while now < max(delays):
+            now += random.randint(1, SLOTS ** 2)
+            wheel.advance(now)
+        assert fired == {delay: delay for delay in delays}
+        assert len(wheel) == 0
+
+    def test_schedule_interval_repeatsUntilCancelled(self, wheel):
+        fired = []
+        timer = wheel.schedule(1, 2, lambda: fired.append(wheel._current), interval=3)
+        wheel.advance(9)
+        timer.cancel()
+        wheel.advance(20)
+        assert fired == [2, 5, 8]
+
+    def test_schedule_timedelta_convertedToTicks(self, wheel):
+        fired = []
+        wheel.schedule(1, datetime.timedelta(minutes=1), lambda: fired.append(1))
+        assert wheel.advance(59) == 0
+        assert wheel.advance(60) == 1
+
+    def test_cancelAll_severalOwners_onlyOwnersTimersCancelled(self, wheel):
+        fired = []
+        for owner in (1, 2):
+            for delay in (1, 100, 10000):
+                wheel.schedule(owner, delay, lambda o=owner: fired.append(o))
+        assert wheel.cancel_all(1) == 3
+        assert wheel.timers(1) == []
+        wheel.advance(10000)
+        assert fired == [2, 2, 2]
+
+    def test_schedule_afterIdle_delayFromNow(self, wheel, clock):
+        fired = []
+        clock.now = 1000
+        wheel.schedule(1, 5, lambda: fired.append(wheel._current))
+        wheel.advance(1010)
+        assert fired == [1005]
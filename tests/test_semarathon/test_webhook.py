@@ -0,0 +1,65 @@
+import json
+import queue
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from semarathon.webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+SECRET_TOKEN = "s3cr3t"
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 2,
+        "date": 1600000000,
+        "chat": {"id": 42, "type": "private"},
+        "text": "/start",
+    },
+}
+
+
+@pytest.fixture
+def webhook():
+    dispatcher = MagicMock(running=True, update_queue=queue.Queue(), bot=None)
+    server = WebhookServer(dispatcher, SECRET_TOKEN, ("127.0.0.1", 0), "/hook")
+    server.start()
+    yield server
+    server.stop()
+
+
+def post(webhook, body, token=SECRET_TOKEN, path="/hook"):
+    host, port = webhook.server_address
+    request = urllib.request.Request(
+        f"http://{host}:{port}{path}", data=body, method="POST"
+    )
+    if token is not None:
+        request.add_header(SECRET_TOKEN_HEADER, token)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+# noinspection PyPep8Naming
+class TestWebhookServer:
+    def test_post_validUpdate_queuedOnDispatcher(self, webhook):
+        assert post(webhook, json.dumps(UPDATE).encode()) == 200
+        update = webhook.dispatcher.update_queue.get(timeout=1)
+        assert update.update_id == 1
+        assert update.message.text == "/start"
+
+    @pytest.mark.parametrize("token", [None, "wrong"])
+    def test_post_wrongSecretToken_forbidden(self, webhook, token):
+        assert post(webhook, json.dumps(UPDATE).encode(), token=token) == 403
+        assert webhook.dispatcher.update_queue.empty()
+
+    def test_post_malformedBody_badRequest(self, webhook):
+        assert post(webhook, b"not json") == 400
+
+    def test_post_wrongPath_notFound(self, webhook):
+        assert post(webhook, json.dumps(UPDATE).encode(), path="/other") == 404